@@ -7,18 +7,35 @@ Sistema: Clínica Equilibrar ERP
 Este script descarga los datos desde Google Sheets
 y los exporta como archivos CSV para la migración.
 
+Las hojas se descargan en paralelo sobre una sesión HTTP compartida y
+cada respuesta se escribe a disco por bloques. Los validadores de cada
+hoja (ETag/Last-Modified) quedan en .export_cache.json: en la siguiente
+exportación se envían como petición condicional y las hojas que no
+cambiaron (304) no se vuelven a descargar.
+
 PREREQUISITOS:
 - Tener acceso a la URL de Google Sheets publicada
 - O usar la Google Sheets API
 
 USO:
     python 00_export_sheets_to_csv.py
+
+    # Descarga todo aunque no haya cambios
+    python 00_export_sheets_to_csv.py --force
+
+    # Otro origen (p. ej. un servidor HTTP local con fixtures: http://localhost:8000/DB_CLIENTES)
+    python 00_export_sheets_to_csv.py --base-url http://localhost:8000/
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from pathlib import Path
+import argparse
 import logging
+import json
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -40,60 +57,144 @@ SHEETS_TO_EXPORT = {
 }
 
 OUTPUT_DIR = Path('./csv_exports')
+CACHE_FILENAME = '.export_cache.json'  # Validadores HTTP por hoja, junto a los CSVs
+CHUNK_BYTES = 1 << 20  # Bloques de 1 MB al escribir la respuesta
+TIMEOUT = (10, 300)  # Segundos para conectar / entre bloques recibidos
 
 # =====================================================
 # FUNCIÓN DE EXPORTACIÓN
 # =====================================================
 
-def export_sheet_to_csv(sheet_name, output_filename):
-    """Exporta una hoja de Google Sheets a CSV"""
+def create_session(workers):
+    """Sesión HTTP con un pool de conexiones para las descargas en paralelo"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def load_cache(output_dir):
+    """Validadores (etag / last_modified) de la exportación anterior, por hoja"""
+    path = output_dir / CACHE_FILENAME
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except ValueError:
+        logger.warning(f"⚠ {path} ilegible: se descargan todas las hojas")
+        return {}
+
+def save_cache(output_dir, cache):
+    path = output_dir / CACHE_FILENAME
+    path.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding='utf-8')
+
+def export_sheet_to_csv(sheet_name, output_filename, session=None, base_url=SHEET_URL_BASE,
+                        output_dir=OUTPUT_DIR, validators=None):
+    """Exporta una hoja de Google Sheets a CSV
+
+    Retorna (estado, validadores): estado es 'descargada', 'sin cambios' o
+    None si hubo un error; validadores son los de la respuesta, para la
+    petición condicional de la próxima exportación.
+    """
+    output_path = Path(output_dir) / output_filename
+    partial_path = output_path.with_name(output_path.name + '.part')
     try:
         logger.info(f"Exportando {sheet_name}...")
-        
+
         # Construir URL
-        url = f"{SHEET_URL_BASE}{sheet_name}"
-        
-        # Descargar
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Guardar
-        output_path = OUTPUT_DIR / output_filename
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        
+        url = f"{base_url}{sheet_name}"
+
+        # Petición condicional solo si el CSV anterior sigue en disco
+        headers = {}
+        if validators and output_path.exists():
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        # Descargar por bloques a un archivo temporal; el CSV anterior se
+        # reemplaza solo si la descarga termina completa
+        with (session or requests).get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 304:
+                logger.info(f"  ↷ {sheet_name} sin cambios, se conserva {output_path}")
+                return 'sin cambios', validators
+            response.raise_for_status()
+
+            with open(partial_path, 'wb') as f:
+                for block in response.iter_content(chunk_size=CHUNK_BYTES):
+                    f.write(block)
+            os.replace(partial_path, output_path)
+
+            validators = {'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+
         logger.info(f"  ✓ Guardado en {output_path}")
-        return True
-        
+        return 'descargada', validators
+
     except Exception as e:
         logger.error(f"  ✗ Error exportando {sheet_name}: {e}")
-        return False
+        partial_path.unlink(missing_ok=True)
+        return None, None
+
+def export_sheets(sheets=SHEETS_TO_EXPORT, base_url=SHEET_URL_BASE, output_dir=OUTPUT_DIR,
+                  workers=None, force=False):
+    """Exporta las hojas en paralelo; retorna el estado de cada una (ver export_sheet_to_csv)"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # --force no envía los validadores, pero conserva los de las hojas que fallen
+    cache = load_cache(output_dir)
+    workers = max(1, workers or len(sheets))
+
+    with create_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            sheet_name: pool.submit(export_sheet_to_csv, sheet_name, filename, session, base_url,
+                                    output_dir, None if force else cache.get(sheet_name))
+            for sheet_name, filename in sheets.items()
+        }
+        results = {sheet_name: future.result() for sheet_name, future in futures.items()}
+
+    # Solo las hojas exportadas sin error actualizan la caché
+    for sheet_name, (status, validators) in results.items():
+        if status and validators and any(validators.values()):
+            cache[sheet_name] = validators
+        elif status:
+            cache.pop(sheet_name, None)
+    save_cache(output_dir, cache)
+    return {sheet_name: status for sheet_name, (status, _) in results.items()}
 
 # =====================================================
 # MAIN
 # =====================================================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exporta las hojas de Google Sheets a CSV')
+    parser.add_argument('--base-url', default=SHEET_URL_BASE,
+                        help='URL a la que se agrega el nombre de cada hoja (default: el Sheet publicado)')
+    parser.add_argument('--output-dir', default=str(OUTPUT_DIR), help='Carpeta de los CSVs')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Descargas en paralelo (default: una por hoja)')
+    parser.add_argument('--force', action='store_true',
+                        help='Descarga todas las hojas aunque no hayan cambiado')
+    args = parser.parse_args()
+
     logger.info("=" * 60)
     logger.info("EXPORTANDO GOOGLE SHEETS A CSV")
     logger.info("=" * 60)
-    
-    # Crear directorio de salida
-    OUTPUT_DIR.mkdir(exist_ok=True)
-    
-    # Exportar cada hoja
-    success_count = 0
-    for sheet_name, filename in SHEETS_TO_EXPORT.items():
-        if export_sheet_to_csv(sheet_name, filename):
-            success_count += 1
-    
+
+    # Exportar las hojas
+    results = export_sheets(base_url=args.base_url, output_dir=args.output_dir,
+                            workers=args.workers, force=args.force)
+    success_count = sum(1 for status in results.values() if status)
+    unchanged = sum(1 for status in results.values() if status == 'sin cambios')
+
     logger.info("=" * 60)
-    logger.info(f"✓ Exportación completa: {success_count}/{len(SHEETS_TO_EXPORT)} hojas")
+    logger.info(f"✓ Exportación completa: {success_count}/{len(SHEETS_TO_EXPORT)} hojas"
+                + (f" ({unchanged} sin cambios)" if unchanged else ""))
     logger.info("=" * 60)
-    
+
     print("\n📝 INSTRUCCIONES:")
-    print("1. Los archivos CSV están en: ./csv_exports/")
+    print(f"1. Los archivos CSV están en: {args.output_dir}/")
     print("2. Ahora ejecuta el schema SQL en MySQL:")
     print("   mysql -u root -p < migration/01_create_schema.sql")
     print("3. Luego ejecuta la migración ETL:")
-    print("   python migration/02_etl_migration.py --csv-path ./csv_exports")
+    print(f"   python migration/02_etl_migration.py --csv-path {args.output_dir}")
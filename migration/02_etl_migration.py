@@ -19,31 +19,86 @@ INSTALACIÓN:
 
 USO:
     python 02_etl_migration.py --csv-path ./csv_exports
+
+    # Modo streaming (memoria acotada) para exports grandes
+    python 02_etl_migration.py --csv-path ./csv_exports --chunk-rows 50000
+
+    # Retomar una corrida interrumpida desde la bitácora
+    python 02_etl_migration.py --csv-path ./csv_exports --chunk-rows 50000 --resume
+
+    # Aplicar solo los cambios desde la última corrida (o continuamente con --watch)
+    python 02_etl_migration.py --csv-path ./csv_exports --delta
+
+    # Sesión de carga: COMMIT cada 50000 filas y FK/UNIQUE verificados al final en vez de por fila
+    python 02_etl_migration.py --csv-path ./csv_exports --commit-rows 50000 --relax-checks
+
+    # Índices secundarios diferidos: se quitan antes de la carga y se reconstruyen al final, en paralelo por tabla
+    python 02_etl_migration.py --csv-path ./csv_exports --chunk-rows 50000 --defer-indexes
+
+    # Convertir los CSVs a la caché Parquet (las corridas siguientes la leen)
+    python 02_etl_migration.py --csv-path ./csv_exports --build-cache
 """
 
 import pandas as pd
+import numpy as np
 import pymysql
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, inspect, make_url, text, bindparam, table as sa_table, column as sa_column
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.exc import DBAPIError
 import logging
 from datetime import datetime, timedelta
 import re
 from pathlib import Path
 import sys
 import argparse
+import os
+import json
+import hashlib
+import tempfile
+import sqlite3
+import threading
+import time
+import csv
+import tracemalloc
+import importlib.util
+import functools
+import unicodedata
+import difflib
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import bcrypt
 
+try:
+    import resource  # RSS pico del proceso (no existe en Windows)
+except ImportError:
+    resource = None
+
+try:
+    import pyarrow as pa  # Caché columnar de los CSVs (opcional)
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 # =====================================================
 # CONFIGURACIÓN DE LOGGING
 # =====================================================
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('migration.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+LOG_PATH = 'migration.log'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+def configure_logging(log_path=LOG_PATH):
+    """migration.log (si log_path) + consola
+    
+    Se llama al ejecutar el script: los que lo importan (validador,
+    benchmark, reconciliación) configuran su propio logging y no escriben
+    en migration.log.
+    """
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_path:
+        handlers.insert(0, logging.FileHandler(log_path))
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, handlers=handlers)
+
 logger = logging.getLogger(__name__)
 
 # =====================================================
@@ -62,6 +117,110 @@ DB_CONFIG = {
 # Crear string de conexión
 connection_string = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}?charset=utf8mb4"
 
+# Máximo de valores por consulta IN (...) al resolver IDs
+ID_LOOKUP_BATCH = 5000
+
+# =====================================================
+# BD EMBEBIDA (SQLITE)
+# =====================================================
+# Traducción de 01_create_schema.sql para correr el ETL sin un
+# servidor MySQL (--target sqlite:///..., --dry-run, benchmarks). Se conservan tablas,
+# seeds, índices y CHECKs; las FKs se declaran pero SQLite no las exige.
+
+SCHEMA_PATH = Path(__file__).with_name('01_create_schema.sql')
+VERIFIER_PATH = Path(__file__).with_name('04_post_migration_verification.py')
+DRY_RUN_TARGET = 'sqlite:///:memory:'  # --dry-run
+INLINE_INDEX_PATTERN = r'^\s*INDEX (\w+) \(([^)]*)\),?\s*$'  # INDEX nombre (columnas) dentro de un CREATE TABLE
+
+def sqlite_schema(sql):
+    """Traduce el DDL MySQL del schema a una lista de sentencias SQLite"""
+    sql = re.sub(r'--[^\n]*', '', sql)
+    
+    # Los CHECK agregados con ALTER TABLE pasan a la definición de la tabla
+    checks = {}
+    for table, body in re.findall(r'ALTER TABLE (\w+)(.*?);', sql, flags=re.S):
+        checks.setdefault(table, []).extend(
+            re.findall(r'ADD (CONSTRAINT \w+ CHECK \(.*?\))\s*(?=,\s*ADD|$)', body.strip(), flags=re.S))
+    
+    statements = []
+    for stmt in sql.split(';'):
+        stmt = stmt.strip()
+        if not stmt or stmt.upper().startswith(('CREATE DATABASE', 'USE ', 'ALTER TABLE')):
+            continue
+        create = re.match(r'CREATE TABLE (\w+)', stmt)
+        if not create:
+            statements.append(stmt)
+            continue
+        
+        table = create.group(1)
+        stmt = re.sub(r"\s+COMMENT '[^']*'", '', stmt)
+        stmt = re.sub(r'\)\s*ENGINE=.*$', ')', stmt, flags=re.S)
+        stmt = stmt.replace('INT AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+        stmt = stmt.replace(' ON UPDATE CURRENT_TIMESTAMP', '')
+        # Los índices inline van como CREATE INDEX (en SQLite el nombre es global)
+        indexes = re.findall(INLINE_INDEX_PATTERN, stmt, flags=re.M)
+        stmt = re.sub(INLINE_INDEX_PATTERN + r'\n?', '', stmt, flags=re.M)
+        stmt = re.sub(r',\s*\)$', '\n)', stmt)
+        if table in checks:
+            stmt = stmt[:-1].rstrip() + ',\n    ' + ',\n    '.join(checks[table]) + '\n)'
+        statements.append(stmt)
+        statements.extend(f"CREATE INDEX {table}_{name} ON {table} ({columns})" for name, columns in indexes)
+    return statements
+
+def load_sqlite_schema(conn):
+    """Crea tablas, índices y seeds del schema en una conexión sqlite3"""
+    for stmt in sqlite_schema(SCHEMA_PATH.read_text(encoding='utf-8')):
+        conn.execute(stmt)
+    conn.commit()
+
+def create_sqlite_database(path):
+    """Crea (o reemplaza) una BD SQLite con el schema; retorna su connection string"""
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    conn = sqlite3.connect(path)
+    try:
+        load_sqlite_schema(conn)
+    finally:
+        conn.close()
+    return f"sqlite:///{path}"
+
+def run_verification(engine):
+    """Ejecuta 04_post_migration_verification.py sobre engine (p. ej. la BD en memoria del ensayo)"""
+    spec = importlib.util.spec_from_file_location('post_migration_verification', VERIFIER_PATH)
+    verifier = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(verifier)
+    return verifier.PostMigrationVerificator(engine=engine).run_all_checks()
+
+def is_memory_database(db_connection_string):
+    """True si la URL apunta a una BD SQLite en memoria"""
+    url = make_url(db_connection_string)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def create_target_engine(db_connection_string, local_infile=False, pool_size=5):
+    """Engine del destino: MySQL, archivo SQLite o SQLite en memoria
+    
+    Una BD SQLite sin tablas se crea con el schema. En memoria, cada conexión
+    nueva sería una BD vacía: se usa una sola conexión compartida (StaticPool).
+    """
+    url = make_url(db_connection_string)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(url, echo=False, pool_size=pool_size,
+                             connect_args={'local_infile': True} if local_infile else {})
+    
+    if is_memory_database(db_connection_string):
+        engine = create_engine(url, echo=False, poolclass=StaticPool,
+                               connect_args={'check_same_thread': False})
+    else:
+        engine = create_engine(url, echo=False)
+    if not inspect(engine).has_table('pacientes'):
+        conn = engine.raw_connection()
+        try:
+            load_sqlite_schema(conn)
+        finally:
+            conn.close()
+    return engine
+
 # =====================================================
 # UTILIDADES DE LIMPIEZA
 # =====================================================
@@ -133,27 +292,2020 @@ def clean_number(value):
     except:
         return 0
 
+def add_minutes(datetime_str, minutes=60):
+    """Suma minutos a un datetime 'YYYY-MM-DD HH:MM:SS'"""
+    try:
+        dt = datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S')
+        return (dt + timedelta(minutes=minutes)).strftime('%Y-%m-%d %H:%M:%S')
+    except:
+        return None
+
+# =====================================================
+# UTILIDADES DE LIMPIEZA COLUMNAR (VECTORIZADAS)
+# =====================================================
+# Equivalentes de las funciones anteriores que operan sobre
+# columnas completas (pd.Series) en lugar de fila a fila.
+# Todas retornan dtype object con None para valores nulos,
+# igual que sus versiones escalares.
+
+DATE_PATTERNS = [
+    r'\A(?P<d>[^/]*)/(?P<m>[^/]*)/(?P<y>[^/]{4})\Z',    # DD/MM/YYYY
+    r'\A(?P<d>[^-]{0,2})-(?P<m>[^-]*)-(?P<y>[^-]{4})\Z',  # DD-MM-YYYY
+]
+
+# Columnas con pocos valores distintos frente al número de filas: load_csv
+# las lee como categóricas y los limpiadores corren una vez por categoría
+CATEGORICAL_COLUMNS = {
+    'DB_CLIENTES.csv': ['COMUNA', 'ISAPRE'],
+    'DB_CONFIG_EQUIPO.csv': ['ESPECIALIDAD', 'ESTADO'],
+    'DB_ATENCIONES.csv': ['ESPECIALISTA', 'ID_SERVICIO', 'FECHA DE ATENCION', 'HORA DE ATENCION',
+                          'FECHA DE PAGO', 'ID_ESTADO',
+                          # Los montos se repiten con los precios de cada servicio
+                          'INGRESO', 'PAGO ESPECIALISTA (LIQUIDO)', 'UTILIDAD', 'IMPUESTO'],
+}
+
+def csv_dtypes(filename):
+    """dtype para read_csv: texto, salvo las columnas categóricas del archivo"""
+    return defaultdict(lambda: str, {column: 'category' for column in CATEGORICAL_COLUMNS.get(filename, [])})
+
+def per_category(cleaner):
+    """Decorador: sobre una columna categórica el limpiador corre una vez por categoría
+    
+    El resultado se reparte a las filas por sus códigos enteros; los nulos
+    (código -1) toman el último elemento, que es el limpiador aplicado a None.
+    """
+    @functools.wraps(cleaner)
+    def wrapper(series, *args, **kwargs):
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            return cleaner(series, *args, **kwargs)
+        values = pd.Series(np.append(series.cat.categories.to_numpy(dtype=object), None), dtype=object)
+        cleaned = cleaner(values, *args, **kwargs)
+        return pd.Series(cleaned.to_numpy()[series.cat.codes.to_numpy()], index=series.index, dtype=cleaned.dtype)
+    return wrapper
+
+def get_column(df, name):
+    """Retorna la columna del CSV o una columna vacía si no existe"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(None, index=df.index, dtype=object)
+
+def _non_empty(series):
+    """Máscara de valores no nulos y distintos de ''"""
+    return series.notna() & (series.astype(str) != '')
+
+def _nullable(series, mask):
+    """Convierte a object dejando None donde la máscara es False"""
+    return series.astype(object).where(mask & series.notna(), None)
+
+@per_category
+def clean_text_series(series):
+    """Versión columnar de clean_text"""
+    text = series.astype(str).str.strip()
+    return _nullable(text, _non_empty(series) & (text != ''))
+
+@per_category
+def title_case_series(series):
+    """Versión columnar de title_case"""
+    text = series.astype(str).str.strip().str.title()
+    return _nullable(text, _non_empty(series))
+
+@per_category
+def clean_rut_series(series):
+    """Versión columnar de clean_rut"""
+    text = (series.astype(str)
+            .str.replace('.', '', regex=False)
+            .str.replace('-', '', regex=False)
+            .str.upper())
+    return clean_text_series(text.where(_non_empty(series)))
+
+@per_category
+def parse_date_series(series):
+    """Versión columnar de parse_date"""
+    text = series.astype(str)
+    pending = _non_empty(series)
+    result = pd.Series(None, index=series.index, dtype=object)
+
+    for pattern in DATE_PATTERNS:
+        parts = text.str.extract(pattern)
+        hit = pending & parts['y'].notna()
+        iso = parts['y'] + '-' + parts['m'].str.zfill(2) + '-' + parts['d'].str.zfill(2)
+        result = result.mask(hit, iso)
+        pending &= ~hit
+
+    # Si ya está en formato YYYY-MM-DD
+    hit = pending & (text.str.len() == 10) & (text.str[4] == '-')
+    result = result.mask(hit, text)
+
+    return _nullable(result, result.notna())
+
+def parse_datetime_series(date_series, time_series):
+    """Versión columnar de parse_datetime"""
+    date = parse_date_series(date_series)
+    time = clean_text_series(time_series)
+    has_time = time.notna() & time.astype(str).str.contains(':', regex=False)
+    time = time.where(has_time, '00:00')
+
+    return _nullable(date.astype(str) + ' ' + time + ':00', date.notna())
+
+@per_category
+def clean_number_series(series):
+    """Versión columnar de clean_number (retorna int64)"""
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.astype(float)
+        fallback = pd.Series(False, index=series.index)
+    else:
+        text = (series.astype(str)
+                .str.replace(',', '', regex=False)
+                .str.replace('$', '', regex=False)
+                .str.strip())
+        values = pd.to_numeric(text.where(_non_empty(series)), errors='coerce')
+        # Valores que float() acepta pero to_numeric no (p. ej. '1_000')
+        fallback = values.isna() & _non_empty(series)
+
+    values = values.where(np.isfinite(values), 0)
+    result = np.trunc(values).astype('int64')
+
+    if fallback.any():
+        result[fallback] = series[fallback].map(clean_number)
+    return result
+
+def add_minutes_series(series, minutes=60):
+    """Versión columnar de add_minutes"""
+    parsed = pd.to_datetime(series, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    shifted = parsed + pd.Timedelta(minutes=minutes)
+    result = _nullable(shifted.dt.strftime('%Y-%m-%d %H:%M:%S'), parsed.notna())
+
+    # Fuera del rango de pd.Timestamp/datetime u otros casos que strptime sí acepta
+    fallback = (parsed.isna() | (shifted.dt.year > 9999)) & series.notna()
+    if fallback.any():
+        result[fallback] = series[fallback].map(lambda v: add_minutes(v, minutes))
+    return result
+
+@per_category
+def parse_int_series(series):
+    """Convierte una columna a entero como int(); None donde int() fallaría"""
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.astype(float)
+        valid = np.isfinite(values)
+    else:
+        text = series.astype(str)
+        valid = series.notna() & text.str.fullmatch(r'\s*[+-]?\d+\s*')
+        values = pd.to_numeric(text.where(valid).str.strip(), errors='coerce')
+        valid &= values.notna()
+
+    return _nullable(np.trunc(values.where(valid, 0)).astype('int64'), valid)
+
+# =====================================================
+# RUTS: DÍGITO VERIFICADOR E ÍNDICE
+# =====================================================
+# Operan sobre RUTs ya limpios (clean_rut_series: '12345678K').
+# Un RUT numérico se codifica como cuerpo * 11 + DV (K = 10) en un
+# int64: la validación es aritmética NumPy sobre columnas completas y
+# las búsquedas usan un índice hash de enteros, sin un dict de strings
+# por paciente.
+
+RUT_MAX_LENGTH = 12  # Cuerpo de hasta 11 dígitos + DV
+RUT_BLOCK = 1 << 18  # Filas por bloque de la matriz de caracteres
+
+def rut_parts(ruts):
+    """Cuerpo, DV (K = 10) y máscara de RUTs numéricos de una columna de RUTs limpios
+    
+    Un RUT es numérico si es un cuerpo de dígitos sin cero inicial seguido de
+    un DV 0-9/K; en el resto de las filas cuerpo y DV quedan en 0.
+    """
+    values = pd.Series(ruts, dtype=object)
+    body = np.zeros(len(values), dtype=np.int64)
+    dv = np.zeros(len(values), dtype=np.int64)
+    numeric = np.zeros(len(values), dtype=bool)
+    width = RUT_MAX_LENGTH + 1  # Un carácter extra delata los valores demasiado largos
+    
+    for start in range(0, len(values), RUT_BLOCK):
+        # None/NaN quedan como 'None'/'nan': no numéricos
+        text = values.iloc[start:start + RUT_BLOCK].to_numpy().astype(f'U{width}')
+        chars = text.view(np.int32).reshape(len(text), width)
+        last = np.char.str_len(text) - 1  # Posición del DV
+        
+        # Cuerpo por Horner, una columna de caracteres a la vez
+        ok = (last >= 1) & (last < RUT_MAX_LENGTH) & (chars[:, 0] != ord('0'))
+        value = np.zeros(len(text), dtype=np.int64)
+        for i in range(RUT_MAX_LENGTH - 1):
+            digit = chars[:, i] - ord('0')
+            in_body = i < last
+            ok &= ~in_body | ((digit >= 0) & (digit <= 9))
+            value = np.where(in_body, value * 10 + digit, value)
+        check = chars[np.arange(len(text)), np.maximum(last, 0)]
+        check = np.where(check == ord('K'), 10, check - ord('0'))
+        ok &= (check >= 0) & (check <= 10)
+        
+        end = start + len(text)
+        body[start:end] = np.where(ok, value, 0)
+        dv[start:end] = np.where(ok, check, 0)
+        numeric[start:end] = ok
+    return body, dv, numeric
+
+def rut_check_digit(body):
+    """DV módulo 11 de un arreglo de cuerpos de RUT (K = 10)"""
+    body = np.asarray(body, dtype=np.int64).copy()
+    total = np.zeros(len(body), dtype=np.int64)
+    weight = 2
+    while (body > 0).any():
+        total += body % 10 * weight
+        body //= 10
+        weight = 2 if weight == 7 else weight + 1
+    dv = 11 - total % 11
+    return np.where(dv == 11, 0, dv)
+
+def valid_rut_series(ruts):
+    """True donde el RUT limpio es numérico y su DV cuadra con el módulo 11"""
+    body, dv, numeric = rut_parts(ruts)
+    return pd.Series(numeric & (dv == rut_check_digit(body)), index=pd.Series(ruts).index)
+
+def encode_ruts(ruts):
+    """Clave int64 cuerpo * 11 + DV por RUT limpio; -1 si no es numérico"""
+    body, dv, numeric = rut_parts(ruts)
+    return np.where(numeric, body * 11 + dv, -1)
+
+def duplicated_ruts(ruts):
+    """Series.duplicated(keep='first') de RUTs limpios comparando claves int64"""
+    ruts = pd.Series(ruts, dtype=object)
+    keys = encode_ruts(ruts)
+    numeric = keys >= 0
+    other = ruts.notna().to_numpy() & ~numeric
+    duplicated = np.zeros(len(ruts), dtype=bool)
+    duplicated[numeric] = pd.Series(keys[numeric]).duplicated().to_numpy()
+    duplicated[other] = ruts[other].duplicated().to_numpy()
+    return pd.Series(duplicated, index=ruts.index)
+
+def sorted_keys(keys, ids):
+    """Claves ordenadas sin repetir y sus ids (con claves repetidas gana la última, como en un dict)"""
+    order = np.argsort(keys, kind='stable')
+    keys, ids = keys[order], ids[order]
+    last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+    return keys[last], ids[last]
+
+def search_keys(keys, ids, values):
+    """(ids, encontrados) de values en claves ordenadas; funciona igual sobre arreglos mapeados desde disco"""
+    if not len(keys):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    position = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+    found = keys[position] == values
+    return np.where(found, ids[position], 0), found
+
+def encode_codes(codes):
+    """Arreglo numpy de bytes UTF-8 de ancho fijo ('S') de una columna de texto sin nulos"""
+    return np.array([str(code).encode('utf-8') for code in codes], dtype='S')
+
+class CodeIndex:
+    """Índice texto → id sobre claves UTF-8 ordenadas (arreglo 'S' de ancho fijo)
+    
+    Para claves que no son RUT numérico: códigos de cliente, pasaportes.
+    Ocupa el largo de la clave más larga por entrada, sin un objeto Python
+    por clave, y se guarda tal cual en el almacén de mapas (MapStore).
+    """
+    ARRAYS = ['keys', 'ids']
+    
+    def __init__(self, codes=(), ids=()):
+        codes = pd.Series(codes, dtype=object)
+        present = codes.notna().to_numpy()
+        self.keys, self.ids = sorted_keys(encode_codes(codes[present]),
+                                          np.asarray(ids, dtype=np.int64)[present])
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.keys, index.ids = arrays['keys'], arrays['ids']
+        return index
+    
+    def arrays(self):
+        return {'keys': self.keys, 'ids': self.ids}
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def lookup(self, codes):
+        """ids (Int64, <NA> si no está) de una columna de códigos limpios"""
+        codes = pd.Series(codes, dtype=object)
+        present = codes.notna().to_numpy()
+        ids, found = search_keys(self.keys, self.ids, encode_codes(codes.where(present, '')))
+        found &= present
+        return pd.Series(pd.arrays.IntegerArray(np.where(found, ids, 0), ~found), index=codes.index)
+
+class RutIndex:
+    """Índice RUT limpio → id sobre claves int64 ordenadas (cuerpo * 11 + DV)
+    
+    Dos arreglos int64 que se buscan con searchsorted, en memoria o
+    mapeados desde el almacén de mapas (MapStore). Los valores no numéricos
+    (pasaportes, RUTs con cero inicial) van a un CodeIndex aparte. Con RUTs
+    repetidos gana el último, como en un dict.
+    """
+    ARRAYS = ['keys', 'ids', 'other_keys', 'other_ids']
+    
+    def __init__(self, ruts=(), ids=()):
+        ruts = pd.Series(ruts, dtype=object)
+        ids = np.asarray(ids, dtype=np.int64)
+        keys = encode_ruts(ruts)
+        numeric = keys >= 0
+        self.keys, self.ids = sorted_keys(keys[numeric], ids[numeric])
+        self.other = CodeIndex(ruts[~numeric], ids[~numeric])
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.keys, index.ids = arrays['keys'], arrays['ids']
+        index.other = CodeIndex.from_arrays({'keys': arrays['other_keys'], 'ids': arrays['other_ids']})
+        return index
+    
+    def arrays(self):
+        return {'keys': self.keys, 'ids': self.ids, 'other_keys': self.other.keys, 'other_ids': self.other.ids}
+    
+    def __len__(self):
+        return len(self.keys) + len(self.other)
+    
+    def lookup(self, ruts):
+        """ids (Int64, <NA> si no está) de una columna de RUTs limpios"""
+        ruts = pd.Series(ruts, dtype=object)
+        keys = encode_ruts(ruts)
+        ids, found = search_keys(self.keys, self.ids, keys)
+        found &= keys >= 0
+        result = pd.Series(pd.arrays.IntegerArray(np.where(found, ids, 0), ~found), index=ruts.index)
+        other = (keys < 0) & ruts.notna().to_numpy()
+        if len(self.other) and other.any():
+            result[other] = self.other.lookup(ruts[other])
+        return result
+
+# =====================================================
+# NOMBRES DE PROFESIONALES: ÍNDICE APROXIMADO
+# =====================================================
+# ESPECIALISTA en DB_ATENCIONES se escribe a mano y no siempre coincide
+# con el nombre de DB_CONFIG_EQUIPO (title_case): mayúsculas, tildes,
+# espacios u orden de nombre y apellido. Cada nombre distinto se resuelve
+# una sola vez contra un índice armado al inicio de la fase de citas.
+
+NAME_MATCH_THRESHOLD = 0.85  # Similitud mínima (difflib, 0-1) para aceptar un nombre aproximado
+NAME_MATCH_MARGIN = 0.05  # Ventaja mínima sobre el segundo candidato; si no, el nombre es ambiguo
+NAME_NGRAM = 3
+NAME_CANDIDATES = 5  # Candidatos con más trigramas en común que se comparan carácter a carácter
+NAME_COMMON_GRAM = 0.05  # Trigramas presentes en más de esta fracción del catálogo no sirven para acotar
+NAME_REVIEW_PREFIX = 'revision_profesionales'  # revision_profesionales_<fecha>.csv junto a migration.log
+
+def normalize_name(name, sort_tokens=True):
+    """Clave de comparación: sin tildes, en minúsculas, solo letras y dígitos, tokens ordenados
+    
+    sort_tokens=False conserva el orden cuando las columnas ya lo fijan (nombres + apellidos):
+    un error de tipeo no mueve la palabra a otra posición.
+    """
+    folded = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    tokens = re.findall(r'[a-z0-9]+', folded.lower())
+    return ' '.join(sorted(tokens) if sort_tokens else tokens)
+
+def name_ngrams(key):
+    """Trigramas de una clave normalizada (con los bordes marcados por espacios)"""
+    padded = f" {key} "
+    return {padded[i:i + NAME_NGRAM] for i in range(len(padded) - NAME_NGRAM + 1)}
+
+class NameMatcher:
+    """Resuelve nombres de texto libre contra un catálogo nombre → id
+    
+    Niveles, de más a menos confiable: 'exacto' (mismo texto), 'normalizado'
+    (misma clave de normalize_name) y 'aproximado' (similitud >= threshold y
+    al menos margin sobre el segundo candidato). Si no, 'ambiguo' o 'sin
+    coincidencia', y el id queda vacío.
+    
+    El índice invertido trigrama → claves se arma una vez. Un nombre solo se
+    cruza con las claves que comparten alguno de sus trigramas poco frecuentes,
+    y solo las NAME_CANDIDATES con más trigramas en común se comparan con
+    difflib; cada nombre distinto se resuelve una sola vez por corrida.
+    """
+    
+    def __init__(self, catalog, threshold=NAME_MATCH_THRESHOLD, margin=NAME_MATCH_MARGIN):
+        self.exact = dict(catalog)
+        self.threshold = threshold
+        self.margin = margin
+        ids = defaultdict(set)
+        self.names = {}  # clave → nombre del catálogo (para el reporte)
+        for name, id_ in self.exact.items():
+            key = normalize_name(name)
+            ids[key].add(id_)
+            self.names.setdefault(key, name)
+        self.keys = list(ids)
+        self.ids = [next(iter(found)) if len(found) == 1 else None for found in ids.values()]  # None: ambigua
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        postings = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            for gram in name_ngrams(key):
+                postings[gram].append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+        self.common_gram = max(NAME_CANDIDATES, int(NAME_COMMON_GRAM * len(self.keys)))
+        self.memo = {}  # nombre → (id, estado, similitud, nombre del catálogo)
+        self.rows = Counter()  # Filas por nombre que no coincidió exacto
+    
+    def resolve(self, name):
+        """(id, estado, similitud, nombre del catálogo) de un nombre"""
+        if name in self.memo:
+            return self.memo[name]
+        if name in self.exact:
+            match = (self.exact[name], 'exacto', 1.0, name)
+        else:
+            match = self.resolve_key(normalize_name(name))
+        self.memo[name] = match
+        return match
+    
+    def resolve_key(self, key):
+        position = self.positions.get(key)
+        if position is not None:
+            found = self.ids[position]
+            return (found, 'normalizado' if found is not None else 'ambiguo', 1.0, self.names[key])
+        
+        postings = [self.postings[gram] for gram in name_ngrams(key) if gram in self.postings]
+        if not postings:
+            return (None, 'sin coincidencia', 0.0, None)
+        # Los trigramas muy frecuentes (' an', 'ez ') traen media lista de candidatos y casi no
+        # distinguen: se cuentan solo los más raros, salvo que el nombre no tenga ninguno
+        rare = [positions for positions in postings if len(positions) <= self.common_gram]
+        postings = rare or postings
+        positions, shared = np.unique(np.concatenate(postings), return_counts=True)
+        top = positions[np.argsort(-shared, kind='stable')[:NAME_CANDIDATES]]
+        
+        # Un candidato que ni con la cota de quick_ratio llega a threshold - margin
+        # no puede ganar ni empatar: se descarta sin calcular ratio()
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        matcher.set_seq2(key)
+        scores = []
+        for position in top:
+            matcher.set_seq1(self.keys[position])
+            if matcher.real_quick_ratio() >= self.threshold - self.margin and \
+                    matcher.quick_ratio() >= self.threshold - self.margin:
+                scores.append((matcher.ratio(), position))
+        if not scores:
+            matcher.set_seq1(self.keys[top[0]])
+            return (None, 'sin coincidencia', round(matcher.ratio(), 3), self.names[self.keys[top[0]]])
+        scores.sort(key=lambda score: score[0], reverse=True)
+        best, position = scores[0]
+        second = scores[1][0] if len(scores) > 1 else 0.0
+        candidate = self.names[self.keys[position]]
+        if best < self.threshold:
+            return (None, 'sin coincidencia', round(best, 3), candidate)
+        if best - second < self.margin or self.ids[position] is None:
+            return (None, 'ambiguo', round(best, 3), candidate)
+        return (self.ids[position], 'aproximado', round(best, 3), candidate)
+    
+    def lookup(self, names):
+        """ids (Int64, <NA> si no se resolvió) de una columna de nombres limpios"""
+        counts = names.value_counts()
+        counts = counts[counts > 0]
+        for name, count in counts.items():
+            if self.resolve(name)[1] != 'exacto':
+                self.rows[name] += int(count)
+        return names.map({name: self.memo[name][0] for name in counts.index}).astype('Int64')
+    
+    def take_rows(self):
+        """Filas por nombre acumuladas desde la última llamada (procesos de --workers)"""
+        rows, self.rows = self.rows, Counter()
+        return rows
+    
+    def add_rows(self, rows):
+        """Suma filas por nombre contadas en otro proceso"""
+        for name, count in rows.items():
+            self.resolve(name)
+            self.rows[name] += count
+    
+    def review(self):
+        """Nombres que no coincidieron exacto, con su resolución y filas (para revisión manual)"""
+        return pd.DataFrame([
+            {'nombre_csv': name, 'estado': self.memo[name][1], 'profesional': self.memo[name][3],
+             'id_profesional': self.memo[name][0], 'similitud': self.memo[name][2], 'filas': count}
+            for name, count in self.rows.items()
+        ], columns=['nombre_csv', 'estado', 'profesional', 'id_profesional', 'similitud', 'filas'])
+
+# =====================================================
+# ENLACE DE REGISTROS DE PACIENTES (--link-patients)
+# =====================================================
+# DB_CLIENTES repite personas con otro formato o sin RUT; migrate_patients
+# solo descarta RUTs repetidos. El enlace arma pares candidatos por claves
+# de bloqueo (RUT sin ceros iniciales, email, teléfono, nombres o apellidos
+# + nacimiento) y por vecindario ordenado del nombre, puntúa solo esos pares
+# y une los que coinciden en grupos. Nunca compara todos contra todos.
+
+LINK_THRESHOLD = 0.8  # Puntaje mínimo de un par para enlazarlo
+LINK_NAME_MIN = 0.9  # Similitud mínima de nombres (difflib) además del puntaje
+LINK_WINDOW = 4  # Vecinos comparados en cada orden por nombre
+LINK_MAX_BLOCK = 20  # Un valor compartido por más filas (correo genérico, teléfono de la clínica) no sirve de evidencia
+LINK_WEIGHTS = {'rut': 4, 'email': 3, 'telefono': 2, 'fecha_nacimiento': 2, 'nombre': 3}
+LINK_EVIDENCE = ['rut', 'email', 'telefono', 'fecha_nacimiento']  # Un par necesita coincidir en al menos uno
+LINK_REPORT_PREFIX = 'enlace_pacientes'  # enlace_pacientes_<fecha>.csv junto a migration.log
+
+def patient_link_keys(df):
+    """Campos normalizados para comparar pacientes (None donde no hay dato)
+    
+    df trae las columnas de clean_patients. Los valores repetidos en más de
+    LINK_MAX_BLOCK filas se anulan: no distinguen a una persona.
+    """
+    def normalized(column):
+        values = df[column].astype(object)
+        key = values.map({name: normalize_name(name, sort_tokens=False) for name in pd.unique(values.dropna())})
+        return key.where(key != '')
+    
+    nombres, apellidos = normalized('nombres'), normalized('apellidos')
+    nombre = (nombres.fillna('') + ' ' + apellidos.fillna('')).str.strip()
+    telefono = df['telefono'].astype(object).str.replace(r'\D', '', regex=True).str[-8:]
+    email = df['email'].astype(object).str.strip().str.lower()
+    keys = pd.DataFrame({
+        'rut': df['rut'].astype(object).str.lstrip('0'),
+        'email': email.where(email.str.contains('@', regex=False, na=False)),
+        'telefono': telefono.where(telefono.str.len() == 8),
+        'fecha_nacimiento': df['fecha_nacimiento'].astype(object),
+        'nombre': nombre.where(nombre != ''),
+        'nombres': nombres,
+        'apellidos': apellidos,
+    }, index=df.index)
+    for column in ('email', 'telefono'):
+        counts = keys[column].map(keys[column].value_counts())
+        keys[column] = keys[column].where(counts <= LINK_MAX_BLOCK)
+    return keys.astype(object).where(keys.notna(), None)
+
+def candidate_pairs(keys):
+    """Pares (i, j) de posiciones con i < j: mismo valor en una clave de bloqueo o vecinos por nombre"""
+    n = len(keys)
+    # Nacimiento con nombres o con apellidos: un error de tipeo en uno no separa el bloque
+    blocks = [keys['rut'], keys['email'], keys['telefono']] + [
+        pd.Series([None if name is None or born is None else f'{name}|{born}'
+                   for name, born in zip(keys[column], keys['fecha_nacimiento'])], dtype=object)
+        for column in ('nombres', 'apellidos')]
+    left, right = [], []
+    for block in blocks:
+        codes = pd.Series(pd.factorize(block)[0])
+        sizes = codes.map(codes.value_counts())
+        members = codes[(codes >= 0) & (sizes > 1) & (sizes <= LINK_MAX_BLOCK)]
+        if members.empty:
+            continue
+        frame = pd.DataFrame({'bloque': members.to_numpy(), 'fila': members.index.to_numpy()})
+        pairs = frame.merge(frame, on='bloque')
+        pairs = pairs[pairs['fila_x'] < pairs['fila_y']]
+        left.append(pairs['fila_x'].to_numpy())
+        right.append(pairs['fila_y'].to_numpy())
+    
+    # Vecindario ordenado: por nombre y por nombre invertido (un error al inicio cambia el orden)
+    nombre = keys['nombre'].fillna('').to_numpy(dtype=object)
+    for order in (np.argsort(nombre, kind='stable'),
+                  np.argsort(np.array([name[::-1] for name in nombre], dtype=object), kind='stable')):
+        order = order[nombre[order] != '']
+        for offset in range(1, LINK_WINDOW + 1):
+            if offset >= len(order):
+                break
+            first, second = order[:-offset], order[offset:]
+            left.append(np.minimum(first, second))
+            right.append(np.maximum(first, second))
+    
+    if not left:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    codes = np.unique(np.concatenate(left).astype(np.int64) * n + np.concatenate(right))
+    return codes // n, codes % n
+
+def score_pairs(keys, left, right):
+    """Puntaje 0-1 de cada par y máscara de pares enlazados
+    
+    Promedio ponderado (LINK_WEIGHTS) de los campos presentes en ambos; el
+    nombre aporta su similitud. Dos RUTs distintos nunca se enlazan, y un
+    par necesita coincidir en un campo de LINK_EVIDENCE y tener nombres
+    parecidos (LINK_NAME_MIN): un nombre común no basta.
+    """
+    score = np.zeros(len(left))
+    weight = np.zeros(len(left))
+    evidence = np.zeros(len(left), dtype=bool)
+    for column in LINK_EVIDENCE:
+        values = keys[column].to_numpy(dtype=object)
+        a, b = values[left], values[right]
+        present = pd.notna(a) & pd.notna(b)
+        agree = present & (a == b)
+        score += LINK_WEIGHTS[column] * agree
+        weight += LINK_WEIGHTS[column] * present
+        evidence |= agree
+    rut = keys['rut'].to_numpy(dtype=object)
+    conflict = pd.notna(rut[left]) & pd.notna(rut[right]) & (rut[left] != rut[right])
+    
+    # difflib solo para los pares que todavía pueden enlazarse
+    nombre = keys['nombre'].to_numpy(dtype=object)
+    similarity = np.zeros(len(left))
+    pending = np.flatnonzero(evidence & ~conflict & pd.notna(nombre[left]) & pd.notna(nombre[right]))
+    for i in pending:
+        a, b = nombre[left[i]], nombre[right[i]]
+        similarity[i] = 1.0 if a == b else difflib.SequenceMatcher(None, a, b).ratio()
+    named = pd.notna(nombre[left]) & pd.notna(nombre[right])
+    score += LINK_WEIGHTS['nombre'] * similarity
+    weight += LINK_WEIGHTS['nombre'] * named
+    
+    score = np.divide(score, weight, out=np.zeros(len(left)), where=weight > 0)
+    score[conflict] = 0.0
+    linked = evidence & ~conflict & (similarity >= LINK_NAME_MIN) & (score >= LINK_THRESHOLD)
+    return score, linked
+
+def connected_components(n, left, right):
+    """Etiqueta de grupo (la menor posición del grupo) de n nodos unidos por los pares dados"""
+    labels = np.arange(n)
+    while len(left):
+        smaller = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smaller)
+        np.minimum.at(updated, right, smaller)
+        updated = updated[updated]  # Salto de punteros: cada nodo apunta a la etiqueta de su etiqueta
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels
+
+def link_patients(df):
+    """Agrupa los registros de la misma persona; retorna un DataFrame por fila enlazada
+    
+    Columnas: grupo (índice de la primera fila del grupo), similitud (el
+    mejor puntaje de la fila con otra del grupo), canonico y accion.
+    'fusionar' si el grupo tiene a lo sumo un RUT: el canónico es la fila
+    con RUT (o la más completa, o la primera) y las demás se descartan.
+    'revisar' si el grupo junta RUTs distintos: no se toca (las citas
+    referencian cada RUT) y queda en el reporte.
+    """
+    keys = patient_link_keys(df)
+    left, right = candidate_pairs(keys)
+    score, linked = score_pairs(keys, left, right)
+    left, right, score = left[linked], right[linked], score[linked]
+    labels = connected_components(len(df), left, right)
+    
+    best = np.zeros(len(df))
+    np.maximum.at(best, left, score)
+    np.maximum.at(best, right, score)
+    enlazadas = np.bincount(labels, minlength=len(df))[labels] > 1
+    members = df[enlazadas]
+    if members.empty:
+        return pd.DataFrame(columns=['grupo', 'similitud', 'canonico', 'accion'])
+    
+    result = pd.DataFrame({
+        'grupo': df.index[labels[enlazadas]],
+        'similitud': best[enlazadas].round(3),
+        'con_rut': members['rut'].notna().to_numpy(),
+        'completos': members.notna().sum(axis=1).to_numpy(),
+    }, index=members.index)
+    ruts = members['rut'].groupby(result['grupo']).nunique()
+    result['accion'] = np.where(result['grupo'].map(ruts) > 1, 'revisar', 'fusionar')
+    ordered = result.sort_values(['grupo', 'con_rut', 'completos'], ascending=[True, False, False], kind='stable')
+    result['canonico'] = False
+    result.loc[ordered.groupby('grupo').head(1).index, 'canonico'] = True
+    return result[['grupo', 'similitud', 'canonico', 'accion']]
+
+def merge_linked_patients(df, links):
+    """Aplica los grupos 'fusionar': deja solo el canónico, completando sus campos vacíos con los del grupo"""
+    merged = links[links['accion'] == 'fusionar']
+    if merged.empty:
+        return df
+    # El canónico primero; después las demás filas en su orden del CSV
+    ordered = merged.sort_values(['grupo', 'canonico'], ascending=[True, False], kind='stable')
+    filled = df.loc[ordered.index].groupby(ordered['grupo'].to_numpy(), sort=False).first()
+    filled.index = ordered.index[ordered['canonico']]
+    kept = df.index.drop(merged.index[~merged['canonico']])
+    return pd.concat([df.drop(merged.index), filled]).loc[kept]
+
+def canonical_rows(links):
+    """Fila canónica de cada fila fusionada (índice: la fila omitida)"""
+    merged = links[links['accion'] == 'fusionar']
+    canonical = merged[merged['canonico']]
+    return merged.loc[~merged['canonico'], 'grupo'].map(pd.Series(canonical.index, index=canonical['grupo']))
+
+# =====================================================
+# HASH DE PASSWORDS TEMPORALES
+# =====================================================
+
+TEMP_PASSWORD = b'temp1234'
+BCRYPT_ROUNDS = 12  # Mismo costo que bcrypt.gensalt() por defecto
+
+def hash_password(rounds=BCRYPT_ROUNDS):
+    """Hash bcrypt del password temporal con un salt nuevo"""
+    return bcrypt.hashpw(TEMP_PASSWORD, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def hash_passwords(count, rounds=BCRYPT_ROUNDS, workers=1):
+    """Genera count hashes bcrypt repartidos en un pool de procesos"""
+    if count <= 1 or workers <= 1:
+        return [hash_password(rounds) for _ in range(count)]
+    with ProcessPoolExecutor(max_workers=min(workers, count)) as pool:
+        return list(pool.map(hash_password, [rounds] * count, chunksize=max(1, count // (workers * 4))))
+
+# =====================================================
+# ESCRITORES (BACKENDS DE CARGA)
+# =====================================================
+# Todas las fases escriben a través de un TableWriter. El
+# mapeo tabla/columnas lo define el DataFrame que se escribe;
+# el backend solo decide cómo llegan las filas a la base.
+# Con una BulkLoadSession la transacción es la de la sesión.
+
+WRITE_BATCH_ROWS = 10000
+
+# Máximo de parámetros por sentencia INSERT multi-fila (SQLite admite 32766)
+MAX_STATEMENT_PARAMS = 30000
+
+def dataframe_to_records(df):
+    """Convierte un DataFrame a tuplas con tipos nativos de Python y None para nulos"""
+    values = df.astype(object).where(df.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+def _escape_infile(series):
+    """Serializa una columna al formato de LOAD DATA (ESCAPED BY '\\\\', NULL = \\N)"""
+    text = (series.astype(str)
+            .str.replace('\\', '\\\\', regex=False)
+            .str.replace('\t', '\\t', regex=False)
+            .str.replace('\n', '\\n', regex=False)
+            .str.replace('\r', '\\r', regex=False)
+            .str.replace('\0', '\\0', regex=False))
+    return text.where(series.notna(), '\\N')
+
+class TableWriter:
+    """Escribe DataFrames en tablas existentes (modo append)"""
+    name = None
+
+    def __init__(self, engine, batch_rows=WRITE_BATCH_ROWS, session=None):
+        self.engine = engine
+        self.batch_rows = batch_rows
+        self.session = session
+
+    def begin(self):
+        """Transacción de una escritura: la conexión de la sesión de carga o una propia que se confirma al salir"""
+        return self.session.connect() if self.session else self.engine.begin()
+
+    def write(self, df, table):
+        """Inserta las filas de df en table; retorna la cantidad de filas escritas"""
+        raise NotImplementedError
+
+    def write_returning_ids(self, df, table, id_column):
+        """Inserta df y retorna los ids generados alineados con df.index
+
+        Retorna None si el backend no puede garantizar los ids; en ese caso
+        el llamador debe resolverlos por clave natural.
+        """
+        self.write(df, table)
+        return None
+
+    def _autoinc_step(self, conn):
+        """auto_increment_increment del servidor (1 salvo en réplicas multi-master)"""
+        if not hasattr(self, '_step'):
+            self._step = 1
+            if self.engine.dialect.name == 'mysql':
+                self._step = conn.exec_driver_sql("SELECT @@auto_increment_increment").scalar()
+        return self._step
+
+    def _captured_ids(self, conn, lastrowid, count):
+        """Ids generados por un INSERT de count filas a partir de lastrowid
+
+        MySQL reporta el primer id del INSERT multi-fila (LAST_INSERT_ID) y
+        SQLite el último. InnoDB asigna valores consecutivos a un "simple
+        insert" en cualquier innodb_autoinc_lock_mode.
+        """
+        step = self._autoinc_step(conn)
+        first = lastrowid - (count - 1) * step if self.engine.dialect.name == 'sqlite' else lastrowid
+        return first + np.arange(count, dtype='int64') * step
+
+class PandasWriter(TableWriter):
+    """Backend original: DataFrame.to_sql"""
+    name = 'pandas'
+
+    def write(self, df, table):
+        with self.begin() as conn:
+            df.to_sql(table, conn, if_exists='append', index=False)
+        return len(df)
+
+class BatchInsertWriter(TableWriter):
+    """INSERT multi-fila vía executemany, en lotes de batch_rows y una transacción por llamada"""
+    name = 'batch'
+
+    def write(self, df, table):
+        if df.empty:
+            return 0
+        stmt = sa_table(table, *[sa_column(c) for c in df.columns]).insert()
+        columns = list(df.columns)
+        with self.begin() as conn:
+            for start in range(0, len(df), self.batch_rows):
+                batch = df.iloc[start:start + self.batch_rows]
+                conn.execute(stmt, [dict(zip(columns, row)) for row in dataframe_to_records(batch)])
+        return len(df)
+
+    def write_returning_ids(self, df, table, id_column):
+        """Un INSERT multi-fila explícito por lote para conocer el rango de ids generado"""
+        if df.empty:
+            return pd.Series([], index=df.index, dtype='int64')
+        columns = list(df.columns)
+        rows_per_statement = max(1, min(self.batch_rows, MAX_STATEMENT_PARAMS // len(columns)))
+        ids = np.empty(len(df), dtype='int64')
+
+        with self.begin() as conn:
+            mark = '?' if conn.dialect.paramstyle == 'qmark' else '%s'
+            row_sql = '(' + ', '.join([mark] * len(columns)) + ')'
+            prefix = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            for start in range(0, len(df), rows_per_statement):
+                records = dataframe_to_records(df.iloc[start:start + rows_per_statement])
+                params = tuple(value for record in records for value in record)
+                result = conn.exec_driver_sql(prefix + ', '.join([row_sql] * len(records)), params)
+                ids[start:start + len(records)] = self._captured_ids(conn, result.lastrowid, len(records))
+        return pd.Series(ids, index=df.index)
+
+class LoadDataWriter(TableWriter):
+    """LOAD DATA LOCAL INFILE desde un archivo temporal por lote
+
+    pymysql solo envía archivos LOCAL desde una ruta en disco, por lo que
+    cada lote se serializa a un archivo temporal que se borra al terminar.
+    Si el servidor rechaza LOCAL INFILE se usa BatchInsertWriter.
+    """
+    name = 'bulk'
+
+    def __init__(self, engine, batch_rows=WRITE_BATCH_ROWS, session=None):
+        super().__init__(engine, batch_rows, session)
+        self.fallback = None
+
+    def write(self, df, table):
+        if df.empty:
+            return 0
+        if self.fallback:
+            return self.fallback.write(df, table)
+        return self._load(df, table)
+
+    def write_returning_ids(self, df, table, id_column):
+        """Ids a partir de LAST_INSERT_ID, verificando que el rango sea exclusivo del lote
+
+        LOAD DATA es un "bulk insert" para InnoDB: con innodb_autoinc_lock_mode=2
+        y otras sesiones insertando, el rango podría no ser consecutivo. Si la
+        verificación falla se retorna None y el llamador resuelve por clave.
+        """
+        if df.empty:
+            return pd.Series([], index=df.index, dtype='int64')
+        if not self.fallback:
+            captured = []
+            self._load(df, table, id_column, captured)
+            if not self.fallback:
+                if any(ids is None for ids in captured):
+                    return None
+                return pd.Series(np.concatenate(captured), index=df.index)
+        return self.fallback.write_returning_ids(df, table, id_column)
+
+    def _load(self, df, table, id_column=None, captured=None):
+        columns = ', '.join(f'`{c}`' for c in df.columns)
+        written = 0
+        for start in range(0, len(df), self.batch_rows):
+            batch = df.iloc[start:start + self.batch_rows]
+            try:
+                written += self._load_batch(batch, table, columns, id_column, captured)
+            except (pymysql.err.OperationalError, pymysql.err.InternalError, DBAPIError) as e:
+                if written:
+                    raise
+                logger.warning(f"  ⚠ LOAD DATA LOCAL INFILE no disponible ({e}). Usando INSERT por lotes...")
+                self.fallback = BatchInsertWriter(self.engine, self.batch_rows, self.session)
+                return self.fallback.write(df, table) if captured is None else 0
+        return written
+
+    def _load_batch(self, batch, table, columns, id_column=None, captured=None):
+        lines = None
+        for col in batch.columns:
+            field = _escape_infile(batch[col])
+            lines = field if lines is None else lines + '\t' + field
+
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.tsv', delete=False) as tmp:
+            tmp.write('\n'.join(lines))
+            tmp.write('\n')
+            tmp_path = Path(tmp.name)
+
+        try:
+            # Por la Connection de SQLAlchemy (no un cursor crudo): así abre la transacción
+            # y la sesión de carga la confirma (un cursor crudo se descartaría al cerrar)
+            with self.begin() as conn:
+                result = conn.exec_driver_sql(self.load_statement(tmp_path, table, columns))
+                loaded = result.rowcount
+                # Con LOCAL, MySQL convierte errores en warnings y omite las filas
+                if loaded != len(batch):
+                    for level, code, message in conn.exec_driver_sql("SHOW WARNINGS LIMIT 5").fetchall():
+                        logger.warning(f"  ⚠ {table}: {level} {code}: {message}")
+                    logger.warning(f"  ⚠ {table}: {loaded}/{len(batch)} filas cargadas por LOAD DATA")
+                if captured is not None:
+                    captured.append(self._verified_range(conn, table, id_column, result.lastrowid, loaded, len(batch)))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return loaded
+
+    def load_statement(self, path, table, columns):
+        """Sentencia que carga el archivo del lote en table"""
+        return (f"LOAD DATA LOCAL INFILE '{path.as_posix()}' INTO TABLE `{table}` "
+                f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+                f"LINES TERMINATED BY '\\n' ({columns})")
+
+    def _verified_range(self, conn, table, id_column, first, loaded, expected):
+        """Rango de ids del lote si es consecutivo y nadie más insertó en él; si no, None"""
+        if loaded != expected or not first:
+            return None
+        step = self._autoinc_step(conn)
+        count, last = conn.exec_driver_sql(
+            f"SELECT COUNT(*), MAX({id_column}) FROM {table} WHERE {id_column} >= %s", (first,)).one()
+        if count != expected or last != first + (expected - 1) * step:
+            logger.warning(f"  ⚠ {table}: rango de ids no consecutivo; se resolverán por clave")
+            return None
+        return first + np.arange(expected, dtype='int64') * step
+
+WRITER_BACKENDS = {cls.name: cls for cls in (PandasWriter, BatchInsertWriter, LoadDataWriter)}
+
+def create_writer(backend, engine, batch_rows=WRITE_BATCH_ROWS, session=None):
+    """Crea el writer pedido; 'bulk' solo aplica a MySQL"""
+    if backend == 'bulk' and engine.dialect.name != 'mysql':
+        logger.warning(f"  ⚠ Backend 'bulk' requiere MySQL ({engine.dialect.name}). Usando 'batch'...")
+        backend = 'batch'
+    return WRITER_BACKENDS[backend](engine, batch_rows, session)
+
+# =====================================================
+# SESIÓN DE CARGA MASIVA (--commit-rows / --relax-checks)
+# =====================================================
+
+COMMIT_ROWS = 50000  # Filas por COMMIT cuando --relax-checks se usa sin --commit-rows
+
+def unique_keys(conn, table):
+    """Columnas de cada UNIQUE de table
+    
+    En SQLite los UNIQUE de columna solo existen como autoindex y el
+    inspector no los reporta: se leen con PRAGMA index_list.
+    """
+    if conn.dialect.name == 'sqlite':
+        return {
+            tuple(row[2] for row in conn.exec_driver_sql(f'PRAGMA index_info("{index[1]}")'))
+            for index in conn.exec_driver_sql(f'PRAGMA index_list("{table}")') if index[2] and index[3] != 'pk'
+        }
+    inspector = inspect(conn)
+    keys = {tuple(constraint['column_names']) for constraint in inspector.get_unique_constraints(table)}
+    return keys | {tuple(index['column_names']) for index in inspector.get_indexes(table) if index.get('unique')}
+
+def integrity_violations(conn, tables):
+    """Filas huérfanas por FK y claves repetidas por UNIQUE en tables
+    
+    Retorna [(tabla, restricción, filas)] solo con las restricciones que
+    fallan. Las FKs y UNIQUE se leen del schema de la BD.
+    """
+    inspector = inspect(conn)
+    problems = []
+    for table in tables:
+        for fk in inspector.get_foreign_keys(table):
+            columns, parent = fk['constrained_columns'], fk['referred_table']
+            present = ' AND '.join(f"t.{column} IS NOT NULL" for column in columns)
+            join = ' AND '.join(f"p.{referred} = t.{column}"
+                                for column, referred in zip(columns, fk['referred_columns']))
+            count = conn.execute(text(
+                f"SELECT COUNT(*) FROM {table} t WHERE {present} AND NOT EXISTS (SELECT 1 FROM {parent} p WHERE {join})"
+            )).scalar()
+            if count:
+                problems.append((table, f"FK ({', '.join(columns)}) → {parent}", count))
+        
+        for columns in sorted(unique_keys(conn, table)):
+            present = ' AND '.join(f"{column} IS NOT NULL" for column in columns)
+            count = conn.execute(text(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {present} "
+                f"GROUP BY {', '.join(columns)} HAVING COUNT(*) > 1) repetidas"
+            )).scalar()
+            if count:
+                problems.append((table, f"UNIQUE ({', '.join(columns)})", count))
+    return problems
+
+class BulkLoadSession:
+    """Una conexión por hilo (fase) o proceso de citas, con un COMMIT cada commit_rows filas
+    
+    Sin sesión, cada escritura, búsqueda o UPDATE toma una conexión del pool y
+    confirma su propia transacción, y el flush del log de InnoDB en cada COMMIT
+    marca el ritmo de la carga. Con la sesión todo lo que hace un hilo va por la
+    misma conexión y se confirma por volumen, al terminar cada fase o bloque de
+    citas (antes de anotarlo en la bitácora) y al cerrar.
+    
+    Con relax_checks las conexiones MySQL desactivan foreign_key_checks y
+    unique_checks (SQLite no exige las FKs y no permite desactivar los UNIQUE).
+    close() busca huérfanos y duplicados en las tablas cargadas antes de
+    reactivar los chequeos; al reactivarlos MySQL no revisa las filas existentes.
+    """
+    
+    def __init__(self, engine, commit_rows=COMMIT_ROWS, relax_checks=False, metrics=None):
+        self.engine = engine
+        self.commit_rows = commit_rows
+        self.relax_checks = relax_checks
+        self.metrics = metrics
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []  # Abiertas por todos los hilos (se cierran en close)
+        self.commit_seconds = []
+        self.stats = {}  # Resumen de los commits de la última sesión cerrada
+    
+    def connection(self):
+        """Conexión del hilo actual (la abre en el primer uso)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.engine.connect()
+            if self.relax_checks and self.engine.dialect.name == 'mysql':
+                conn.exec_driver_sql("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+            self.local.conn = conn
+            self.local.pending = 0
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def connect(self):
+        """Como engine.begin(), pero el COMMIT lo decide la sesión"""
+        yield self.connection()
+    
+    def wrote(self, rows):
+        """Suma filas escritas por el hilo actual; confirma al llegar a commit_rows"""
+        self.local.pending = getattr(self.local, 'pending', 0) + rows
+        if self.local.pending >= self.commit_rows:
+            self.commit()
+    
+    def commit(self):
+        """Confirma la transacción del hilo actual, si tiene una"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            self._commit(conn, self.local.pending)
+            self.local.pending = 0
+    
+    def _commit(self, conn, rows=0):
+        if not conn.in_transaction():
+            return
+        start = time.perf_counter()
+        with self.metrics.step('commit', rows) if self.metrics else nullcontext():
+            conn.commit()
+        with self.lock:
+            self.commit_seconds.append(time.perf_counter() - start)
+    
+    def close(self, commit=True, verify_tables=()):
+        """Confirma (o descarta, con commit=False) y cierra las conexiones de todos los hilos
+        
+        Con relax_checks verifica verify_tables antes de reactivar los chequeos
+        y lanza RuntimeError si hay violaciones. Se llama cuando ya no hay
+        fases en curso; la sesión se puede volver a usar después.
+        """
+        with self.lock:
+            connections, self.connections = self.connections, []
+        self.local = threading.local()
+        problems = []
+        try:
+            for conn in connections:
+                if commit:
+                    self._commit(conn)
+                elif conn.in_transaction():
+                    conn.rollback()
+            if commit and self.relax_checks and verify_tables:
+                logger.info("Verificando FKs y UNIQUE antes de reactivar los chequeos...")
+                with self.engine.connect() as conn:
+                    problems = integrity_violations(conn, verify_tables)
+        finally:
+            for conn in connections:
+                if self.relax_checks and self.engine.dialect.name == 'mysql':
+                    conn.exec_driver_sql("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+                conn.close()
+            self.report_commits()
+        
+        for table, constraint, count in problems:
+            logger.error(f"  ✗ {table}: {count} violaciones de {constraint}")
+        if problems:
+            raise RuntimeError(f"{len(problems)} restricciones violadas tras la carga con chequeos desactivados")
+        if commit and self.relax_checks and verify_tables:
+            logger.info(f"  ✓ Sin huérfanos ni duplicados en {len(verify_tables)} tablas")
+    
+    def report_commits(self):
+        """Registra la latencia de los commits de la sesión y la reinicia"""
+        with self.lock:
+            seconds, self.commit_seconds = sorted(self.commit_seconds), []
+        if not seconds:
+            self.stats = {}
+            return
+        self.stats = {
+            'commits': len(seconds),
+            'commit_ms_medio': round(1000 * sum(seconds) / len(seconds), 2),
+            'commit_ms_p95': round(1000 * seconds[int(0.95 * (len(seconds) - 1))], 2),
+            'commit_ms_max': round(1000 * seconds[-1], 2),
+            'commit_segundos': round(sum(seconds), 3),
+        }
+        logger.info(f"  Commits: {self.stats['commits']} (cada {self.commit_rows} filas) | latencia media "
+                    f"{self.stats['commit_ms_medio']} ms, p95 {self.stats['commit_ms_p95']} ms, "
+                    f"máx {self.stats['commit_ms_max']} ms, total {self.stats['commit_segundos']}s")
+
+# =====================================================
+# ÍNDICES SECUNDARIOS DIFERIDOS (--defer-indexes)
+# =====================================================
+
+INDEX_WORKERS = 4  # Tablas cuyos índices se reconstruyen en paralelo
+
+def schema_indexes(dialect, sql=None):
+    """Índices secundarios de 01_create_schema.sql: {tabla: [(nombre, columnas)]}
+    
+    Incluye los INDEX inline y los CREATE INDEX; los UNIQUE son restricciones
+    de columna y no aparecen. Los nombres son los de la BD: en SQLite los
+    inline llevan la tabla como prefijo (ver sqlite_schema).
+    """
+    sql = re.sub(r'--[^\n]*', '', sql or SCHEMA_PATH.read_text(encoding='utf-8'))
+    indexes = defaultdict(list)
+    for stmt in sql.split(';'):
+        stmt = stmt.strip()
+        create_table = re.match(r'CREATE TABLE (\w+)', stmt)
+        create_index = re.match(r'CREATE INDEX (\w+) ON (\w+)\s*\(([^)]*)\)', stmt)
+        if create_table:
+            table = create_table.group(1)
+            for name, columns in re.findall(INLINE_INDEX_PATTERN, stmt, flags=re.M):
+                name = f"{table}_{name}" if dialect == 'sqlite' else name
+                indexes[table].append((name, tuple(column.strip() for column in columns.split(','))))
+        elif create_index:
+            name, table, columns = create_index.groups()
+            indexes[table].append((name, tuple(column.strip() for column in columns.split(','))))
+    return dict(indexes)
+
+class SecondaryIndexes:
+    """Quita los índices secundarios de las tablas de la carga y los reconstruye al final
+    
+    Cada índice secundario se mantiene fila a fila durante los INSERT; sin
+    ellos las tablas grandes se cargan al ritmo de un append y cada índice se
+    construye después en una sola pasada ordenada. Se conservan la PK, los
+    UNIQUE (los mapeos del ETL buscan por ellos) y, por cada FK que no quede
+    cubierta por la PK o un UNIQUE, el índice más angosto que empiece por sus
+    columnas: MySQL no permite quitarlo. Se conservan en todos los motores
+    para que un ensayo en SQLite mida lo mismo que MySQL.
+    
+    La definición sale siempre del schema, así rebuild() recrea lo que falte
+    aunque lo haya quitado una corrida anterior que se interrumpió.
+    """
+    
+    def __init__(self, engine, tables, workers=INDEX_WORKERS, metrics=None):
+        self.engine = engine
+        self.tables = list(tables)
+        # SQLite admite un solo escritor: los índices se crean de a uno
+        self.workers = 1 if engine.dialect.name == 'sqlite' else max(1, workers)
+        self.metrics = metrics
+        self.definitions = {table: indexes for table, indexes in schema_indexes(engine.dialect.name).items()
+                            if table in self.tables}
+    
+    def existing(self, conn, table):
+        return {index['name'] for index in inspect(conn).get_indexes(table)}
+    
+    def required(self, conn, table):
+        """Índices del schema que sostienen una FK de table (no se pueden quitar)"""
+        inspector = inspect(conn)
+        covering = [tuple(inspector.get_pk_constraint(table)['constrained_columns']), *unique_keys(conn, table)]
+        required = set()
+        for fk in inspector.get_foreign_keys(table):
+            columns = tuple(fk['constrained_columns'])
+            if any(key[:len(columns)] == columns for key in covering):
+                continue
+            candidates = [(name, index) for name, index in self.definitions.get(table, [])
+                          if index[:len(columns)] == columns]
+            if candidates:
+                required.add(min(candidates, key=lambda candidate: len(candidate[1]))[0])
+        return required
+    
+    def deferrable(self):
+        """{tabla: [nombre]} de los índices que drop() quitaría ahora"""
+        plan = {}
+        with self.engine.connect() as conn:
+            for table, indexes in self.definitions.items():
+                present, required = self.existing(conn, table), self.required(conn, table)
+                names = [name for name, _ in indexes if name in present and name not in required]
+                if names:
+                    plan[table] = names
+        return plan
+    
+    def missing(self):
+        """{tabla: [(nombre, columnas)]} de los índices del schema que no están en la BD"""
+        with self.engine.connect() as conn:
+            plan = {table: [(name, columns) for name, columns in indexes if name not in self.existing(conn, table)]
+                    for table, indexes in self.definitions.items()}
+        return {table: indexes for table, indexes in plan.items() if indexes}
+    
+    def drop(self):
+        """Quita los índices diferibles; retorna cuántos quitó"""
+        plan = self.deferrable()
+        with self.engine.begin() as conn:
+            for table, names in plan.items():
+                if conn.dialect.name == 'mysql':
+                    # Un solo ALTER por tabla; quitar un índice secundario en InnoDB no copia la tabla
+                    conn.exec_driver_sql(f"ALTER TABLE {table} {', '.join(f'DROP INDEX {name}' for name in names)}")
+                else:
+                    for name in names:
+                        conn.exec_driver_sql(f"DROP INDEX {name}")
+                logger.info(f"  ↷ {table}: índices {', '.join(names)} diferidos hasta el final de la carga")
+        dropped = sum(len(names) for names in plan.values())
+        logger.info(f"✓ {dropped} índices secundarios quitados en {len(plan)} tablas")
+        return dropped
+    
+    def rebuild(self):
+        """Crea los índices del schema que falten, en paralelo por tabla; retorna cuántos creó"""
+        plan = self.missing()
+        if not plan:
+            logger.info("✓ Índices secundarios del schema completos")
+            return 0
+        total = sum(len(indexes) for indexes in plan.values())
+        logger.info(f"Reconstruyendo {total} índices secundarios en {len(plan)} tablas "
+                    f"({min(self.workers, len(plan))} en paralelo)...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='indice') as pool:
+            for future in [pool.submit(self.rebuild_table, table, indexes) for table, indexes in plan.items()]:
+                future.result()
+        logger.info(f"✓ {total} índices reconstruidos en {time.perf_counter() - start:.1f}s")
+        return total
+    
+    def rebuild_table(self, table, indexes):
+        """Crea los índices de una tabla uno a uno, midiendo cada uno"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            for name, columns in indexes:
+                start = time.perf_counter()
+                with self.metrics.step(f'índice {table}.{name}', rows, phase='índices') if self.metrics else nullcontext():
+                    conn.exec_driver_sql(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+                    conn.commit()
+                logger.info(f"  ✓ {table}.{name} ({', '.join(columns)}): {rows} filas en "
+                            f"{time.perf_counter() - start:.2f}s")
+
+# =====================================================
+# BITÁCORA DE CORRIDA (CHECKPOINTS / --resume)
+# =====================================================
+
+JOURNAL_PATH = 'migration_journal.json'
+
+CSV_FILES = ['DB_CLIENTES.csv', 'DB_CONFIG_EQUIPO.csv', 'DB_SERVICIOS.csv', 'DB_ATENCIONES.csv']
+
+# Tablas que escribe cada fase, de hija a padre (orden seguro para deshacer)
+PHASE_TABLES = {
+    'masters': ['especialidades', 'previsiones', 'comunas'],
+    'patients': ['pacientes'],
+    'staff': ['profesionales', 'usuarios'],
+    'services': ['servicios'],
+    'appointments': ['ficha_clinica', 'pagos', 'detalle_financiero_cita', 'citas'],
+}
+
+PRIMARY_KEYS = {
+    'comunas': 'id_comuna',
+    'previsiones': 'id_prevision',
+    'especialidades': 'id_especialidad',
+    'pacientes': 'id_paciente',
+    'usuarios': 'id_usuario',
+    'profesionales': 'id_profesional',
+    'servicios': 'id_servicio',
+    'citas': 'id_cita',
+    'detalle_financiero_cita': 'id_finanza',
+    'pagos': 'id_pago',
+    'ficha_clinica': 'id_ficha',
+}
+
+# Grafo de fases: de qué fases depende cada una y qué mapas de ids produce
+PHASE_DEPENDENCIES = {
+    'masters': [],
+    'patients': ['masters'],          # comunas, previsiones
+    'staff': ['masters'],             # especialidades
+    'services': [],
+    'appointments': ['patients', 'staff', 'services'],
+}
+
+PHASE_MAPS = {
+    'masters': ['comunas', 'previsiones', 'especialidades'],
+    'patients': ['pacientes_rut', 'pacientes_cod'],
+    'staff': ['profesionales'],
+    'services': ['servicios'],
+    'appointments': [],
+}
+
+PHASE_WORKERS = 3  # Ancho máximo del grafo: patients, staff y services
+
+SHARD_KEYS = ['profesional', 'fecha']  # Partición de DB_ATENCIONES entre procesos (--workers)
+
+def file_sha256(path, block_size=1 << 20):
+    """Hash SHA-256 de un archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RunJournal:
+    """Bitácora persistente de una corrida: fases, bloques, conteos y hashes de entrada
+
+    Se reescribe de forma atómica (archivo temporal + os.replace) al iniciar y
+    terminar cada fase y cada bloque. Antes de escribir, cada fase/bloque anota
+    el MAX(id) de sus tablas (watermark), de modo que --resume puede borrar lo
+    que haya quedado a medias y repetir solo esa parte.
+    """
+
+    def __init__(self, path, data=None):
+        self.path = Path(path)
+        self.data = data or {'inputs': {}, 'phases': {}}
+        self.lock = threading.RLock()  # Las fases en paralelo comparten la bitácora
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        if not path.exists():
+            return cls(path)
+        return cls(path, json.loads(path.read_text(encoding='utf-8')))
+
+    def save(self):
+        with self.lock:
+            self.data['updated_at'] = datetime.now().isoformat(timespec='seconds')
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            tmp_path.write_text(json.dumps(self.data, indent=2, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, self.path)
+
+    def phase(self, name):
+        with self.lock:
+            return self.data['phases'].setdefault(name, {'status': 'pending'})
+
+    def is_done(self, name):
+        return self.phase(name)['status'] == 'done'
+
+    def next_row(self, name):
+        """Primera fila de datos aún no migrada por una fase procesada en bloques"""
+        return self.data['phases'].get(name, {}).get('next_row', 0)
+
+    def start_phase(self, name, watermarks):
+        with self.lock:
+            self.phase(name).update(status='running', watermarks=watermarks,
+                                    started_at=datetime.now().isoformat(timespec='seconds'))
+            self.save()
+
+    def finish_phase(self, name, rows):
+        with self.lock:
+            phase = self.phase(name)
+            phase.update(status='done', finished_at=datetime.now().isoformat(timespec='seconds'))
+            phase.setdefault('rows', {}).update(rows)
+            phase.pop('chunk', None)
+            self.save()
+
+    def start_chunk(self, name, first_row, watermarks):
+        with self.lock:
+            self.phase(name)['chunk'] = {'first_row': first_row, 'watermarks': watermarks}
+            self.save()
+
+    def finish_chunk(self, name, next_row, rows):
+        with self.lock:
+            phase = self.phase(name)
+            phase.pop('chunk', None)
+            phase['next_row'] = next_row
+            phase['chunks_done'] = phase.get('chunks_done', 0) + 1
+            totals = phase.setdefault('rows', {})
+            for table, count in rows.items():
+                totals[table] = totals.get(table, 0) + count
+            self.save()
+
+# =====================================================
+# ALMACÉN DE MAPAS DE IDS (EN DISCO)
+# =====================================================
+# Cada fase guarda sus mapas legacy → id al terminar, junto a la bitácora.
+# --resume y los procesos de --workers los abren desde ahí en vez de
+# reconstruirlos desde la BD o recibir una copia.
+
+MAPS_SUFFIX = '_maps'  # migration_journal.json → migration_journal_maps/
+MAPS_MANIFEST = 'manifest.json'
+CLIENT_CODE_COLUMN = 'COD'  # Código de cliente de DB_CLIENTES (opcional); CODIGO CLIENTE trae el RUT o este código
+APPOINTMENT_MAPS = ['pacientes_rut', 'pacientes_cod', 'profesionales', 'servicios']  # Mapas que usa la fase de citas
+
+class MapStore:
+    """Mapas de ids de una corrida guardados en una carpeta
+    
+    Los índices (RutIndex, CodeIndex) se guardan como arreglos .npy y se
+    abren mapeados en memoria (mmap): solo se leen las páginas que se
+    consultan y los procesos comparten las del sistema operativo. Los
+    mapas chicos (dicts de maestros) van en JSON. Cada archivo se escribe
+    de forma atómica y el manifiesto se actualiza al final, así un mapa a
+    medio escribir nunca se lee.
+    """
+    INDEXES = {'RutIndex': RutIndex, 'CodeIndex': CodeIndex}
+    
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()  # Las fases en paralelo comparten el manifiesto
+    
+    @classmethod
+    def for_journal(cls, journal_path):
+        journal_path = Path(journal_path)
+        return cls(journal_path.with_name(journal_path.stem + MAPS_SUFFIX))
+    
+    def manifest(self):
+        path = self.directory / MAPS_MANIFEST
+        return json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+    
+    def write(self, filename, save):
+        tmp_path = self.directory / (filename + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            save(f)
+        os.replace(tmp_path, self.directory / filename)
+    
+    def save(self, maps):
+        """Guarda {nombre: dict | RutIndex | CodeIndex}"""
+        with self.lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            manifest = self.manifest()
+            for name, value in maps.items():
+                if isinstance(value, dict):
+                    data = {str(key): int(id_) for key, id_ in value.items()}
+                    self.write(f'{name}.json', lambda f: f.write(json.dumps(data, ensure_ascii=False).encode('utf-8')))
+                    manifest[name] = {'tipo': 'dict', 'filas': len(value)}
+                else:
+                    for part, array in value.arrays().items():
+                        self.write(f'{name}.{part}.npy', lambda f: np.save(f, np.ascontiguousarray(array)))
+                    manifest[name] = {'tipo': type(value).__name__, 'filas': len(value)}
+            self.write(MAPS_MANIFEST, lambda f: f.write(json.dumps(manifest, indent=2).encode('utf-8')))
+    
+    def has(self, names):
+        manifest = self.manifest()
+        return all(name in manifest for name in names)
+    
+    def load(self, names):
+        """{nombre: mapa} de los nombres pedidos (None si falta alguno)"""
+        manifest = self.manifest()
+        if not all(name in manifest for name in names):
+            return None
+        maps = {}
+        for name in names:
+            kind = manifest[name]['tipo']
+            if kind == 'dict':
+                maps[name] = json.loads((self.directory / f'{name}.json').read_text(encoding='utf-8'))
+            else:
+                index = self.INDEXES[kind]
+                maps[name] = index.from_arrays({part: np.load(self.directory / f'{name}.{part}.npy', mmap_mode='r')
+                                                for part in index.ARRAYS})
+        return maps
+    
+    def clear(self):
+        """Borra los mapas de una corrida anterior"""
+        with self.lock:
+            if self.directory.exists():
+                for path in self.directory.iterdir():
+                    path.unlink()
+
+# =====================================================
+# MÉTRICAS DE CORRIDA
+# =====================================================
+
+METRICS_PREFIX = 'migration_metrics'  # migration_metrics_<fecha>.json/.csv junto a migration.log
+
+METRICS_COLUMNS = ['fase', 'paso', 'llamadas', 'segundos', 'segundos_bd', 'filas', 'filas_s',
+                   'round_trips', 'rss_pico_mb', 'traced_pico_mb']
+
+def peak_rss_mb():
+    """RSS máximo alcanzado por el proceso hasta ahora (None si no se puede medir)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB y macOS bytes
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+class RunMetrics:
+    """Tiempo, filas, round-trips a la BD y memoria pico por fase y sub-paso
+    
+    Los pasos se acumulan por (fase, paso): los bloques de citas suman sobre
+    la misma entrada. La fase se toma del hilo que ejecuta el paso, así las
+    fases en paralelo no se mezclan. Cada sentencia enviada por el engine
+    cuenta como un round-trip de todos los pasos abiertos en ese hilo, y su
+    duración va a segundos_bd: segundos - segundos_bd es el costo de
+    transformación (no se cuentan los procesos de --workers ni LOAD DATA,
+    que usa una conexión cruda). Con trace_memory el pico de
+    tracemalloc se reinicia al abrir cada paso: con fases en paralelo es
+    aproximado (--phase-workers 1 para medirlo por paso).
+    """
+    
+    def __init__(self, trace_memory=False):
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.steps = {}  # (fase, paso) → acumulado
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def reset(self):
+        """Descarta lo medido (cada sincronización de --watch tiene su propio archivo)"""
+        with self.lock:
+            self.steps = {}
+            self.started_at = datetime.now()
+            self.start = time.perf_counter()
+    
+    def attach(self, engine):
+        """Cuenta las sentencias ejecutadas por engine"""
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+        event.listen(engine, 'after_cursor_execute', self.on_executed)
+    
+    def on_execute(self, *args):
+        self.local.execute_start = time.perf_counter()
+        for entry in getattr(self.local, 'open', ()):
+            entry['round_trips'] += 1
+    
+    def on_executed(self, *args):
+        seconds = time.perf_counter() - self.local.execute_start
+        for entry in getattr(self.local, 'open', ()):
+            entry['db_seconds'] += seconds
+    
+    @contextmanager
+    def phase(self, name):
+        """Atribuye a la fase `name` los pasos del hilo actual y mide la fase completa"""
+        previous = getattr(self.local, 'phase', None)
+        self.local.phase = name
+        try:
+            with self.step('total') as entry:
+                yield entry
+        finally:
+            self.local.phase = previous
+    
+    @contextmanager
+    def step(self, name, rows=0, phase=None):
+        """Mide un paso; las filas pueden fijarse al final con entry['rows']
+        
+        phase atribuye el paso a otra fase que la del hilo (p. ej. desde un pool).
+        """
+        entry = {'rows': rows, 'round_trips': 0, 'db_seconds': 0.0}
+        opened = self.local.__dict__.setdefault('open', [])
+        opened.append(entry)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            seconds = time.perf_counter() - start
+            # Por identidad: un paso anidado con los mismos contadores es un dict igual
+            opened[:] = [other for other in opened if other is not entry]
+            traced = tracemalloc.get_traced_memory()[1] / (1 << 20) if self.trace_memory else None
+            self.record(phase or getattr(self.local, 'phase', None) or 'general', name, seconds,
+                        entry['rows'], entry['round_trips'], traced, entry['db_seconds'])
+    
+    def record(self, phase, name, seconds, rows, round_trips, traced=None, db_seconds=0.0):
+        with self.lock:
+            acc = self.steps.setdefault((phase, name), {
+                'llamadas': 0, 'segundos': 0.0, 'segundos_bd': 0.0, 'filas': 0, 'round_trips': 0,
+                'rss_pico_mb': None, 'traced_pico_mb': None,
+            })
+            acc['llamadas'] += 1
+            acc['segundos'] += seconds
+            acc['segundos_bd'] += db_seconds
+            acc['filas'] += int(rows or 0)
+            acc['round_trips'] += round_trips
+            acc['rss_pico_mb'] = peak_rss_mb()
+            if traced is not None:
+                acc['traced_pico_mb'] = round(max(acc['traced_pico_mb'] or 0, traced), 1)
+    
+    def rows(self):
+        """Una fila por (fase, paso), en el orden en que aparecieron"""
+        with self.lock:
+            items = list(self.steps.items())
+        return [
+            dict(fase=phase, paso=name, **{**acc, 'segundos': round(acc['segundos'], 3),
+                                           'segundos_bd': round(acc['segundos_bd'], 3)},
+                 filas_s=round(acc['filas'] / acc['segundos'], 1) if acc['segundos'] and acc['filas'] else None)
+            for (phase, name), acc in items
+        ]
+    
+    def write(self, directory, extra):
+        """Escribe <prefijo>_<fecha>.json y .csv en directory; retorna la ruta del JSON"""
+        directory = Path(directory)
+        stem = f"{METRICS_PREFIX}_{self.started_at.strftime('%Y%m%d_%H%M%S')}"
+        rows = self.rows()
+        report = {
+            'inicio': self.started_at.isoformat(timespec='seconds'),
+            'segundos': round(time.perf_counter() - self.start, 3),
+            'rss_pico_mb': peak_rss_mb(),
+            **extra,
+            'pasos': rows,
+        }
+        (directory / f'{stem}.json').write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+        with open(directory / f'{stem}.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=METRICS_COLUMNS)
+            writer.writeheader()
+            writer.writerows({column: row[column] for column in METRICS_COLUMNS} for row in rows)
+        return directory / f'{stem}.json'
+
+def log_file():
+    """Ruta de migration.log (el FileHandler de configure_logging) o None si no se configuró"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return handler.baseFilename
+    return None
+
+def log_directory():
+    """Carpeta de migration.log (donde quedan también las métricas)"""
+    path = log_file()
+    return Path(path).parent if path else Path('.')
+
+# =====================================================
+# CACHÉ COLUMNAR (PARQUET)
+# =====================================================
+# --build-cache convierte cada CSV una sola vez a Parquet (zstd) con un schema
+# explícito: texto para todas las columnas y diccionario para CATEGORICAL_COLUMNS.
+# Los valores no se convierten (RUT, montos y fechas quedan como vienen): los
+# limpiadores del ETL deciden qué se rechaza y las huellas de --delta no cambian.
+# read_export usa la caché solo si corresponde al CSV actual (tamaño y mtime).
+
+CACHE_DIRNAME = '.parquet_cache'  # Dentro de la carpeta de los CSVs
+CACHE_FORMAT = 1
+CACHE_METADATA_KEY = b'etl_cache'
+CACHE_ROW_GROUP_ROWS = 100000
+
+def columnar_cache_path(csv_file):
+    """Ruta del Parquet que corresponde a un CSV"""
+    csv_file = Path(csv_file)
+    return csv_file.parent / CACHE_DIRNAME / f'{csv_file.stem}.parquet'
+
+def cache_signature(csv_file):
+    """Identifica el CSV (y las columnas categóricas) con que se construyó la caché"""
+    csv_file = Path(csv_file)
+    stat = csv_file.stat()
+    return {'format': CACHE_FORMAT, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'categorical': CATEGORICAL_COLUMNS.get(csv_file.name, [])}
+
+def export_schema(columns, filename):
+    """Schema Arrow de un CSV: texto, o diccionario de texto si la columna es categórica"""
+    categorical = set(CATEGORICAL_COLUMNS.get(filename, []))
+    return pa.schema([
+        pa.field(column, pa.dictionary(pa.int32(), pa.string()) if column in categorical else pa.string())
+        for column in columns
+    ])
+
+def build_columnar_cache(csv_file, chunk_rows=CACHE_ROW_GROUP_ROWS):
+    """Convierte un CSV a Parquet por bloques (un row group por bloque); retorna las filas"""
+    if pq is None:
+        raise RuntimeError('La caché columnar requiere pyarrow (pip install pyarrow)')
+    csv_file = Path(csv_file)
+    path = columnar_cache_path(csv_file)
+    path.parent.mkdir(exist_ok=True)
+    partial = path.with_name(path.name + '.part')
+    
+    # La firma se toma antes de leer: si el CSV cambia durante la conversión la caché queda vieja
+    signature = json.dumps(cache_signature(csv_file)).encode()
+    columns = pd.read_csv(csv_file, encoding='utf-8-sig', nrows=0).columns
+    schema = export_schema(columns, csv_file.name).with_metadata({CACHE_METADATA_KEY: signature})
+    rows = 0
+    try:
+        with pq.ParquetWriter(partial, schema, compression='zstd') as writer:
+            for chunk in pd.read_csv(csv_file, encoding='utf-8-sig', dtype=csv_dtypes(csv_file.name),
+                                     chunksize=chunk_rows):
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                rows += len(chunk)
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+    return rows
+
+def columnar_cache_is_fresh(csv_file):
+    """True si hay caché Parquet para el CSV y fue construida desde su versión actual"""
+    path = columnar_cache_path(csv_file)
+    if pq is None or not path.exists() or not Path(csv_file).exists():
+        return False
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowException):
+        return False
+    return metadata.get(CACHE_METADATA_KEY) == json.dumps(cache_signature(csv_file)).encode()
+
+def read_export(csv_file, chunk_rows=None, columns=None):
+    """Lee un CSV exportado (texto + categóricas), desde la caché Parquet si está al día
+    
+    Retorna un DataFrame o, con chunk_rows, un iterador de bloques cuyo índice
+    es el número de fila del CSV. columns limita las columnas leídas; las que
+    no existen en el archivo se ignoran.
+    """
+    csv_file = Path(csv_file)
+    if columnar_cache_is_fresh(csv_file):
+        return read_columnar_cache(columnar_cache_path(csv_file), chunk_rows, columns)
+    usecols = None if columns is None else (lambda column: column in columns)
+    return pd.read_csv(csv_file, encoding='utf-8-sig', dtype=csv_dtypes(csv_file.name), usecols=usecols,
+                       chunksize=chunk_rows)
+
+def read_columnar_cache(path, chunk_rows=None, columns=None):
+    """Lee el Parquet con memory map, solo las columnas pedidas"""
+    parquet = pq.ParquetFile(path, memory_map=True)
+    names = [name for name in parquet.schema_arrow.names if columns is None or name in columns]
+    if not chunk_rows:
+        return parquet.read(columns=names).to_pandas()
+    return _columnar_chunks(parquet, names, chunk_rows)
+
+def _columnar_chunks(parquet, columns, chunk_rows):
+    start = 0
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+# =====================================================
+# HUELLAS POR FILA (SINCRONIZACIÓN INCREMENTAL)
+# =====================================================
+
+FINGERPRINT_TABLE = 'etl_fingerprints'
+
+WATCH_INTERVAL = 60  # Segundos entre revisiones de los CSVs en --watch
+
+# Clave natural de cada CSV con sincronización incremental: (columna, limpiador)
+DELTA_SOURCES = {
+    'DB_CLIENTES.csv': ('RUT', clean_rut_series),
+    'DB_SERVICIOS.csv': ('ID_SERVICIO', clean_text_series),
+    'DB_ATENCIONES.csv': ('ID_ATENCION', clean_text_series),
+}
+
+def row_fingerprints(df, source):
+    """Hash de contenido de cada fila, agrupado por la clave natural de la fuente
+    
+    Retorna una Series int64 indexada por clave (las filas sin clave se
+    ignoran; las claves repetidas combinan sus hashes).
+    """
+    key_column, clean_key = DELTA_SOURCES[source]
+    keys = clean_key(get_column(df, key_column))
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy().view('int64')
+    valid = keys.notna().to_numpy()
+    return combine_fingerprints(pd.Series(hashes[valid], index=keys[valid].to_numpy()))
+
+def combine_fingerprints(fingerprints):
+    """Suma (módulo 2^64) las huellas de claves repetidas"""
+    combined = pd.Series(fingerprints.to_numpy().view('uint64'), index=fingerprints.index).groupby(level=0).sum()
+    return pd.Series(combined.to_numpy(dtype='uint64').view('int64'), index=combined.index)
+
+class FingerprintStore:
+    """Huellas por fila de cada CSV, guardadas en la BD destino (tabla etl_fingerprints)
+    
+    Las citas rechazadas se guardan con rechazada = 1: no se reintentan
+    mientras su fila no cambie (o lleguen pacientes o profesionales nuevos).
+    """
+
+    def __init__(self, connection, writer):
+        self.connection = connection  # ETLMigration.connection (respeta la sesión de carga)
+        self.writer = writer
+
+    def ensure_table(self):
+        with self.connection(write=True) as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (
+                    fuente VARCHAR(50) NOT NULL,
+                    clave VARCHAR(100) NOT NULL,
+                    fingerprint BIGINT NOT NULL,
+                    rechazada INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fuente, clave)
+                )
+            """))
+            # Tablas de versiones anteriores, sin la marca de rechazo
+            columns = {column['name'] for column in inspect(conn).get_columns(FINGERPRINT_TABLE)}
+            if 'rechazada' not in columns:
+                conn.execute(text(f"ALTER TABLE {FINGERPRINT_TABLE} ADD COLUMN rechazada INT NOT NULL DEFAULT 0"))
+
+    def load(self, source):
+        with self.connection() as conn:
+            rows = conn.execute(
+                text(f"SELECT clave, fingerprint FROM {FINGERPRINT_TABLE} WHERE fuente = :fuente"),
+                {'fuente': source}
+            ).fetchall()
+        return pd.Series([row[1] for row in rows], index=[row[0] for row in rows], dtype='int64')
+
+    def rejected(self, source):
+        """Claves guardadas como rechazadas"""
+        with self.connection() as conn:
+            return pd.Index(conn.execute(
+                text(f"SELECT clave FROM {FINGERPRINT_TABLE} WHERE fuente = :fuente AND rechazada = 1"),
+                {'fuente': source}
+            ).scalars().all(), dtype=object)
+
+    def diff(self, source, current):
+        """Compara con lo guardado; retorna (claves nuevas, modificadas, eliminadas)"""
+        previous = self.load(source)
+        known = current.index.isin(previous.index)
+        inserted = current.index[~known]
+        changed = current.index[known][current[known].to_numpy() != previous.reindex(current.index[known]).to_numpy()]
+        deleted = previous.index.difference(current.index)
+        return inserted, changed, deleted
+
+    def save(self, source, fingerprints, deleted=(), replace=False, rejected=()):
+        """Guarda huellas; replace=True reemplaza todas las de la fuente, rejected marca las claves rechazadas"""
+        stale = list(deleted) + list(fingerprints.index)
+        delete_keys = text(f"DELETE FROM {FINGERPRINT_TABLE} WHERE fuente = :fuente AND clave IN :claves").bindparams(
+            bindparam('claves', expanding=True)
+        )
+        with self.connection(write=True) as conn:
+            if replace:
+                conn.execute(text(f"DELETE FROM {FINGERPRINT_TABLE} WHERE fuente = :fuente"), {'fuente': source})
+            else:
+                for i in range(0, len(stale), ID_LOOKUP_BATCH):
+                    conn.execute(delete_keys, {'fuente': source, 'claves': stale[i:i + ID_LOOKUP_BATCH]})
+        if len(fingerprints):
+            self.writer.write(pd.DataFrame({
+                'fuente': source,
+                'clave': fingerprints.index,
+                'fingerprint': fingerprints.to_numpy(),
+                'rechazada': fingerprints.index.isin(rejected).astype('int64'),
+            }), FINGERPRINT_TABLE)
+
 # =====================================================
 # CLASE PRINCIPAL DE MIGRACIÓN
 # =====================================================
 
 class ETLMigration:
-    def __init__(self, csv_path, db_connection_string):
+    USES_ID_MAPS = True  # Las FKs de citas se resuelven con los mapas en memoria (self.maps)
+    
+    def __init__(self, csv_path, db_connection_string, chunk_rows=None,
+                 writer='batch', batch_rows=WRITE_BATCH_ROWS,
+                 bcrypt_rounds=BCRYPT_ROUNDS, hash_workers=None,
+                 journal_path=JOURNAL_PATH, resume=False, phase_workers=PHASE_WORKERS,
+                 workers=1, shard_by='profesional', trace_memory=False,
+                 commit_rows=None, relax_checks=False, defer_indexes=False, index_workers=INDEX_WORKERS,
+                 name_threshold=NAME_MATCH_THRESHOLD, link_patients=False, report_dir=None):
         self.csv_path = Path(csv_path)
-        self.engine = create_engine(db_connection_string, echo=False)
+        self.db_connection_string = db_connection_string
+        self.writer_backend = writer
+        if relax_checks and not commit_rows:
+            commit_rows = COMMIT_ROWS
+        if is_memory_database(db_connection_string) and (phase_workers > 1 or workers > 1):
+            # Una sola conexión compartida: ni fases en paralelo ni procesos
+            logger.info("↷ BD en memoria: fases en secuencia y citas en un solo proceso")
+            phase_workers, workers = 1, 1
+        elif commit_rows and make_url(db_connection_string).get_backend_name() == 'sqlite' and (
+                phase_workers > 1 or workers > 1):
+            # SQLite admite un solo escritor: las transacciones largas de la sesión se bloquearían entre sí
+            logger.info("↷ Sesión de carga en SQLite: fases en secuencia y citas en un solo proceso")
+            phase_workers, workers = 1, 1
+        # Cada fase en paralelo toma su propia conexión del pool
+        self.engine = create_target_engine(db_connection_string, local_infile=writer == 'bulk',
+                                           pool_size=max(5, phase_workers + 1))
+        self.metrics = RunMetrics(trace_memory)  # Tiempos y volúmenes por fase y sub-paso
+        self.metrics.attach(self.engine)
+        # Sesión de carga (--commit-rows): una conexión por hilo y COMMIT por volumen
+        self.session = BulkLoadSession(self.engine, commit_rows, relax_checks, self.metrics) if commit_rows else None
+        self.writer = create_writer(writer, self.engine, batch_rows, self.session)
+        # Índices secundarios diferidos (--defer-indexes): se quitan antes de la carga y se reconstruyen al final
+        self.indexes = SecondaryIndexes(self.engine, [table for tables in PHASE_TABLES.values() for table in tables],
+                                        index_workers, self.metrics) if defer_indexes else None
         self.maps = {}  # Almacena mapeos ID legacy → ID nuevo
+        self.chunk_rows = chunk_rows  # Filas por bloque en modo streaming (None = todo en memoria)
+        self.bcrypt_rounds = bcrypt_rounds
+        self.hash_workers = hash_workers or os.cpu_count() or 1
+        self.journal = RunJournal.load(journal_path) if resume else RunJournal(journal_path)
+        self.map_store = MapStore.for_journal(journal_path)  # Mapas de cada fase en disco (para --resume y --workers)
+        self.resume = resume
+        self.rows_written = {}  # Filas insertadas por tabla en esta corrida
+        self.rows_lock = threading.Lock()
+        self.phase_workers = max(1, phase_workers)
+        self.workers = max(1, workers)  # Procesos para la fase de citas
+        self.shard_by = shard_by
+        self.rejections = {}  # Filas de citas rechazadas por motivo
+        self.name_threshold = name_threshold
+        self.matcher = None  # NameMatcher de ESPECIALISTA (se arma al inicio de la fase de citas)
+        self.link_patients = link_patients  # Enlace de registros de pacientes sin RUT o con datos distintos
+        self.report_dir = Path(report_dir) if report_dir else None  # Reportes y métricas (None = junto a migration.log)
+        self.fingerprints = FingerprintStore(self.connection, self.writer)
+        
+    def report_directory(self):
+        """Carpeta de los reportes CSV y las métricas de la corrida"""
+        return self.report_dir or log_directory()
+    
+    def load_csv(self, filename, chunk_rows=None, skip_rows=0):
+        """Carga un archivo CSV (o un iterador de bloques si se indica chunk_rows)
+        
+        skip_rows omite las primeras filas de datos (ya migradas en una corrida
+        anterior) conservando su numeración original en el índice.
+        """
+        filepath = self.csv_path / filename
+        if not filepath.exists():
+            logger.error(f"Archivo no encontrado: {filepath}")
+            return None
+        
+        # Todo se lee como texto (o categórica de texto, CATEGORICAL_COLUMNS): los
+        # limpiadores hacen la conversión y así la inferencia de tipos no puede
+        # variar de un bloque a otro. La caché Parquet (--build-cache) trae lo mismo
+        if columnar_cache_is_fresh(filepath):
+            logger.info(f"  Leyendo {filename} desde {columnar_cache_path(filepath)}")
+        elif columnar_cache_path(filepath).exists():
+            logger.warning(f"⚠ Caché Parquet de {filename} desactualizada (reconstruir con --build-cache); se lee el CSV")
+        if chunk_rows:
+            logger.info(f"Cargando {filename} en bloques de {chunk_rows} filas...")
+            reader = self.timed_chunks(filename, read_export(filepath, chunk_rows=chunk_rows))
+            if skip_rows:
+                # Se filtra por índice (no con skiprows) porque OBSERVACION puede traer saltos de línea
+                logger.info(f"  Omitiendo {skip_rows} filas ya migradas")
+                return (chunk[chunk.index >= skip_rows] for chunk in reader)
+            return reader
+        
+        logger.info(f"Cargando {filename}...")
+        with self.metrics.step(f'lectura {filename}') as step:
+            df = read_export(filepath)
+            step['rows'] = len(df)
+        logger.info(f"  Registros cargados: {len(df)}")
+        if skip_rows:
+            logger.info(f"  Omitiendo {skip_rows} filas ya migradas")
+            df = df[df.index >= skip_rows]
+        return df
+    
+    def timed_chunks(self, filename, reader):
+        """Itera los bloques de un CSV midiendo la lectura de cada uno"""
+        while True:
+            with self.metrics.step(f'lectura {filename}') as step:
+                chunk = next(reader, None)
+                step['rows'] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+    
+    def connection(self, write=False):
+        """Conexión para consultas o escrituras sueltas (context manager)
+        
+        Con sesión de carga es la conexión del hilo, sin COMMIT al salir; sin
+        sesión es una del pool y write=True la envuelve en una transacción.
+        """
+        if self.session:
+            return self.session.connect()
+        return self.engine.begin() if write else self.engine.connect()
+    
+    def commit_session(self):
+        """Confirma lo escrito por el hilo actual en la sesión de carga (fin de fase o bloque)"""
+        if self.session:
+            self.session.commit()
+    
+    def close_session(self, success=True):
+        """Cierra la sesión de carga al final de la corrida (ver BulkLoadSession.close)"""
+        if not self.session:
+            return
+        if not success:
+            self.session.close(commit=False)
+            return
+        with self.metrics.phase('cierre de sesión'):
+            self.session.close(verify_tables=[table for tables in PHASE_TABLES.values() for table in tables])
+    
+    def defer_indexes(self):
+        """Quita los índices secundarios antes de la carga (--defer-indexes)"""
+        if self.indexes:
+            with self.metrics.phase('índices'):
+                self.indexes.drop()
+    
+    def rebuild_indexes(self, success=True):
+        """Reconstruye los índices quitados por defer_indexes; si la corrida falló solo lo advierte"""
+        if not self.indexes:
+            return
+        if not success:
+            logger.warning("⚠ Los índices secundarios quedan sin reconstruir: se recrean al completar "
+                           "--resume o con --rebuild-indexes")
+            return
+        with self.metrics.phase('índices'):
+            self.indexes.rebuild()
+    
+    def write(self, df, table):
+        """Escribe un DataFrame en una tabla usando el backend configurado"""
+        with self.metrics.step(f'escritura {table}', len(df)):
+            written = self.writer.write(df, table)
+        self.count_rows(table, written)
+        return written
+    
+    def count_rows(self, table, count):
+        """Acumula las filas insertadas por tabla (compartido entre fases paralelas)"""
+        with self.rows_lock:
+            self.rows_written[table] = self.rows_written.get(table, 0) + count
+        if self.session:
+            self.session.wrote(count)
+    
+    def insert_returning_ids(self, df, table, id_column, key_column):
+        """Inserta df y retorna sus ids generados (Int64) alineados con df.index
+        
+        Los ids se capturan al insertar; solo si el backend no puede
+        garantizarlos se resuelven por key_column, consultando únicamente
+        las claves del lote.
+        """
+        with self.metrics.step(f'escritura {table}', len(df)):
+            ids = self.writer.write_returning_ids(df, table, id_column)
+            self.count_rows(table, len(df))
+            if ids is None:
+                found = self.lookup_ids(table, id_column, key_column, df[key_column].dropna().unique())
+                ids = df[key_column].map(found)
+        return ids.astype('Int64')
+    
+    def upsert_returning_ids(self, df, table, id_column, key_column, update=True):
+        """Inserta las filas cuya key_column no existe y actualiza (o reutiliza) las que sí
         
-    def load_csv(self, filename):
-        """Carga un archivo CSV"""
-        filepath = self.csv_path / filename
-        if not filepath.exists():
-            logger.error(f"Archivo no encontrado: {filepath}")
-            return None
+        Hace que repetir una fase no duplique maestros. Las filas con clave
+        nula siempre se insertan. Retorna los ids alineados con df.index.
+        """
+        keys = df[key_column]
+        existing = self.lookup_ids(table, id_column, key_column, keys.dropna().unique())
+        ids = keys.map(existing).astype('Int64')
+        found = ids.notna()
         
-        logger.info(f"Cargando {filename}...")
-        df = pd.read_csv(filepath, encoding='utf-8-sig')
-        logger.info(f"  Registros cargados: {len(df)}")
-        return df
+        if found.any():
+            if update:
+                self.update_rows(df[found], table, id_column, ids[found])
+            logger.info(f"  ↻ {found.sum()} registros ya existían en {table} ({'actualizados' if update else 'reutilizados'})")
+        if (~found).any():
+            ids[~found] = self.insert_returning_ids(df[~found], table, id_column, key_column)
+        return ids
+    
+    def update_rows(self, df, table, id_column, ids):
+        """UPDATE por id de las filas de df (executemany en lotes)"""
+        columns = list(df.columns)
+        stmt = text(f"UPDATE {table} SET {', '.join(f'{c} = :{c}' for c in columns)} WHERE {id_column} = :_id")
+        params = [dict(zip(columns, record), _id=int(id_))
+                  for record, id_ in zip(dataframe_to_records(df), ids)]
+        with self.metrics.step(f'actualización {table}', len(df)), self.connection(write=True) as conn:
+            for i in range(0, len(params), self.writer.batch_rows):
+                conn.execute(stmt, params[i:i + self.writer.batch_rows])
+    
+    def lookup_ids(self, table, id_column, key_column, keys):
+        """Retorna {clave: id} para un conjunto acotado de claves (consultas IN por lotes)"""
+        ids = {}
+        keys = [key.item() if isinstance(key, np.generic) else key for key in keys]
+        query = text(f"SELECT {id_column}, {key_column} FROM {table} WHERE {key_column} IN :keys").bindparams(
+            bindparam('keys', expanding=True)
+        )
+        with self.metrics.step(f'búsqueda ids {table}', len(keys)), self.connection() as conn:
+            for i in range(0, len(keys), ID_LOOKUP_BATCH):
+                result = conn.execute(query, {'keys': keys[i:i + ID_LOOKUP_BATCH]})
+                ids.update({row[1]: row[0] for row in result})
+        return ids
     
     # =================================================
     # FASE 1: MAESTROS DINÁMICOS
@@ -166,107 +2318,150 @@ class ETLMigration:
         # 1. Comunas
         logger.info("Migrando comunas...")
         comunas_unique = df_clientes['COMUNA'].dropna().unique()
-        comunas_data = [{'nombre': clean_text(c)} for c in comunas_unique if clean_text(c)]
+        comunas_data = pd.DataFrame({'nombre': [clean_text(c) for c in comunas_unique]}).dropna().drop_duplicates()
         
-        if comunas_data:
-            pd.DataFrame(comunas_data).to_sql('comunas', self.engine, if_exists='append', index=False)
+        # Crear mapa comuna nombre → id con los ids generados al insertar
+        self.maps['comunas'] = {}
+        if not comunas_data.empty:
+            ids = self.upsert_returning_ids(comunas_data, 'comunas', 'id_comuna', 'nombre', update=False)
+            self.maps['comunas'] = dict(zip(comunas_data['nombre'], ids))
             logger.info(f"  ✓ {len(comunas_data)} comunas insertadas")
         
-        # Crear mapa comuna nombre → id
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT id_comuna, nombre FROM comunas"))
-            self.maps['comunas'] = {row[1]: row[0] for row in result}
-        
         # 2. Previsiones (adicionales a las ya insertadas)
         logger.info("Migrando previsiones adicionales...")
         previsiones_unique = df_clientes['ISAPRE'].dropna().unique()  # Asumiendo que ISAPRE contiene la previsión
         
-        with self.engine.connect() as conn:
-            existing = conn.execute(text("SELECT LOWER(nombre) FROM previsiones"))
-            existing_names = [row[0] for row in existing]
+        # Mapa previsión nombre → id: catálogo sembrado + las que se insertan aquí
+        with self.connection() as conn:
+            existing = conn.execute(text("SELECT id_prevision, nombre FROM previsiones"))
+            self.maps['previsiones'] = {row[1].lower(): row[0] for row in existing}
         
         new_previsiones = []
         for prev in previsiones_unique:
             prev_clean = clean_text(prev)
-            if prev_clean and prev_clean.lower() not in existing_names:
+            if prev_clean and prev_clean.lower() not in self.maps['previsiones']:
                 new_previsiones.append({'nombre': prev_clean, 'tipo': 'ISAPRE'})
+        new_previsiones = pd.DataFrame(new_previsiones, columns=['nombre', 'tipo'])
+        new_previsiones = new_previsiones[~new_previsiones['nombre'].str.lower().duplicated()]
         
-        if new_previsiones:
-            pd.DataFrame(new_previsiones).to_sql('previsiones', self.engine, if_exists='append', index=False)
+        if not new_previsiones.empty:
+            ids = self.insert_returning_ids(new_previsiones, 'previsiones', 'id_prevision', 'nombre')
+            self.maps['previsiones'].update(zip(new_previsiones['nombre'].str.lower(), ids))
             logger.info(f"  ✓ {len(new_previsiones)} previsiones insertadas")
         
-        # Crear mapa previsión nombre → id
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT id_prevision, nombre FROM previsiones"))
-            self.maps['previsiones'] = {row[1].lower(): row[0] for row in result}
-        
         # 3. Especialidades
         logger.info("Migrando especialidades...")
         especialidades_unique = df_equipo['ESPECIALIDAD'].dropna().unique()
-        especialidades_data = [{'nombre': clean_text(e)} for e in especialidades_unique if clean_text(e)]
-        
-        if especialidades_data:
-            pd.DataFrame(especialidades_data).to_sql('especialidades', self.engine, if_exists='append', index=False)
-            logger.info(f"  ✓ {len(especialidades_data)} especialidades insertadas")
+        especialidades_data = pd.DataFrame({'nombre': [clean_text(e) for e in especialidades_unique]}).dropna().drop_duplicates()
         
         # Crear mapa especialidad nombre → id
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT id_especialidad, nombre FROM especialidades"))
-            self.maps['especialidades'] = {row[1]: row[0] for row in result}
+        self.maps['especialidades'] = {}
+        if not especialidades_data.empty:
+            ids = self.upsert_returning_ids(especialidades_data, 'especialidades', 'id_especialidad', 'nombre', update=False)
+            self.maps['especialidades'] = dict(zip(especialidades_data['nombre'], ids))
+            logger.info(f"  ✓ {len(especialidades_data)} especialidades insertadas")
     
     # =================================================
     # FASE 2: PACIENTES
     # =================================================
     
+    def clean_patients(self, df_clientes):
+        """Normaliza DB_CLIENTES por columna (previsión y comuna quedan como texto)"""
+        apellidos = (clean_text_series(get_column(df_clientes, 'PATERNO')).fillna('') + ' ' +
+                     clean_text_series(get_column(df_clientes, 'MATERNO')).fillna('')).str.strip()
+        
+        return pd.DataFrame({
+            'rut': clean_rut_series(get_column(df_clientes, 'RUT')),
+            'nombres': title_case_series(get_column(df_clientes, 'NOMBRES')),
+            'apellidos': title_case_series(apellidos.where(apellidos != '')),
+            'email': clean_text_series(get_column(df_clientes, 'CORREO')),
+            'telefono': clean_text_series(get_column(df_clientes, 'TELEFONO')),
+            'direccion': clean_text_series(get_column(df_clientes, 'DIRECCION')),
+            'fecha_nacimiento': parse_date_series(get_column(df_clientes, 'FECHA_NACIMIENTO')),
+            'isapre': clean_text_series(get_column(df_clientes, 'ISAPRE')),
+            'comuna': clean_text_series(get_column(df_clientes, 'COMUNA'))
+        })
+    
+    def warn_check_digits(self, rut, duplicados):
+        """Informa los RUTs con dígito verificador inválido (el paciente se migra igual)"""
+        invalidos = rut.notna() & ~duplicados & ~valid_rut_series(rut)
+        for idx, valor in rut[invalidos].items():
+            logger.warning(f"  ⚠ RUT con dígito verificador inválido en fila {idx+2}: {valor}")
+    
+    def index_client_codes(self, df_clientes, ids):
+        """CodeIndex código de cliente (CLIENT_CODE_COLUMN) → id_paciente; ids: id de cada fila de df_clientes"""
+        codigo = clean_rut_series(get_column(df_clientes, CLIENT_CODE_COLUMN))
+        con_codigo = codigo.notna() & ids.notna()
+        if con_codigo.any():
+            logger.info(f"  ✓ {int(con_codigo.sum())} códigos de cliente indexados")
+        return CodeIndex(codigo[con_codigo], ids[con_codigo])
+    
+    def link_duplicate_patients(self, df):
+        """Fusiona los registros de la misma persona (--link-patients)
+        
+        Retorna (df sin los fusionados, fila canónica de cada fila omitida).
+        Los grupos con RUTs distintos no se tocan: quedan en el reporte para revisión.
+        """
+        if not self.link_patients or df.empty:
+            return df, pd.Series(dtype='int64')
+        with self.metrics.step('enlace de pacientes', len(df)):
+            links = link_patients(df)
+            merged = merge_linked_patients(df, links)
+        if links.empty:
+            logger.info("  ✓ Enlace de pacientes: sin registros duplicados")
+            return df, pd.Series(dtype='int64')
+        
+        grupos = links.groupby('accion')['grupo'].nunique()
+        logger.info(f"  ✓ Enlace de pacientes: {grupos.get('fusionar', 0)} grupos fusionados "
+                    f"({len(df) - len(merged)} registros omitidos), {grupos.get('revisar', 0)} grupos con RUTs distintos para revisar")
+        # grupo y fila como números de fila del CSV (grupo = su primera aparición)
+        report = links.assign(grupo=links['grupo'] + 2, fila=links.index + 2).join(
+            df[['rut', 'nombres', 'apellidos', 'email', 'telefono', 'fecha_nacimiento']])
+        path = self.report_directory() / f"{LINK_REPORT_PREFIX}_{self.metrics.started_at.strftime('%Y%m%d_%H%M%S')}.csv"
+        try:
+            report.sort_values(['accion', 'grupo', 'fila']).to_csv(path, index=False, encoding='utf-8-sig')
+            logger.info(f"  Reporte de enlace en {path}")
+        except OSError as e:
+            logger.warning(f"⚠ No se pudo guardar el reporte de enlace: {e}")
+        return merged, canonical_rows(links)
+    
     def migrate_patients(self, df_clientes):
         """Migra tabla DB_CLIENTES.csv → pacientes"""
         logger.info("=== FASE 2: MIGRANDO PACIENTES ===")
         
-        pacientes = []
-        ruts_vistos = set()
-        
-        for idx, row in df_clientes.iterrows():
-            rut = clean_rut(row.get('RUT'))
-            
-            # Validar RUT único
-            if rut and rut in ruts_vistos:
-                logger.warning(f"  ⚠ RUT duplicado en fila {idx+2}: {rut}. Omitiendo...")
-                continue
-            
-            if rut:
-                ruts_vistos.add(rut)
-            
-            # Construir registro
-            apellidos = f"{clean_text(row.get('PATERNO', ''))} {clean_text(row.get('MATERNO', ''))}".strip()
-            
-            paciente = {
-                'rut': rut,
-                'nombres': title_case(row.get('NOMBRES')),
-                'apellidos': title_case(apellidos) if apellidos else None,
-                'email': clean_text(row.get('CORREO')),
-                'telefono': clean_text(row.get('TELEFONO')),
-                'direccion': clean_text(row.get('DIRECCION')),
-                'fecha_nacimiento': parse_date(row.get('FECHA_NACIMIENTO')),
-                'id_prevision': self.maps['previsiones'].get(clean_text(row.get('ISAPRE', '')).lower()) if clean_text(row.get('ISAPRE')) else None,
-                'id_comuna': self.maps['comunas'].get(clean_text(row.get('COMUNA'))) if clean_text(row.get('COMUNA')) else None
-            }
-            
-            pacientes.append(paciente)
+        with self.metrics.step('limpieza', len(df_clientes)):
+            clean = self.clean_patients(df_clientes)
+        rut = clean['rut']
+
+        # Validar RUT único (se conserva la primera aparición)
+        duplicados = duplicated_ruts(rut)
+        for idx, valor in rut[duplicados].items():
+            logger.warning(f"  ⚠ RUT duplicado en fila {idx+2}: {valor}. Omitiendo...")
         
-        # Insertar en lote
-        if pacientes:
-            df_pacientes = pd.DataFrame(pacientes)
-            df_pacientes.to_sql('pacientes', self.engine, if_exists='append', index=False)
-            logger.info(f"  ✓ {len(pacientes)} pacientes insertados")
+        self.warn_check_digits(rut, duplicados)
+
+        # Resolver FKs con los mapas de maestros
+        df_pacientes = clean.drop(columns=['isapre', 'comuna']).assign(
+            id_prevision=clean['isapre'].str.lower().map(self.maps['previsiones']).astype('Int64'),
+            id_comuna=clean['comuna'].map(self.maps['comunas']).astype('Int64')
+        )[~duplicados]
+        df_pacientes, fusionadas = self.link_duplicate_patients(df_pacientes)
+
+        # Insertar en lote y crear el índice RUT → id_paciente con los ids generados
+        self.maps['pacientes_rut'] = RutIndex()
+        ids = pd.Series(dtype='Int64')
+        if not df_pacientes.empty:
+            ids = self.upsert_returning_ids(df_pacientes, 'pacientes', 'id_paciente', 'rut')
+            con_rut = df_pacientes['rut'].notna()
+            self.maps['pacientes_rut'] = RutIndex(df_pacientes['rut'][con_rut], ids[con_rut])
+            logger.info(f"  ✓ {len(df_pacientes)} pacientes insertados")
         
-        # Crear mapa RUT → id_paciente
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT id_paciente, rut FROM pacientes WHERE rut IS NOT NULL"))
-            self.maps['pacientes_rut'] = {row[1]: row[0] for row in result}
-            
-            # También por Código Cliente (COD)
-            result2 = conn.execute(text("SELECT id_paciente, rut FROM pacientes"))
-            self.maps['pacientes_cod'] = {}  # Tendrás que mapear COD si existe en CSV
+        # También por código de cliente: las filas omitidas (RUT repetido o
+        # fusionadas) apuntan al paciente que quedó en su lugar
+        id_fila = ids.reindex(clean.index)
+        id_fila = id_fila.fillna(ids.reindex(fusionadas.to_numpy()).set_axis(fusionadas.index).reindex(clean.index))
+        id_fila = id_fila.fillna(self.maps['pacientes_rut'].lookup(rut))
+        self.maps['pacientes_cod'] = self.index_client_codes(df_clientes, id_fila)
     
     # =================================================
     # FASE 3: PROFESIONALES Y USUARIOS
@@ -277,277 +2472,840 @@ class ETLMigration:
         logger.info("=== FASE 3: MIGRANDO STAFF ===")
         
         # Obtener ID del rol PROFESIONAL
-        with self.engine.connect() as conn:
+        with self.connection() as conn:
             role_result = conn.execute(text("SELECT id_rol FROM roles WHERE nombre = 'PROFESIONAL'"))
             id_rol_prof = role_result.fetchone()[0]
         
-        for idx, row in df_equipo.iterrows():
-            nombres = title_case(row.get('ESPECIALISTA'))
-            if not nombres:
-                continue
-            
-            # Crear email dummy si no existe
-            email = clean_text(row.get('EMAIL'))
-            if not email:
-                email = f"{nombres.lower().replace(' ', '.')}@clinica.com"
-            
-            # Insertar usuario
-            password_hash = bcrypt.hashpw(b'temp1234', bcrypt.gensalt()).decode('utf-8')
+        self.maps['profesionales'] = {}
+        nombres = title_case_series(get_column(df_equipo, 'ESPECIALISTA'))
+        staff = df_equipo[nombres.notna()]
+        nombres = nombres[nombres.notna()]
+        
+        # Crear email dummy si no existe
+        email = clean_text_series(get_column(staff, 'EMAIL'))
+        email = email.fillna(nombres.str.lower().str.replace(' ', '.', regex=False) + '@clinica.com')
+        
+        estado = clean_text_series(get_column(staff, 'ESTADO')).fillna('ACTIVO')
+        profesionales = pd.DataFrame({
+            'nombres': nombres,
+            'id_especialidad': clean_text_series(get_column(staff, 'ESPECIALIDAD')).map(self.maps['especialidades']).astype('Int64'),
+            'color_calendario': clean_text_series(get_column(staff, 'COLOR_PROFESIONAL')).fillna('#3B82F6'),
+            'comision_base': pd.to_numeric(clean_text_series(get_column(staff, 'COMISION_%')).fillna('0'), errors='coerce'),
+            'retencion_impuesto': pd.to_numeric(clean_text_series(get_column(staff, 'RETENCION_%')).fillna('0'), errors='coerce'),
+            'activo': (estado.str.upper() == 'ACTIVO').astype(int)
+        })
+        
+        # Filas no insertables: porcentajes no numéricos o emails repetidos
+        rechazo = pd.Series(None, index=staff.index, dtype=object)
+        rechazo[profesionales['comision_base'].isna() | profesionales['retencion_impuesto'].isna()] = 'porcentaje no numérico'
+        rechazo[rechazo.isna() & email.duplicated(keep='first')] = 'email duplicado en el CSV'
+        for idx, motivo in rechazo.dropna().items():
+            logger.error(f"  ✗ Error insertando {nombres[idx]}: {motivo} ({email[idx]})")
+        
+        validos = rechazo.isna()
+        profesionales = profesionales[validos]
+        email = email[validos]
+        
+        if not profesionales.empty:
+            # Usuarios ya existentes (corrida anterior) se reutilizan sin tocar su password
+            existentes = self.lookup_ids('usuarios', 'id_usuario', 'email', email.unique())
+            id_usuario = email.map(existentes).astype('Int64')
+            nuevos = id_usuario.isna()
+            if not nuevos.all():
+                logger.info(f"  ↻ {(~nuevos).sum()} usuarios ya existían (reutilizados)")
             
-            usuario = {
-                'email': email,
-                'password_hash': password_hash,
-                'id_rol': id_rol_prof
-            }
+            if nuevos.any():
+                # Hash de passwords temporales en paralelo (un salt por usuario)
+                logger.info(f"  Generando {nuevos.sum()} hashes bcrypt (cost={self.bcrypt_rounds}, workers={self.hash_workers})...")
+                with self.metrics.step('bcrypt', int(nuevos.sum())):
+                    usuarios = pd.DataFrame({
+                        'email': email[nuevos],
+                        'password_hash': hash_passwords(int(nuevos.sum()), self.bcrypt_rounds, self.hash_workers),
+                        'id_rol': id_rol_prof
+                    }, index=email.index[nuevos])
+                id_usuario[nuevos] = self.insert_returning_ids(usuarios, 'usuarios', 'id_usuario', 'email')
+            profesionales.insert(0, 'id_usuario', id_usuario)
             
-            try:
-                df_user = pd.DataFrame([usuario])
-                df_user.to_sql('usuarios', self.engine, if_exists='append', index=False)
-                
-                # Obtener ID recién insertado
-                with self.engine.connect() as conn:
-                    user_result = conn.execute(text(f"SELECT id_usuario FROM usuarios WHERE email = '{email}'"))
-                    id_usuario = user_result.fetchone()[0]
-                
-                # Insertar profesional
-                profesional = {
-                    'id_usuario': id_usuario,
-                    'nombres': nombres,
-                    'id_especialidad': self.maps['especialidades'].get(clean_text(row.get('ESPECIALIDAD'))),
-                    'color_calendario': clean_text(row.get('COLOR_PROFESIONAL')) or '#3B82F6',
-                    'comision_base': float(clean_text(row.get('COMISION_%', 0)) or 0),
-                    'retencion_impuesto': float(clean_text(row.get('RETENCION_%', 0)) or 0),
-                    'activo': 1 if clean_text(row.get('ESTADO', 'ACTIVO')).upper() == 'ACTIVO' else 0
-                }
-                
-                df_prof = pd.DataFrame([profesional])
-                df_prof.to_sql('profesionales', self.engine, if_exists='append', index=False)
-                
-                logger.info(f"  ✓ Profesional: {nombres}")
-                
-            except Exception as e:
-                logger.error(f"  ✗ Error insertando {nombres}: {e}")
-        
-        # Crear mapa nombre profesional → id_profesional
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT id_profesional, nombres FROM profesionales"))
-            self.maps['profesionales'] = {row[1]: row[0] for row in result}
+            # Crear mapa nombre profesional → id_profesional
+            ids = self.upsert_returning_ids(profesionales, 'profesionales', 'id_profesional', 'id_usuario')
+            self.maps['profesionales'].update(zip(profesionales['nombres'], ids))
+            logger.info(f"  ✓ {len(profesionales)} profesionales insertados")
     
     # =================================================
     # FASE 4: SERVICIOS
     # =================================================
     
+    def clean_services(self, df_servicios):
+        """Normaliza DB_SERVICIOS por columna"""
+        return pd.DataFrame({
+            'codigo': clean_text_series(get_column(df_servicios, 'ID_SERVICIO')),
+            'nombre': clean_text_series(get_column(df_servicios, 'NOMBRE_SERVICIO')),
+            'precio_lista': clean_number_series(get_column(df_servicios, 'PRECIO_LISTA')),
+            'modalidad': 'PRESENCIAL',  # Valor por defecto
+            'duracion_minutos': 60  # Valor por defecto
+        })
+    
     def migrate_services(self, df_servicios):
         """Migra DB_SERVICIOS.csv → servicios"""
         logger.info("=== FASE 4: MIGRANDO SERVICIOS ===")
         
-        servicios = []
-        for idx, row in df_servicios.iterrows():
-            servicio = {
-                'codigo': clean_text(row.get('ID_SERVICIO')),
-                'nombre': clean_text(row.get('NOMBRE_SERVICIO')),
-                'precio_lista': clean_number(row.get('PRECIO_LISTA')),
-                'modalidad': 'PRESENCIAL',  # Valor por defecto
-                'duracion_minutos': 60  # Valor por defecto
-            }
-            servicios.append(servicio)
-        
-        if servicios:
-            df_servicios_clean = pd.DataFrame(servicios)
-            df_servicios_clean.to_sql('servicios', self.engine, if_exists='append', index=False)
-            logger.info(f"  ✓ {len(servicios)} servicios insertados")
-        
+        with self.metrics.step('limpieza', len(df_servicios)):
+            df_servicios_clean = self.clean_services(df_servicios)
+
         # Crear mapa código servicio → id_servicio
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT id_servicio, codigo FROM servicios WHERE codigo IS NOT NULL"))
-            self.maps['servicios'] = {row[1]: row[0] for row in result}
+        self.maps['servicios'] = {}
+        if not df_servicios_clean.empty:
+            ids = self.upsert_returning_ids(df_servicios_clean, 'servicios', 'id_servicio', 'codigo')
+            con_codigo = df_servicios_clean['codigo'].notna()
+            self.maps['servicios'] = dict(zip(df_servicios_clean['codigo'][con_codigo], ids[con_codigo]))
+            logger.info(f"  ✓ {len(df_servicios_clean)} servicios insertados")
     
     # =================================================
     # FASE 5: TRANSACCIONES (CRÍTICO)
     # =================================================
     
     def migrate_appointments(self, df_atenciones):
-        """Migra DB_ATENCIONES.csv → citas + detalle_financiero + pagos"""
-        logger.info("=== FASE 5: MIGRANDO CITAS Y FINANZAS ===")
+        """Migra DB_ATENCIONES.csv → citas + detalle_financiero + pagos
         
-        citas = []
-        detalles_financieros = []
-        pagos_list = []
-        fichas_clinicas = []
+        Acepta un DataFrame completo o un iterador de bloques (modo
+        --chunk-rows); cada bloque se transforma y escribe antes de leer
+        el siguiente, de modo que la memoria no depende del tamaño del CSV.
+        """
+        logger.info("=== FASE 5: MIGRANDO CITAS Y FINANZAS ===")
         
         # Obtener ID del estado por defecto (REALIZADA)
-        with self.engine.connect() as conn:
+        with self.connection() as conn:
             estado_result = conn.execute(text("SELECT id_estado FROM estados_cita WHERE codigo = 'REALIZADA'"))
             id_estado_default = estado_result.fetchone()[0]
+        self.build_professional_matcher()
         
-        for idx, row in df_atenciones.iterrows():
-            try:
-                # A) CITAS
-                codigo_cliente = clean_text(row.get('CODIGO CLIENTE'))
-                id_paciente = self.maps['pacientes_rut'].get(codigo_cliente)  # Ajustar según mapeo
-                
-                if not id_paciente:
-                    logger.warning(f"  ⚠ Paciente no encontrado para {codigo_cliente} (fila {idx+2})")
-                    continue
-                
-                nombre_prof = clean_text(row.get('ESPECIALISTA'))
-                id_profesional = self.maps['profesionales'].get(nombre_prof)
-                
-                if not id_profesional:
-                    logger.warning(f"  ⚠ Profesional no encontrado: {nombre_prof} (fila {idx+2})")
-                    continue
-                
-                fecha_inicio = parse_datetime(row.get('FECHA DE ATENCION'), row.get('HORA DE ATENCION'))
-                if not fecha_inicio:
-                    logger.warning(f"  ⚠ Fecha inválida en fila {idx+2}")
+        chunks = [df_atenciones] if isinstance(df_atenciones, pd.DataFrame) else df_atenciones
+        
+        # Con --workers N cada bloque se reparte entre N procesos; los mapas los
+        # abren del almacén en disco (o reciben una copia si no se pudo guardar)
+        pool = nullcontext()
+        if self.workers > 1:
+            logger.info(f"  Usando {self.workers} procesos (partición por {self.shard_by})")
+            maps = (self.map_store.directory if self.map_store.has(APPOINTMENT_MAPS)
+                    else {name: self.maps[name] for name in APPOINTMENT_MAPS})
+            session = (self.session.commit_rows, self.session.relax_checks) if self.session else (None, False)
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_appointment_worker,
+                initargs=(self.db_connection_string, self.writer_backend, self.writer.batch_rows, maps,
+                          self.matcher, log_file(), *session)
+            )
+        
+        totales = {'citas': 0, 'detalle_financiero_cita': 0, 'pagos': 0, 'ficha_clinica': 0}
+        bloques = 0
+        with pool:
+            for chunk in chunks:
+                if chunk.empty:
                     continue
+                bloques += 1
+                if self.chunk_rows:
+                    logger.info(f"  Bloque {bloques}: filas {chunk.index[0]+2}-{chunk.index[-1]+2}")
                 
-                # Calcular fecha_fin (default +60 min)
-                try:
-                    dt_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d %H:%M:%S')
-                    dt_fin = dt_inicio + timedelta(minutes=60)
-                    fecha_fin = dt_fin.strftime('%Y-%m-%d %H:%M:%S')
-                except:
-                    fecha_fin = None
-                
-                cita = {
-                    'codigo_cita': clean_text(row.get('ID_ATENCION')),
-                    'id_paciente': id_paciente,
-                    'id_profesional': id_profesional,
-                    'id_servicio': self.maps['servicios'].get(clean_text(row.get('ID_SERVICIO'))) if clean_text(row.get('ID_SERVICIO')) else None,
-                    'id_estado': int(row.get('ID_ESTADO', id_estado_default)),
-                    'id_ubicacion': 1,  # Por defecto presencial
-                    'fecha_inicio': fecha_inicio,
-                    'fecha_fin': fecha_fin,
-                    'observaciones': clean_text(row.get('OBSERVACION')),
-                    'observacion_migrada': clean_text(row.get('OBSERVACION'))
-                }
-                
-                citas.append(cita)
-                
-                # B) DETALLE FINANCIERO
-                detalle_fin = {
-                    'precio_cobrado': clean_number(row.get('INGRESO')),
-                    'monto_profesional': clean_number(row.get('PAGO ESPECIALISTA (LIQUIDO)')),
-                    'monto_clinica': clean_number(row.get('UTILIDAD')),
-                    'impuesto_retenido': clean_number(row.get('IMPUESTO'))
-                }
-                detalles_financieros.append(detalle_fin)
-                
-                # C) PAGOS (si existe fecha de pago)
-                fecha_pago = parse_date(row.get('FECHA DE PAGO'))
-                if fecha_pago:
-                    pago = {
-                        'fecha_pago': fecha_pago,
-                        'monto': clean_number(row.get('INGRESO')),
-                        'estado_pago': 'CONFIRMADO'
-                    }
-                    pagos_list.append(pago)
+                # Cada bloque queda registrado en la bitácora al confirmarse
+                self.journal.start_chunk('appointments', int(chunk.index[0]),
+                                         self.table_watermarks(PHASE_TABLES['appointments']))
+                if self.workers > 1:
+                    with self.metrics.step('citas en procesos', len(chunk)):
+                        conteo = self.migrate_appointments_sharded(pool, chunk, id_estado_default)
                 else:
-                    pagos_list.append(None)  # Mantener índice sincronizado
-                
-                # D) FICHA CLÍNICA (si observación tiene contenido médico)
-                obs = clean_text(row.get('OBSERVACION'))
-                if obs and len(obs) > 20:  # Filtro básico
-                    ficha = {
-                        'id_paciente': id_paciente,
-                        'observacion_historica': obs
-                    }
-                    fichas_clinicas.append(ficha)
-                else:
-                    fichas_clinicas.append(None)
-                
-            except Exception as e:
-                logger.error(f"  ✗ Error procesando fila {idx+2}: {e}")
-                continue
+                    conteo = self.migrate_appointments_chunk(chunk, id_estado_default)
+                self.commit_session()
+                self.journal.finish_chunk('appointments', int(chunk.index[-1]) + 1, conteo)
+                for tabla, cantidad in conteo.items():
+                    totales[tabla] += cantidad
+        
+        self.report_professional_matches()
+        if self.rejections:
+            logger.warning(f"  ⚠ Filas rechazadas: " + ", ".join(
+                f"{cantidad} {motivo}" for motivo, cantidad in self.rejections.items()))
+        if not self.chunk_rows and self.workers == 1:
+            return
+        logger.info(f"  ✓ Total: {totales['citas']} citas, {totales['detalle_financiero_cita']} detalles, "
+                    f"{totales['pagos']} pagos, {totales['ficha_clinica']} fichas en {bloques} bloques")
+    
+    def shard_appointments(self, df, shards):
+        """Reparte las filas de un bloque en `shards` particiones según self.shard_by
+        
+        'profesional' mantiene todas las citas de un profesional en el mismo
+        proceso (asignación greedy por volumen para balancear); 'fecha' corta
+        el bloque en rangos de fecha contiguos de igual tamaño.
+        """
+        if self.shard_by == 'fecha':
+            fecha = parse_date_series(get_column(df, 'FECHA DE ATENCION')).fillna('')
+            shard = np.empty(len(df), dtype=int)
+            for i, positions in enumerate(np.array_split(fecha.argsort(kind='stable').to_numpy(), shards)):
+                shard[positions] = i
+        else:
+            nombre = clean_text_series(get_column(df, 'ESPECIALISTA')).fillna('')
+            loads = [0] * shards
+            assignment = {}
+            for name, size in nombre.value_counts().items():
+                target = loads.index(min(loads))
+                assignment[name] = target
+                loads[target] += size
+            shard = nombre.map(assignment).to_numpy()
+        
+        return [df[shard == i] for i in range(shards) if (shard == i).any()]
+    
+    def migrate_appointments_sharded(self, pool, df, id_estado_default):
+        """Procesa un bloque en paralelo y combina conteos y rechazos de cada proceso"""
+        futures = [
+            pool.submit(migrate_appointments_shard, shard, id_estado_default)
+            for shard in self.shard_appointments(df, self.workers)
+        ]
+        
+        conteo = {'citas': 0, 'detalle_financiero_cita': 0, 'pagos': 0, 'ficha_clinica': 0}
+        for future in futures:
+            shard_conteo, rechazos, nombres = future.result()
+            for tabla, cantidad in shard_conteo.items():
+                conteo[tabla] += cantidad
+                self.count_rows(tabla, cantidad)
+            self.count_rejections(rechazos)
+            self.matcher.add_rows(nombres)
+        return conteo
+    
+    def build_professional_matcher(self):
+        """Arma el índice de nombres de profesionales con el mapa de la fase staff"""
+        with self.metrics.step('índice de profesionales', len(self.maps['profesionales'])):
+            self.matcher = NameMatcher(self.maps['profesionales'], self.name_threshold)
+    
+    def report_professional_matches(self):
+        """Resume los ESPECIALISTA que no coincidieron exacto y los deja en un CSV para revisión"""
+        review = self.matcher.review()
+        if review.empty:
+            return
+        for row in review[review['estado'] == 'aproximado'].itertuples():
+            logger.warning(f"  ↻ Profesional aproximado: {row.nombre_csv} → {row.profesional} "
+                           f"(similitud {row.similitud}, {row.filas} filas)")
+        resumen = review.groupby('estado', sort=False)['filas'].agg(['size', 'sum'])
+        logger.info("  Nombres de profesional sin coincidencia exacta: " + ", ".join(
+            f"{nombres} {estado} ({filas} filas)" for estado, (nombres, filas) in resumen.iterrows()))
+        path = self.report_directory() / f"{NAME_REVIEW_PREFIX}_{self.metrics.started_at.strftime('%Y%m%d_%H%M%S')}.csv"
+        try:
+            (review.astype({'id_profesional': 'Int64'})
+             .sort_values(['estado', 'filas'], ascending=[True, False])
+             .to_csv(path, index=False, encoding='utf-8-sig'))
+            logger.info(f"  Revisión de nombres en {path}")
+        except OSError as e:
+            logger.warning(f"⚠ No se pudo guardar la revisión de nombres: {e}")
+    
+    def count_rejections(self, rechazos):
+        """Acumula filas rechazadas por motivo"""
+        for motivo, cantidad in rechazos.items():
+            if cantidad:
+                self.rejections[motivo] = self.rejections.get(motivo, 0) + cantidad
+    
+    def clean_appointments(self, df_atenciones, id_estado_default):
+        """Normaliza un bloque de DB_ATENCIONES por columna (FKs quedan como texto)"""
+        fecha_inicio = parse_datetime_series(
+            get_column(df_atenciones, 'FECHA DE ATENCION'),
+            get_column(df_atenciones, 'HORA DE ATENCION')
+        )
+        
+        if 'ID_ESTADO' in df_atenciones.columns:
+            id_estado = parse_int_series(df_atenciones['ID_ESTADO'])
+            id_estado_original = df_atenciones['ID_ESTADO']
+        else:
+            id_estado = pd.Series(id_estado_default, index=df_atenciones.index, dtype=object)
+            id_estado_original = pd.Series(None, index=df_atenciones.index, dtype=object)
+        
+        observacion = clean_text_series(get_column(df_atenciones, 'OBSERVACION'))
+        
+        return pd.DataFrame({
+            'codigo_cita': clean_text_series(get_column(df_atenciones, 'ID_ATENCION')),
+            'codigo_cliente': clean_rut_series(get_column(df_atenciones, 'CODIGO CLIENTE')),
+            'especialista': clean_text_series(get_column(df_atenciones, 'ESPECIALISTA')),
+            'fecha_inicio': fecha_inicio,
+            'fecha_fin': add_minutes_series(fecha_inicio, 60),
+            'id_estado': id_estado,
+            'id_estado_original': id_estado_original,
+            'servicio': clean_text_series(get_column(df_atenciones, 'ID_SERVICIO')),
+            'observacion': observacion,
+            'precio_cobrado': clean_number_series(get_column(df_atenciones, 'INGRESO')),
+            'monto_profesional': clean_number_series(get_column(df_atenciones, 'PAGO ESPECIALISTA (LIQUIDO)')),
+            'monto_clinica': clean_number_series(get_column(df_atenciones, 'UTILIDAD')),
+            'impuesto_retenido': clean_number_series(get_column(df_atenciones, 'IMPUESTO')),
+            'fecha_pago': parse_date_series(get_column(df_atenciones, 'FECHA DE PAGO')),
+            'con_ficha': observacion.notna() & (observacion.astype(str).str.len() > 20)  # Filtro básico
+        })
+    
+    def migrate_appointments_chunk(self, df_atenciones, id_estado_default):
+        """Transforma y escribe un bloque de DB_ATENCIONES; retorna filas insertadas por tabla"""
+        conteo = {'citas': 0, 'detalle_financiero_cita': 0, 'pagos': 0, 'ficha_clinica': 0}
+        
+        # A) VALIDACIÓN Y RESOLUCIÓN DE FKs (por columna)
+        with self.metrics.step('limpieza', len(df_atenciones)):
+            clean = self.clean_appointments(df_atenciones, id_estado_default)
+        codigo_cliente = clean['codigo_cliente']
+        # CODIGO CLIENTE trae el RUT o el código de cliente de DB_CLIENTES
+        id_paciente = self.maps['pacientes_rut'].lookup(codigo_cliente)
+        if len(self.maps['pacientes_cod']):
+            id_paciente = id_paciente.fillna(self.maps['pacientes_cod'].lookup(codigo_cliente))
+        
+        nombre_prof = clean['especialista']
+        id_profesional = self.matcher.lookup(nombre_prof)
+        
+        fecha_inicio = clean['fecha_inicio']
+        id_estado = clean['id_estado']
+        
+        # Cada fila se rechaza por el primer motivo que aplique
+        sin_paciente = id_paciente.isna()
+        sin_profesional = ~sin_paciente & id_profesional.isna()
+        sin_fecha = ~sin_paciente & ~sin_profesional & fecha_inicio.isna()
+        estado_invalido = ~sin_paciente & ~sin_profesional & ~sin_fecha & id_estado.isna()
+        
+        for idx in df_atenciones.index[sin_paciente]:
+            logger.warning(f"  ⚠ Paciente no encontrado para {codigo_cliente[idx]} (fila {idx+2})")
+        for idx in df_atenciones.index[sin_profesional]:
+            logger.warning(f"  ⚠ Profesional no encontrado: {nombre_prof[idx]} (fila {idx+2})")
+        for idx in df_atenciones.index[sin_fecha]:
+            logger.warning(f"  ⚠ Fecha inválida en fila {idx+2}")
+        for idx in df_atenciones.index[estado_invalido]:
+            logger.error(f"  ✗ Error procesando fila {idx+2}: ID_ESTADO inválido ({clean.at[idx, 'id_estado_original']})")
+        self.count_rejections({
+            'sin paciente': int(sin_paciente.sum()),
+            'sin profesional': int(sin_profesional.sum()),
+            'fecha inválida': int(sin_fecha.sum()),
+            'estado inválido': int(estado_invalido.sum()),
+        })
+        
+        validas = ~(sin_paciente | sin_profesional | sin_fecha | estado_invalido)
+        df = clean[validas]
+        
+        # B) CITAS (fecha_fin por defecto +60 min)
+        df_citas = pd.DataFrame({
+            'codigo_cita': df['codigo_cita'],
+            'id_paciente': id_paciente[validas],
+            'id_profesional': id_profesional[validas],
+            'id_servicio': df['servicio'].map(self.maps['servicios']).astype('Int64'),
+            'id_estado': df['id_estado'].astype('int64'),
+            'id_ubicacion': 1,  # Por defecto presencial
+            'fecha_inicio': df['fecha_inicio'],
+            'fecha_fin': df['fecha_fin'],
+            'observaciones': df['observacion'],
+            'observacion_migrada': df['observacion']
+        })
+        
+        # C) DETALLE FINANCIERO
+        df_detalles = df[['precio_cobrado', 'monto_profesional', 'monto_clinica', 'impuesto_retenido']].copy()
+        
+        # D) PAGOS (si existe fecha de pago)
+        df_pagos = pd.DataFrame({
+            'fecha_pago': df['fecha_pago'],
+            'monto': df['precio_cobrado'],
+            'estado_pago': 'CONFIRMADO'
+        })[df['fecha_pago'].notna()]
+        
+        # E) FICHA CLÍNICA (si observación tiene contenido médico)
+        df_fichas = pd.DataFrame({
+            'id_paciente': id_paciente[validas],
+            'observacion_historica': df['observacion']
+        })[df['con_ficha']]
         
         # INSERTAR CITAS
-        if citas:
-            df_citas = pd.DataFrame(citas)
-            df_citas.to_sql('citas', self.engine, if_exists='append', index=False)
-            logger.info(f"  ✓ {len(citas)} citas insertadas")
-            
-            # Obtener IDs de citas recién insertadas
-            with self.engine.connect() as conn:
-                result = conn.execute(text("SELECT id_cita, codigo_cita FROM citas WHERE codigo_cita IS NOT NULL ORDER BY id_cita"))
-                citas_ids = {row[1]: row[0] for row in result}
+        if not df_citas.empty:
+            # IDs de las citas capturados al insertar (por posición, O(bloque))
+            id_cita = self.insert_returning_ids(df_citas, 'citas', 'id_cita', 'codigo_cita')
+            logger.info(f"  ✓ {len(df_citas)} citas insertadas")
+            conteo['citas'] = len(df_citas)
             
             # INSERTAR DETALLES FINANCIEROS
-            detalles_con_id = []
-            for i, detalle in enumerate(detalles_financieros):
-                codigo = citas[i]['codigo_cita']
-                id_cita = citas_ids.get(codigo)
-                if id_cita and detalle:
-                    detalle['id_cita'] = id_cita
-                    detalles_con_id.append(detalle)
+            df_detalles['id_cita'] = id_cita
+            df_detalles = df_detalles[df_detalles['id_cita'].notna()]
             
-            if detalles_con_id:
-                df_detalles = pd.DataFrame(detalles_con_id)
-                df_detalles.to_sql('detalle_financiero_cita', self.engine, if_exists='append', index=False)
-                logger.info(f"  ✓ {len(detalles_con_id)} detalles financieros insertados")
+            if not df_detalles.empty:
+                self.write(df_detalles, 'detalle_financiero_cita')
+                logger.info(f"  ✓ {len(df_detalles)} detalles financieros insertados")
+                conteo['detalle_financiero_cita'] = len(df_detalles)
             
             # INSERTAR PAGOS
-            pagos_con_id = []
-            for i, pago in enumerate(pagos_list):
-                if pago:
-                    codigo = citas[i]['codigo_cita']
-                    id_cita = citas_ids.get(codigo)
-                    if id_cita:
-                        pago['id_cita'] = id_cita
-                        pago['id_metodo_pago'] = 1  # Default: Efectivo
-                        pagos_con_id.append(pago)
+            df_pagos['id_cita'] = id_cita.reindex(df_pagos.index)  # reindex: df_pagos puede estar vacío
+            df_pagos['id_metodo_pago'] = 1  # Default: Efectivo
+            df_pagos = df_pagos[df_pagos['id_cita'].notna()]
             
-            if pagos_con_id:
-                df_pagos = pd.DataFrame(pagos_con_id)
-                df_pagos.to_sql('pagos', self.engine, if_exists='append', index=False)
-                logger.info(f"  ✓ {len(pagos_con_id)} pagos insertados")
+            if not df_pagos.empty:
+                self.write(df_pagos, 'pagos')
+                logger.info(f"  ✓ {len(df_pagos)} pagos insertados")
+                conteo['pagos'] = len(df_pagos)
             
             # INSERTAR FICHAS CLÍNICAS
-            fichas_con_id = []
-            for i, ficha in enumerate(fichas_clinicas):
-                if ficha:
-                    codigo = citas[i]['codigo_cita']
-                    id_cita = citas_ids.get(codigo)
-                    if id_cita:
-                        ficha['id_cita'] = id_cita
-                        fichas_con_id.append(ficha)
+            df_fichas['id_cita'] = id_cita.reindex(df_fichas.index)
+            df_fichas = df_fichas[df_fichas['id_cita'].notna()]
+            
+            if not df_fichas.empty:
+                self.write(df_fichas, 'ficha_clinica')
+                logger.info(f"  ✓ {len(df_fichas)} fichas clínicas insertadas")
+                conteo['ficha_clinica'] = len(df_fichas)
+        
+        return conteo
+    
+    # =================================================
+    # CHECKPOINTS Y REANUDACIÓN
+    # =================================================
+    
+    def table_watermarks(self, tables):
+        """MAX(id) actual de cada tabla (0 si está vacía)"""
+        with self.connection() as conn:
+            return {
+                table: conn.execute(text(f"SELECT COALESCE(MAX({PRIMARY_KEYS[table]}), 0) FROM {table}")).scalar()
+                for table in tables
+            }
+    
+    def rollback_above(self, watermarks):
+        """Borra las filas insertadas sobre el watermark (en el orden dado: hijas primero)"""
+        with self.connection(write=True) as conn:
+            for table, max_id in watermarks.items():
+                deleted = conn.execute(
+                    text(f"DELETE FROM {table} WHERE {PRIMARY_KEYS[table]} > :max_id"), {'max_id': max_id}
+                ).rowcount
+                if deleted:
+                    logger.warning(f"  ⚠ {deleted} filas de {table} de la corrida interrumpida eliminadas")
+    
+    def store_maps(self, phase):
+        """Guarda los mapas de una fase en el almacén y los reemplaza por su versión mapeada desde disco"""
+        names = [name for name in PHASE_MAPS[phase] if name in self.maps]
+        if not names or not self.USES_ID_MAPS:
+            return
+        with self.metrics.step(f'guardar mapas {phase}', sum(len(self.maps[name]) for name in names)):
+            try:
+                self.map_store.save({name: self.maps[name] for name in names})
+            except OSError as e:
+                logger.warning(f"⚠ No se pudieron guardar los mapas de '{phase}' en {self.map_store.directory}: {e}")
+                return
+            self.maps.update(self.map_store.load(names))
+    
+    def load_maps(self, phase):
+        """Mapas de una fase ya completada: del almacén en disco o, si no están, de la BD"""
+        maps = self.map_store.load(PHASE_MAPS[phase]) if PHASE_MAPS[phase] else None
+        if maps is None:
+            self.load_maps_from_db(phase)
+            return
+        with self.metrics.step(f'mapas {phase}', sum(len(value) for value in maps.values())):
+            self.maps.update(maps)
+        logger.info(f"  ↷ Mapas de '{phase}' desde {self.map_store.directory}")
+    
+    def load_client_codes(self):
+        """CodeIndex de códigos de cliente desde DB_CLIENTES.csv, resueltos por el RUT de su fila
+        
+        Los códigos no quedan en la BD: sin el CSV, CODIGO CLIENTE solo se resuelve por RUT.
+        """
+        filepath = self.csv_path / 'DB_CLIENTES.csv'
+        if not filepath.exists():
+            logger.warning(f"⚠ {filepath} no existe: las citas solo se resuelven por RUT (no por código de cliente)")
+            return CodeIndex()
+        df_clientes = read_export(filepath, columns={'RUT', CLIENT_CODE_COLUMN})
+        rut = clean_rut_series(get_column(df_clientes, 'RUT'))
+        return self.index_client_codes(df_clientes, self.maps['pacientes_rut'].lookup(rut))
+    
+    def load_maps_from_db(self, phase):
+        """Reconstruye los mapas de una fase ya completada leyendo la BD"""
+        with self.metrics.step(f'mapas {phase}') as step, self.connection() as conn:
+            if phase == 'masters':
+                self.maps['comunas'] = dict((row[1], row[0]) for row in conn.execute(
+                    text("SELECT id_comuna, nombre FROM comunas")))
+                self.maps['previsiones'] = dict((row[1].lower(), row[0]) for row in conn.execute(
+                    text("SELECT id_prevision, nombre FROM previsiones")))
+                self.maps['especialidades'] = dict((row[1], row[0]) for row in conn.execute(
+                    text("SELECT id_especialidad, nombre FROM especialidades")))
+            elif phase == 'patients':
+                rows = conn.execute(text("SELECT id_paciente, rut FROM pacientes WHERE rut IS NOT NULL")).fetchall()
+                self.maps['pacientes_rut'] = RutIndex([row[1] for row in rows], [row[0] for row in rows])
+                self.maps['pacientes_cod'] = self.load_client_codes()
+            elif phase == 'staff':
+                self.maps['profesionales'] = dict((row[1], row[0]) for row in conn.execute(
+                    text("SELECT id_profesional, nombres FROM profesionales ORDER BY id_profesional")))
+            elif phase == 'services':
+                self.maps['servicios'] = dict((row[1], row[0]) for row in conn.execute(
+                    text("SELECT id_servicio, codigo FROM servicios WHERE codigo IS NOT NULL")))
+            step['rows'] = sum(len(self.maps.get(name, ())) for name in PHASE_MAPS[phase])
+    
+    def run_phase(self, name, method, *args):
+        """Ejecuta una fase registrándola en la bitácora
+        
+        Con --resume, una fase ya completada solo recarga sus mapas; una fase
+        interrumpida se deshace hasta su watermark (o el de su último bloque)
+        y se vuelve a ejecutar.
+        """
+        with self.metrics.phase(name) as step:
+            step['rows'] = self.run_journaled_phase(name, method, *args)
+    
+    def run_journaled_phase(self, name, method, *args):
+        """Cuerpo de run_phase; retorna las filas escritas por la fase"""
+        phase = self.journal.phase(name)
+        if phase['status'] == 'done':
+            logger.info(f"↷ Fase '{name}' completada en una corrida anterior, se omite")
+            self.load_maps(name)
+            return 0
+        
+        if phase['status'] == 'running':
+            logger.warning(f"⚠ Fase '{name}' quedó incompleta, deshaciendo escrituras parciales...")
+            if 'chunk' in phase:
+                self.rollback_above(phase['chunk']['watermarks'])
+            elif 'next_row' not in phase:
+                self.rollback_above(phase['watermarks'])
+            phase.pop('chunk', None)
+        
+        with self.rows_lock:
+            rows_before = dict(self.rows_written)
+        self.journal.start_phase(name, self.table_watermarks(PHASE_TABLES[name]))
+        method(*args)
+        self.commit_session()
+        self.store_maps(name)
+        
+        with self.rows_lock:
+            rows = {
+                table: self.rows_written.get(table, 0) - rows_before.get(table, 0)
+                for table in PHASE_TABLES[name]
+            }
+        # Las citas ya acumulan sus conteos bloque a bloque en la bitácora
+        self.journal.finish_phase(name, {} if name == 'appointments' else rows)
+        return sum(rows.values())
+    
+    def run_phases(self, phases):
+        """Ejecuta las fases respetando PHASE_DEPENDENCIES, las independientes en paralelo
+        
+        phases: {nombre: (método, args)}. Una fase se lanza apenas terminan
+        las fases de las que depende (las ausentes se consideran cumplidas),
+        así el tiempo total queda acotado por la rama más lenta y no por la
+        suma. Si una fase falla no se lanzan más fases y se propaga el error.
+        """
+        pending = dict(phases)
+        running = {}
+        timings = {}  # nombre → (inicio, fin) relativos al inicio
+        start = time.perf_counter()
+        
+        def timed(name, method, args):
+            phase_start = time.perf_counter() - start
+            self.run_phase(name, method, *args)
+            missing = [map_name for map_name in PHASE_MAPS[name] if map_name not in self.maps]
+            if missing and self.USES_ID_MAPS:
+                raise RuntimeError(f"La fase '{name}' no produjo los mapas {', '.join(missing)}")
+            return phase_start, time.perf_counter() - start
+        
+        with ThreadPoolExecutor(max_workers=self.phase_workers, thread_name_prefix='fase') as pool:
+            while pending or running:
+                ready = [name for name in pending
+                         if all(dep in timings or dep not in phases for dep in PHASE_DEPENDENCIES[name])]
+                for name in ready:
+                    method, args = pending.pop(name)
+                    running[pool.submit(timed, name, method, args)] = name
+                
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    timings[name] = future.result()
+        
+        self.log_critical_path(timings, time.perf_counter() - start)
+    
+    def log_critical_path(self, timings, elapsed):
+        """Reporta la duración de cada fase y la ruta crítica del grafo"""
+        path = [max(timings, key=lambda name: timings[name][1])]
+        while True:
+            deps = [dep for dep in PHASE_DEPENDENCIES[path[-1]] if dep in timings]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda dep: timings[dep][1]))
+        path.reverse()
+        
+        logger.info("Duración por fase:")
+        for name, (phase_start, phase_end) in sorted(timings.items(), key=lambda item: item[1][0]):
+            logger.info(f"  {name:<13} {phase_start:8.1f}s → {phase_end:8.1f}s ({phase_end - phase_start:.1f}s)")
+        total = sum(phase_end - phase_start for phase_start, phase_end in timings.values())
+        logger.info(f"  Ruta crítica: {' → '.join(path)} | total {elapsed:.1f}s (suma de fases {total:.1f}s)")
+    
+    def prepare_journal(self):
+        """Registra los hashes de los CSVs; al reanudar exige que no hayan cambiado"""
+        inputs = {
+            filename: file_sha256(self.csv_path / filename)
+            for filename in CSV_FILES if (self.csv_path / filename).exists()
+        }
+        
+        if self.resume:
+            if not self.journal.data['phases']:
+                logger.warning(f"⚠ No hay bitácora previa en {self.journal.path}, se ejecuta la migración completa")
+            else:
+                previous = self.journal.data.get('inputs', {})
+                changed = sorted(f for f in set(inputs) | set(previous) if inputs.get(f) != previous.get(f))
+                if changed:
+                    logger.error(f"✗ No se puede reanudar: cambiaron los CSVs {', '.join(changed)}")
+                    return False
+                logger.info(f"Reanudando desde {self.journal.path}")
+        
+        if not self.journal.data['phases']:
+            self.map_store.clear()  # Son de otra corrida
+        self.journal.data['inputs'] = inputs
+        self.journal.save()
+        return True
+    
+    # =================================================
+    # SINCRONIZACIÓN INCREMENTAL (--delta / --watch)
+    # =================================================
+    
+    def record_fingerprints(self):
+        """Guarda las huellas de todas las filas migradas (línea base para --delta)"""
+        logger.info("Registrando huellas por fila para sincronización incremental...")
+        self.fingerprints.ensure_table()
+        
+        for source in DELTA_SOURCES:
+            if not (self.csv_path / source).exists():
+                continue
+            chunks = self.load_csv(source, chunk_rows=self.chunk_rows)
+            if isinstance(chunks, pd.DataFrame):
+                chunks = [chunks]
+            parts = [row_fingerprints(chunk, source) for chunk in chunks]
+            fingerprints = combine_fingerprints(pd.concat(parts)) if parts else pd.Series(dtype='int64')
+            
+            # Citas rechazadas quedan marcadas: el delta las reintenta si su fila cambia
+            rejected = pd.Index([])
+            if source == 'DB_ATENCIONES.csv':
+                with self.connection() as conn:
+                    migrated = set(conn.execute(
+                        text("SELECT codigo_cita FROM citas WHERE codigo_cita IS NOT NULL")).scalars())
+                rejected = fingerprints.index[~fingerprints.index.isin(migrated)]
+            
+            self.fingerprints.save(source, fingerprints, replace=True, rejected=rejected)
+            logger.info(f"  ✓ {source}: {len(fingerprints)} huellas"
+                        + (f" ({len(rejected)} citas rechazadas)" if len(rejected) else ""))
+    
+    def delete_appointments(self, codigos):
+        """Borra citas (y sus detalles, pagos y fichas) por codigo_cita; retorna cuántas"""
+        ids = list(self.lookup_ids('citas', 'id_cita', 'codigo_cita', codigos).values())
+        with self.connection(write=True) as conn:
+            for i in range(0, len(ids), ID_LOOKUP_BATCH):
+                for table in PHASE_TABLES['appointments']:  # hijas primero, citas al final
+                    conn.execute(text(f"DELETE FROM {table} WHERE id_cita IN :ids").bindparams(
+                        bindparam('ids', expanding=True)), {'ids': ids[i:i + ID_LOOKUP_BATCH]})
+        return len(ids)
+    
+    def set_active(self, table, key_column, keys, active):
+        """Marca activo en las filas cuyo key_column esté en keys (bajas y reingresos del CSV)"""
+        keys = list(keys)
+        stmt = text(f"UPDATE {table} SET activo = :activo WHERE {key_column} IN :keys").bindparams(
+            bindparam('keys', expanding=True))
+        with self.connection(write=True) as conn:
+            for i in range(0, len(keys), ID_LOOKUP_BATCH):
+                conn.execute(stmt, {'activo': active, 'keys': keys[i:i + ID_LOOKUP_BATCH]})
+    
+    def sync_delta(self):
+        """Aplica el delta desde la última corrida y guarda sus métricas"""
+        success = self.apply_delta()
+        self.write_metrics('delta', success)
+        return success
+    
+    def apply_delta(self):
+        """Aplica solo las filas nuevas, modificadas o eliminadas desde la última corrida
+        
+        Maestros y staff son pequeños y se re-aplican completos (upsert);
+        pacientes, servicios y citas se comparan por huella contra
+        etl_fingerprints. Pacientes y servicios eliminados se desactivan;
+        las citas modificadas o eliminadas se borran (con sus hijas) y las
+        modificadas se vuelven a insertar. Las citas rechazadas antes solo
+        se reintentan si su fila cambió o si llegaron pacientes o
+        profesionales nuevos.
+        """
+        logger.info("=" * 60)
+        logger.info("SINCRONIZACIÓN INCREMENTAL: CSV → MySQL")
+        logger.info("=" * 60)
+        
+        try:
+            self.fingerprints.ensure_table()
+            
+            df_clientes = self.load_csv('DB_CLIENTES.csv')
+            df_equipo = self.load_csv('DB_CONFIG_EQUIPO.csv')
+            df_servicios = self.load_csv('DB_SERVICIOS.csv')
+            df_atenciones = self.load_csv('DB_ATENCIONES.csv')
+            
+            if df_clientes is None or df_equipo is None:
+                logger.error("No se pudieron cargar los CSVs necesarios")
+                return False
+            
+            with self.metrics.phase('masters'):
+                self.migrate_dynamic_masters(df_clientes, df_equipo)
+            profesionales = self.table_watermarks(['profesionales'])['profesionales']
+            with self.metrics.phase('staff'):
+                self.migrate_staff(df_equipo)
+            # Referencias nuevas pueden resolver citas rechazadas en corridas anteriores
+            new_references = self.table_watermarks(['profesionales'])['profesionales'] > profesionales
+            
+            # Pacientes
+            with self.metrics.phase('patients'):
+                fingerprints = row_fingerprints(df_clientes, 'DB_CLIENTES.csv')
+                inserted, changed, deleted = self.delta_summary('DB_CLIENTES.csv', fingerprints)
+                rut = clean_rut_series(get_column(df_clientes, 'RUT'))
+                if len(inserted) or len(changed):
+                    self.migrate_patients(df_clientes[rut.isin(inserted.union(changed))])
+                self.set_active('pacientes', 'rut', inserted, True)
+                self.set_active('pacientes', 'rut', deleted, False)
+                self.fingerprints.save('DB_CLIENTES.csv', fingerprints[inserted.union(changed)], deleted)
+                self.load_maps_from_db('patients')
+                new_references |= bool(len(inserted) or len(changed))
+            
+            # Servicios
+            with self.metrics.phase('services'):
+                if df_servicios is not None:
+                    fingerprints = row_fingerprints(df_servicios, 'DB_SERVICIOS.csv')
+                    inserted, changed, deleted = self.delta_summary('DB_SERVICIOS.csv', fingerprints)
+                    codigo = clean_text_series(get_column(df_servicios, 'ID_SERVICIO'))
+                    if len(inserted) or len(changed):
+                        self.migrate_services(df_servicios[codigo.isin(inserted.union(changed))])
+                    self.set_active('servicios', 'codigo', inserted, True)
+                    self.set_active('servicios', 'codigo', deleted, False)
+                    self.fingerprints.save('DB_SERVICIOS.csv', fingerprints[inserted.union(changed)], deleted)
+                self.load_maps_from_db('services')
             
-            if fichas_con_id:
-                df_fichas = pd.DataFrame(fichas_con_id)
-                df_fichas.to_sql('ficha_clinica', self.engine, if_exists='append', index=False)
-                logger.info(f"  ✓ {len(fichas_con_id)} fichas clínicas insertadas")
+            # Citas: las modificadas se borran y se vuelven a insertar
+            with self.metrics.phase('appointments'):
+                if df_atenciones is not None:
+                    fingerprints = row_fingerprints(df_atenciones, 'DB_ATENCIONES.csv')
+                    inserted, changed, deleted = self.delta_summary('DB_ATENCIONES.csv', fingerprints)
+                    pending = inserted.union(changed)
+                    if new_references:
+                        retry = self.fingerprints.rejected('DB_ATENCIONES.csv').intersection(fingerprints.index)
+                        if len(retry.difference(pending)):
+                            logger.info(f"  ↻ {len(retry.difference(pending))} citas rechazadas se reintentan "
+                                        "(pacientes o profesionales nuevos)")
+                        pending = pending.union(retry)
+                    removed = self.delete_appointments(pending.union(deleted))
+                    if removed:
+                        logger.info(f"  {removed} citas previas eliminadas para re-aplicar")
+                
+                    if len(pending):
+                        with self.connection() as conn:
+                            id_estado_default = conn.execute(
+                                text("SELECT id_estado FROM estados_cita WHERE codigo = 'REALIZADA'")).scalar()
+                        codigo = clean_text_series(get_column(df_atenciones, 'ID_ATENCION'))
+                        self.build_professional_matcher()
+                        self.migrate_appointments_chunk(df_atenciones[codigo.isin(pending)], id_estado_default)
+                        self.report_professional_matches()
+                
+                    # Las que no quedaron en la BD se marcan rechazadas: no se reintentan mientras no cambien
+                    migrated = self.lookup_ids('citas', 'id_cita', 'codigo_cita', pending)
+                    self.fingerprints.save('DB_ATENCIONES.csv', fingerprints[pending], deleted,
+                                           rejected=pending[~pending.isin(list(migrated))])
+            
+            self.close_session()
+            logger.info("✓ SINCRONIZACIÓN INCREMENTAL COMPLETADA")
+            return True
+            
+        except Exception as e:
+            logger.error(f"✗ ERROR EN SINCRONIZACIÓN INCREMENTAL: {e}")
+            self.close_session(success=False)
+            return False
+    
+    def delta_summary(self, source, fingerprints):
+        """Calcula el delta de una fuente y lo reporta"""
+        inserted, changed, deleted = self.fingerprints.diff(source, fingerprints)
+        logger.info(f"  {source}: {len(inserted)} nuevas, {len(changed)} modificadas, {len(deleted)} eliminadas")
+        return inserted, changed, deleted
+    
+    def watch(self, interval=WATCH_INTERVAL):
+        """Revisa los CSVs cada `interval` segundos y aplica deltas cuando cambian
+        
+        Un cambio se aplica solo cuando los archivos quedan iguales en dos
+        revisiones seguidas, para no leer un export a medio escribir.
+        """
+        logger.info(f"Observando {self.csv_path} cada {interval}s (Ctrl+C para terminar)...")
+        applied = None
+        previous = None
+        try:
+            while True:
+                current = {
+                    filename: file_sha256(self.csv_path / filename)
+                    for filename in CSV_FILES if (self.csv_path / filename).exists()
+                }
+                if current == previous and current != applied:
+                    if self.sync_delta():
+                        applied = current
+                previous = current
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Observación detenida")
+        return True
     
     # =================================================
     # EJECUTOR PRINCIPAL
     # =================================================
     
     def run_migration(self):
+        """Ejecuta todo el proceso ETL y guarda sus métricas"""
+        success = self.migrate_all()
+        self.write_metrics('completa', success)
+        return success
+    
+    def dry_run(self):
+        """Ensayo completo: migra, ejecuta el verificador sobre la misma BD y guarda las métricas"""
+        success = self.migrate_all()
+        if success:
+            with self.metrics.phase('verificación'):
+                success = run_verification(self.engine)
+        self.write_metrics('ensayo', success)
+        return success
+    
+    def write_metrics(self, mode, success):
+        """Escribe las métricas de la corrida junto a migration.log y las reinicia (--watch)"""
+        try:
+            path = self.metrics.write(self.report_directory(), {
+                'modo': mode,
+                'exito': success,
+                'motor': type(self).__name__,
+                'writer': self.writer_backend,
+                'chunk_rows': self.chunk_rows,
+                'phase_workers': self.phase_workers,
+                'workers': self.workers,
+                'commit_rows': self.session.commit_rows if self.session else None,
+                'relax_checks': bool(self.session and self.session.relax_checks),
+                'commits': self.session.stats if self.session else {},
+                'defer_indexes': bool(self.indexes),
+                'link_patients': self.link_patients,
+                'filas_escritas': dict(self.rows_written),
+                'rechazos': dict(self.rejections),
+            })
+            logger.info(f"Métricas de la corrida en {path}")
+        except OSError as e:
+            logger.warning(f"⚠ No se pudieron guardar las métricas: {e}")
+        self.metrics.reset()
+    
+    def migrate_all(self):
         """Ejecuta todo el proceso ETL"""
         logger.info("=" * 60)
         logger.info("INICIANDO MIGRACIÓN ETL: CSV → MySQL")
         logger.info("=" * 60)
         
         try:
+            if not self.prepare_journal():
+                return False
+            
             # Cargar CSVs
             df_clientes = self.load_csv('DB_CLIENTES.csv')
             df_equipo = self.load_csv('DB_CONFIG_EQUIPO.csv')
             df_servicios = self.load_csv('DB_SERVICIOS.csv')
-            df_atenciones = self.load_csv('DB_ATENCIONES.csv')
+            df_atenciones = self.load_csv('DB_ATENCIONES.csv', chunk_rows=self.chunk_rows,
+                                          skip_rows=self.journal.next_row('appointments'))
             
             if df_clientes is None or df_equipo is None:
                 logger.error("No se pudieron cargar los CSVs necesarios")
                 return False
             
-            # Ejecutar fases
-            self.migrate_dynamic_masters(df_clientes, df_equipo)
-            self.migrate_patients(df_clientes)
-            self.migrate_staff(df_equipo)
-            
+            self.defer_indexes()
+            # Ejecutar fases (las independientes en paralelo, ver PHASE_DEPENDENCIES)
+            phases = {
+                'masters': (self.migrate_dynamic_masters, (df_clientes, df_equipo)),
+                'patients': (self.migrate_patients, (df_clientes,)),
+                'staff': (self.migrate_staff, (df_equipo,)),
+            }
             if df_servicios is not None:
-                self.migrate_services(df_servicios)
-            
+                phases['services'] = (self.migrate_services, (df_servicios,))
             if df_atenciones is not None:
-                self.migrate_appointments(df_atenciones)
+                phases['appointments'] = (self.migrate_appointments, (df_atenciones,))
+            self.run_phases(phases)
+            with self.metrics.phase('fingerprints'):
+                self.record_fingerprints()
+            self.close_session()
+            self.rebuild_indexes()
             
             logger.info("=" * 60)
             logger.info("✓ MIGRACIÓN COMPLETADA EXITOSAMENTE")
@@ -556,30 +3314,488 @@ class ETLMigration:
             
         except Exception as e:
             logger.error(f"✗ ERROR CRÍTICO EN MIGRACIÓN: {e}")
+            self.close_session(success=False)
+            self.rebuild_indexes(success=False)
             return False
 
+# =====================================================
+# MOTOR SQL CON TABLAS DE STAGING (--transform sql)
+# =====================================================
+
+TRANSFORMS = ['pandas', 'sql']
+
+# Tablas de staging: valores ya limpios por columna, FKs aún como texto
+STAGING_TABLES = {
+    'stg_pacientes': """
+        fila INT NOT NULL PRIMARY KEY,
+        rut VARCHAR(20),
+        nombres VARCHAR(100),
+        apellidos VARCHAR(100),
+        email VARCHAR(150),
+        telefono VARCHAR(50),
+        direccion TEXT,
+        fecha_nacimiento VARCHAR(10),
+        isapre VARCHAR(100),
+        comuna VARCHAR(100),
+        id_prevision INT,
+        id_comuna INT
+    """,
+    'stg_previsiones': """
+        fila INT NOT NULL PRIMARY KEY,
+        clave VARCHAR(100) NOT NULL,
+        id_prevision INT NOT NULL
+    """,
+    'stg_servicios': """
+        fila INT NOT NULL PRIMARY KEY,
+        codigo VARCHAR(50),
+        nombre VARCHAR(150),
+        precio_lista BIGINT,
+        modalidad VARCHAR(50),
+        duracion_minutos INT
+    """,
+    'stg_atenciones': """
+        fila INT NOT NULL PRIMARY KEY,
+        codigo_cita VARCHAR(50),
+        codigo_enlace VARCHAR(60) NOT NULL,
+        codigo_cliente VARCHAR(100),
+        especialista VARCHAR(100),
+        fecha_inicio VARCHAR(19),
+        fecha_fin VARCHAR(19),
+        id_estado INT,
+        id_estado_original VARCHAR(50),
+        servicio VARCHAR(50),
+        observacion TEXT,
+        precio_cobrado BIGINT,
+        monto_profesional BIGINT,
+        monto_clinica BIGINT,
+        impuesto_retenido BIGINT,
+        fecha_pago VARCHAR(10),
+        con_ficha INT,
+        id_paciente INT,
+        id_profesional INT,
+        id_servicio INT
+    """,
+}
+
+STAGING_INDEXES = {
+    'stg_pacientes': ['rut'],
+    'stg_previsiones': ['clave'],
+    'stg_servicios': ['codigo'],
+    'stg_atenciones': ['codigo_enlace'],
+}
+
+# Prefijo temporal de codigo_cita para enlazar citas sin ID_ATENCION con sus hijas
+STAGING_LINK_PREFIX = '#stg#'
+
+class StagedETLMigration(ETLMigration):
+    """Variante de ETLMigration que resuelve FKs e inserta con SQL set-based
+    
+    Pacientes, servicios y citas se limpian por columna con las mismas
+    funciones del camino pandas, se cargan en tablas stg_* con el writer
+    configurado y luego la BD hace la resolución de previsión, comuna,
+    paciente y servicio y los INSERT ... SELECT ... JOIN. El profesional
+    llega resuelto a stg_atenciones (NameMatcher, igual que en pandas).
+    Maestros y staff (pocas filas, bcrypt) siguen el camino pandas.
+    """
+    
+    USES_ID_MAPS = False
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.workers > 1:
+            logger.warning("⚠ --workers no aplica con --transform sql (la BD hace el trabajo); se usa 1 proceso")
+            self.workers = 1
+        self.staging_ready = set()
+    
+    def same_text(self, left, right):
+        """Igualdad de texto exacta como en los dict de pandas (MySQL compara sin mayúsculas)"""
+        if self.engine.dialect.name == 'mysql':
+            # La primera igualdad usa el índice; la segunda descarta coincidencias por collation
+            return f"{left} = {right} AND {left} COLLATE utf8mb4_bin = {right}"
+        return f"{left} = {right}"
+    
+    def load_staging(self, table, df):
+        """(Re)carga una tabla de staging con las filas limpias de df (columna fila = índice del CSV)"""
+        with self.metrics.step(f'staging {table}', len(df)):
+            with self.connection(write=True) as conn:
+                if table not in self.staging_ready:
+                    conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+                    conn.execute(text(f"CREATE TABLE {table} ({STAGING_TABLES[table]})"))
+                    for column in STAGING_INDEXES[table]:
+                        conn.execute(text(f"CREATE INDEX idx_{table}_{column} ON {table} ({column})"))
+                    self.staging_ready.add(table)
+                else:
+                    conn.execute(text(f"DELETE FROM {table}"))
+            self.writer.write(df.assign(fila=df.index), table)
+    
+    def drop_staging_tables(self):
+        with self.engine.begin() as conn:
+            for table in self.staging_ready:
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        self.staging_ready.clear()
+    
+    def migrate_patients(self, df_clientes):
+        """Migra DB_CLIENTES.csv → pacientes vía stg_pacientes"""
+        logger.info("=== FASE 2: MIGRANDO PACIENTES (SQL) ===")
+        with self.metrics.step('limpieza', len(df_clientes)):
+            clean = self.clean_patients(df_clientes)
+        if self.link_patients:
+            # Solo entre las primeras apariciones de cada RUT, como en la carga pandas
+            duplicados = duplicated_ruts(clean['rut'])
+            clean = pd.concat([self.link_duplicate_patients(clean[~duplicados])[0], clean[duplicados]]).sort_index()
+        # La previsión se cruza por su nombre en minúsculas de Python, como el mapa de la carga
+        # pandas: LOWER() de SQLite solo pasa a minúsculas el ASCII ('ISAPRE BANMÉDICA')
+        self.load_staging('stg_pacientes', clean.assign(isapre=clean['isapre'].str.lower()))
+        self.load_staging('stg_previsiones', pd.DataFrame(list(self.maps['previsiones'].items()),
+                                                          columns=['clave', 'id_prevision']))
+        
+        # Se conserva la primera aparición de cada RUT
+        primera = "NOT EXISTS (SELECT 1 FROM stg_pacientes d WHERE d.rut = s.rut AND d.fila < s.fila)"
+        columns = ['rut', 'nombres', 'apellidos', 'email', 'telefono', 'direccion',
+                   'fecha_nacimiento', 'id_prevision', 'id_comuna']
+        
+        with self.metrics.step('SQL pacientes') as step, self.connection(write=True) as conn:
+            for fila, rut in conn.execute(text(
+                    f"SELECT fila, rut FROM stg_pacientes s WHERE rut IS NOT NULL AND NOT {primera} ORDER BY fila")):
+                logger.warning(f"  ⚠ RUT duplicado en fila {fila+2}: {rut}. Omitiendo...")
+            self.warn_check_digits(clean['rut'], duplicated_ruts(clean['rut']))
+            
+            conn.execute(text(f"""
+                UPDATE stg_pacientes SET
+                    id_prevision = (SELECT pv.id_prevision FROM stg_previsiones pv
+                                    WHERE {self.same_text('pv.clave', 'stg_pacientes.isapre')}),
+                    id_comuna = (SELECT MAX(c.id_comuna) FROM comunas c
+                                 WHERE {self.same_text('c.nombre', 'stg_pacientes.comuna')})
+            """))
+            
+            existentes = conn.execute(text(f"""
+                SELECT COUNT(*) FROM stg_pacientes s
+                WHERE {primera} AND EXISTS (SELECT 1 FROM pacientes p WHERE p.rut = s.rut)
+            """)).scalar()
+            if existentes:
+                assignments = ', '.join(
+                    f"{c} = (SELECT s.{c} FROM stg_pacientes s WHERE s.rut = pacientes.rut AND {primera})"
+                    for c in columns[1:]
+                )
+                conn.execute(text(f"""
+                    UPDATE pacientes SET {assignments}
+                    WHERE EXISTS (SELECT 1 FROM stg_pacientes s WHERE s.rut = pacientes.rut)
+                """))
+                logger.info(f"  ↻ {existentes} registros ya existían en pacientes (actualizados)")
+            
+            insertados = conn.execute(text(f"""
+                INSERT INTO pacientes ({', '.join(columns)})
+                SELECT {', '.join('s.' + c for c in columns)} FROM stg_pacientes s
+                WHERE s.rut IS NULL OR ({primera} AND NOT EXISTS (SELECT 1 FROM pacientes p WHERE p.rut = s.rut))
+                ORDER BY s.fila
+            """)).rowcount
+            step['rows'] = insertados + existentes
+        
+        self.count_rows('pacientes', insertados)
+        logger.info(f"  ✓ {insertados + existentes} pacientes insertados")
+    
+    def migrate_services(self, df_servicios):
+        """Migra DB_SERVICIOS.csv → servicios vía stg_servicios"""
+        logger.info("=== FASE 4: MIGRANDO SERVICIOS (SQL) ===")
+        with self.metrics.step('limpieza', len(df_servicios)):
+            clean = self.clean_services(df_servicios)
+        self.load_staging('stg_servicios', clean)
+        
+        # Con códigos repetidos, el UPDATE toma la última fila (igual que el executemany de pandas)
+        ultima = "NOT EXISTS (SELECT 1 FROM stg_servicios d WHERE d.codigo = s.codigo AND d.fila > s.fila)"
+        columns = ['codigo', 'nombre', 'precio_lista', 'modalidad', 'duracion_minutos']
+        
+        with self.metrics.step('SQL servicios') as step, self.connection(write=True) as conn:
+            existentes = conn.execute(text(
+                "SELECT COUNT(*) FROM stg_servicios s WHERE EXISTS (SELECT 1 FROM servicios v WHERE v.codigo = s.codigo)"
+            )).scalar()
+            if existentes:
+                assignments = ', '.join(
+                    f"{c} = (SELECT s.{c} FROM stg_servicios s WHERE s.codigo = servicios.codigo AND {ultima})"
+                    for c in columns[1:]
+                )
+                conn.execute(text(f"""
+                    UPDATE servicios SET {assignments}
+                    WHERE EXISTS (SELECT 1 FROM stg_servicios s WHERE s.codigo = servicios.codigo)
+                """))
+                logger.info(f"  ↻ {existentes} registros ya existían en servicios (actualizados)")
+            
+            insertados = conn.execute(text(f"""
+                INSERT INTO servicios ({', '.join(columns)})
+                SELECT {', '.join('s.' + c for c in columns)} FROM stg_servicios s
+                WHERE s.codigo IS NULL OR NOT EXISTS (SELECT 1 FROM servicios v WHERE v.codigo = s.codigo)
+                ORDER BY s.fila
+            """)).rowcount
+            step['rows'] = insertados + existentes
+        
+        self.count_rows('servicios', insertados)
+        logger.info(f"  ✓ {insertados + existentes} servicios insertados")
+    
+    def migrate_appointments_chunk(self, df_atenciones, id_estado_default):
+        """Carga un bloque en stg_atenciones y lo inserta con INSERT ... SELECT ... JOIN"""
+        conteo = {'citas': 0, 'detalle_financiero_cita': 0, 'pagos': 0, 'ficha_clinica': 0}
+        
+        with self.metrics.step('limpieza', len(df_atenciones)):
+            clean = self.clean_appointments(df_atenciones, id_estado_default)
+        clean['codigo_enlace'] = clean['codigo_cita'].fillna(
+            STAGING_LINK_PREFIX + pd.Series(clean.index, index=clean.index).astype(str))
+        clean['con_ficha'] = clean['con_ficha'].astype(int)
+        # Los nombres se resuelven en Python (NameMatcher): la BD solo compara texto exacto
+        clean['id_profesional'] = self.matcher.lookup(clean['especialista'])
+        self.load_staging('stg_atenciones', clean)
+        
+        validas = ("s.id_paciente IS NOT NULL AND s.id_profesional IS NOT NULL "
+                   "AND s.fecha_inicio IS NOT NULL AND s.id_estado IS NOT NULL")
+        
+        with self.metrics.step('SQL citas', len(clean)), self.connection(write=True) as conn:
+            # A) RESOLUCIÓN DE FKs
+            conn.execute(text(f"""
+                UPDATE stg_atenciones SET
+                    id_paciente = (SELECT p.id_paciente FROM pacientes p
+                                   WHERE {self.same_text('p.rut', 'stg_atenciones.codigo_cliente')}),
+                    id_servicio = (SELECT v.id_servicio FROM servicios v
+                                   WHERE {self.same_text('v.codigo', 'stg_atenciones.servicio')})
+            """))
+            
+            # Cada fila se rechaza por el primer motivo que aplique
+            rechazos = {}
+            motivos = [
+                ('sin paciente', "s.id_paciente IS NULL", 'codigo_cliente',
+                 lambda fila, valor: logger.warning(f"  ⚠ Paciente no encontrado para {valor} (fila {fila+2})")),
+                ('sin profesional', "s.id_paciente IS NOT NULL AND s.id_profesional IS NULL", 'especialista',
+                 lambda fila, valor: logger.warning(f"  ⚠ Profesional no encontrado: {valor} (fila {fila+2})")),
+                ('fecha inválida', "s.id_paciente IS NOT NULL AND s.id_profesional IS NOT NULL AND s.fecha_inicio IS NULL",
+                 'fecha_inicio', lambda fila, valor: logger.warning(f"  ⚠ Fecha inválida en fila {fila+2}")),
+                ('estado inválido', f"s.id_estado IS NULL AND s.id_paciente IS NOT NULL "
+                                    f"AND s.id_profesional IS NOT NULL AND s.fecha_inicio IS NOT NULL", 'id_estado_original',
+                 lambda fila, valor: logger.error(f"  ✗ Error procesando fila {fila+2}: ID_ESTADO inválido ({valor})")),
+            ]
+            for motivo, condicion, columna, log in motivos:
+                filas = conn.execute(text(
+                    f"SELECT s.fila, s.{columna} FROM stg_atenciones s WHERE {condicion} ORDER BY s.fila")).fetchall()
+                for fila, valor in filas:
+                    log(fila, valor)
+                rechazos[motivo] = len(filas)
+            self.count_rejections(rechazos)
+            
+            # B) CITAS (las sin ID_ATENCION llevan un código temporal para enlazar sus hijas)
+            watermark = conn.execute(text("SELECT COALESCE(MAX(id_cita), 0) FROM citas")).scalar()
+            conteo['citas'] = conn.execute(text(f"""
+                INSERT INTO citas (codigo_cita, id_paciente, id_profesional, id_servicio, id_estado, id_ubicacion,
+                                   fecha_inicio, fecha_fin, observaciones, observacion_migrada)
+                SELECT s.codigo_enlace, s.id_paciente, s.id_profesional, s.id_servicio, s.id_estado, 1,
+                       s.fecha_inicio, s.fecha_fin, s.observacion, s.observacion
+                FROM stg_atenciones s WHERE {validas}
+                ORDER BY s.fila
+            """)).rowcount
+            
+            if conteo['citas']:
+                enlace = "FROM stg_atenciones s JOIN citas c ON c.codigo_cita = s.codigo_enlace WHERE c.id_cita > :watermark"
+                
+                # C) DETALLE FINANCIERO
+                conteo['detalle_financiero_cita'] = conn.execute(text(f"""
+                    INSERT INTO detalle_financiero_cita (precio_cobrado, monto_profesional, monto_clinica,
+                                                         impuesto_retenido, id_cita)
+                    SELECT s.precio_cobrado, s.monto_profesional, s.monto_clinica, s.impuesto_retenido, c.id_cita
+                    {enlace} ORDER BY s.fila
+                """), {'watermark': watermark}).rowcount
+                
+                # D) PAGOS (si existe fecha de pago)
+                conteo['pagos'] = conn.execute(text(f"""
+                    INSERT INTO pagos (fecha_pago, monto, estado_pago, id_cita, id_metodo_pago)
+                    SELECT s.fecha_pago, s.precio_cobrado, 'CONFIRMADO', c.id_cita, 1
+                    {enlace} AND s.fecha_pago IS NOT NULL ORDER BY s.fila
+                """), {'watermark': watermark}).rowcount
+                
+                # E) FICHA CLÍNICA
+                conteo['ficha_clinica'] = conn.execute(text(f"""
+                    INSERT INTO ficha_clinica (id_paciente, observacion_historica, id_cita)
+                    SELECT s.id_paciente, s.observacion, c.id_cita
+                    {enlace} AND s.con_ficha = 1 ORDER BY s.fila
+                """), {'watermark': watermark}).rowcount
+                
+                conn.execute(text(
+                    "UPDATE citas SET codigo_cita = NULL WHERE id_cita > :watermark AND codigo_cita LIKE :prefijo"
+                ), {'watermark': watermark, 'prefijo': STAGING_LINK_PREFIX + '%'})
+        
+        for tabla, cantidad in conteo.items():
+            self.count_rows(tabla, cantidad)
+        if conteo['citas']:
+            logger.info(f"  ✓ {conteo['citas']} citas insertadas")
+            logger.info(f"  ✓ {conteo['detalle_financiero_cita']} detalles financieros insertados")
+            logger.info(f"  ✓ {conteo['pagos']} pagos insertados")
+            logger.info(f"  ✓ {conteo['ficha_clinica']} fichas clínicas insertadas")
+        return conteo
+    
+    def run_migration(self):
+        try:
+            return super().run_migration()
+        finally:
+            self.drop_staging_tables()
+    
+    def sync_delta(self):
+        try:
+            return super().sync_delta()
+        finally:
+            self.drop_staging_tables()
+
+# =====================================================
+# PROCESOS DE CITAS (--workers)
+# =====================================================
+
+_worker_migration = None  # ETLMigration propio de cada proceso de citas
+
+def init_appointment_worker(db_connection_string, writer, batch_rows, maps, matcher, log_path=None,
+                            commit_rows=None, relax_checks=False):
+    """Inicializa un proceso de citas: engine (y sesión de carga) propio, mapas y copia del NameMatcher
+    
+    maps es la carpeta del almacén de mapas (se abren mapeados desde disco) o un dict con copias.
+    log_path es el migration.log del proceso principal: un proceso iniciado con spawn (Windows)
+    no hereda su logging.
+    """
+    global _worker_migration
+    if not logging.getLogger().handlers:
+        configure_logging(log_path)
+    _worker_migration = ETLMigration('.', db_connection_string, writer=writer, batch_rows=batch_rows,
+                                     commit_rows=commit_rows, relax_checks=relax_checks)
+    _worker_migration.maps = MapStore(maps).load(APPOINTMENT_MAPS) if isinstance(maps, Path) else maps
+    _worker_migration.matcher = matcher
+
+def migrate_appointments_shard(df, id_estado_default):
+    """Migra una partición de un bloque; retorna (filas por tabla, rechazos por motivo, filas por nombre no exacto)
+    
+    Lo escrito queda confirmado al retornar: el proceso principal anota el
+    bloque en la bitácora cuando terminan todas las particiones.
+    """
+    _worker_migration.rejections = {}
+    conteo = _worker_migration.migrate_appointments_chunk(df, id_estado_default)
+    _worker_migration.commit_session()
+    return conteo, _worker_migration.rejections, _worker_migration.matcher.take_rows()
+
 # =====================================================
 # MAIN
 # =====================================================
 
 if __name__ == "__main__":
+    configure_logging()
     parser = argparse.ArgumentParser(description='Migración ETL CSV → MySQL')
     parser.add_argument('--csv-path', default='./csv_exports', help='Ruta a los archivos CSV')
     parser.add_argument('--db-host', default='localhost', help='Host de MySQL')
     parser.add_argument('--db-user', default='root', help='Usuario de MySQL')
     parser.add_argument('--db-password', default='', help='Password de MySQL')
+    parser.add_argument('--target', default=None, metavar='URL',
+                        help='Destino SQLAlchemy en vez de MySQL (p. ej. sqlite:///ensayo.db; se crea con el schema)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Ensayo en SQLite en memoria: migra, verifica y descarta (no toca MySQL)')
+    parser.add_argument('--chunk-rows', type=int, default=None,
+                        help='Procesa DB_ATENCIONES en bloques de N filas (memoria acotada)')
+    parser.add_argument('--writer', choices=sorted(WRITER_BACKENDS), default='batch',
+                        help='Backend de escritura: batch (INSERT multi-fila), bulk (LOAD DATA LOCAL INFILE) o pandas (to_sql)')
+    parser.add_argument('--batch-rows', type=int, default=WRITE_BATCH_ROWS,
+                        help='Filas por lote de escritura')
+    parser.add_argument('--bcrypt-rounds', type=int, default=BCRYPT_ROUNDS,
+                        help='Costo bcrypt de los passwords temporales del staff')
+    parser.add_argument('--hash-workers', type=int, default=None,
+                        help='Procesos para generar hashes bcrypt (default: todos los cores)')
+    parser.add_argument('--journal', default=JOURNAL_PATH,
+                        help='Archivo de bitácora con el avance de la migración')
+    parser.add_argument('--resume', action='store_true',
+                        help='Retoma una migración interrumpida según la bitácora')
+    parser.add_argument('--phase-workers', type=int, default=PHASE_WORKERS,
+                        help='Fases independientes ejecutadas en paralelo (1 = secuencial)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Procesos para transformar y cargar DB_ATENCIONES')
+    parser.add_argument('--shard-by', choices=SHARD_KEYS, default='profesional',
+                        help='Partición de las citas entre procesos: por profesional o por rango de fechas')
+    parser.add_argument('--transform', choices=TRANSFORMS, default='pandas',
+                        help='pandas: FKs resueltas en memoria; sql: staging stg_* e INSERT ... SELECT en la BD')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Registra la memoria pico por paso con tracemalloc (más lento)')
+    parser.add_argument('--delta', action='store_true',
+                        help='Aplica solo filas nuevas, modificadas o eliminadas desde la última corrida')
+    parser.add_argument('--watch', type=int, nargs='?', const=WATCH_INTERVAL, default=None, metavar='SEGUNDOS',
+                        help='Revisa los CSVs periódicamente y aplica deltas (default: cada 60s)')
+    parser.add_argument('--commit-rows', type=int, default=None, metavar='N',
+                        help='Sesión de carga: una conexión por fase/proceso y un COMMIT cada N filas '
+                             '(default: una transacción por escritura)')
+    parser.add_argument('--relax-checks', action='store_true',
+                        help='Desactiva foreign_key_checks y unique_checks durante la carga y verifica '
+                             f'huérfanos y duplicados al final (implica --commit-rows {COMMIT_ROWS})')
+    parser.add_argument('--name-threshold', type=float, default=NAME_MATCH_THRESHOLD,
+                        help='Similitud mínima (0-1) para aceptar un ESPECIALISTA aproximado '
+                             '(1 = solo mayúsculas, tildes, espacios y orden de los nombres)')
+    parser.add_argument('--link-patients', action='store_true',
+                        help='Fusiona los registros de pacientes de la misma persona (sin RUT o con datos con '
+                             f'otro formato) y deja el detalle en {LINK_REPORT_PREFIX}_<fecha>.csv')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='Quita los índices secundarios de las tablas de la carga y los reconstruye al final')
+    parser.add_argument('--index-workers', type=int, default=INDEX_WORKERS,
+                        help='Tablas cuyos índices se reconstruyen en paralelo (SQLite: 1)')
+    parser.add_argument('--rebuild-indexes', action='store_true',
+                        help='Recrea los índices secundarios del schema que falten en la BD (p. ej. tras una '
+                             'corrida interrumpida con --defer-indexes) y termina')
+    parser.add_argument('--build-cache', action='store_true',
+                        help=f'Convierte los CSVs a Parquet en {CACHE_DIRNAME}/ (requiere pyarrow) y termina')
     
     args = parser.parse_args()
     
+    if args.build_cache:
+        if pq is None:
+            parser.error('--build-cache requiere pyarrow (pip install pyarrow)')
+        for filename in CSV_FILES:
+            filepath = Path(args.csv_path) / filename
+            if not filepath.exists():
+                logger.warning(f"⚠ {filepath} no existe, se omite")
+            elif columnar_cache_is_fresh(filepath):
+                logger.info(f"↷ {filename}: caché al día")
+            else:
+                rows = build_columnar_cache(filepath)
+                logger.info(f"✓ {filename}: {rows} filas → {columnar_cache_path(filepath)}")
+        sys.exit(0)
+    
     # Actualizar configuración
     DB_CONFIG['host'] = args.db_host
     DB_CONFIG['user'] = args.db_user
     DB_CONFIG['password'] = args.db_password
     
     connection_string = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}?charset=utf8mb4"
+    if args.dry_run:
+        if args.resume or args.delta or args.watch:
+            parser.error('--dry-run no se combina con --resume, --delta ni --watch (la BD en memoria se descarta)')
+        connection_string = DRY_RUN_TARGET
+        # La bitácora del ensayo no debe pisar la de la migración real
+        dry_run_dir = tempfile.TemporaryDirectory(prefix='etl_dry_run_')
+        args.journal = Path(dry_run_dir.name) / Path(args.journal).name
+    elif args.target:
+        connection_string = args.target
+    
+    if args.rebuild_indexes:
+        if args.dry_run:
+            parser.error('--rebuild-indexes no se combina con --dry-run')
+        engine = create_target_engine(connection_string)
+        tables = [table for tables in PHASE_TABLES.values() for table in tables]
+        SecondaryIndexes(engine, tables, args.index_workers).rebuild()
+        sys.exit(0)
     
     # Ejecutar migración
-    migration = ETLMigration(args.csv_path, connection_string)
-    success = migration.run_migration()
+    migration_class = StagedETLMigration if args.transform == 'sql' else ETLMigration
+    migration = migration_class(args.csv_path, connection_string, chunk_rows=args.chunk_rows,
+                             writer=args.writer, batch_rows=args.batch_rows,
+                             bcrypt_rounds=args.bcrypt_rounds, hash_workers=args.hash_workers,
+                             journal_path=args.journal, resume=args.resume,
+                             phase_workers=args.phase_workers,
+                             workers=args.workers, shard_by=args.shard_by,
+                             trace_memory=args.trace_memory,
+                             commit_rows=args.commit_rows, relax_checks=args.relax_checks,
+                             defer_indexes=args.defer_indexes, index_workers=args.index_workers,
+                             name_threshold=args.name_threshold, link_patients=args.link_patients)
+    if args.dry_run:
+        success = migration.dry_run()
+    elif args.watch:
+        success = migration.watch(args.watch)
+    elif args.delta:
+        success = migration.sync_delta()
+    else:
+        success = migration.run_migration()
     
     sys.exit(0 if success else 1)
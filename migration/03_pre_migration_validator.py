@@ -5,25 +5,194 @@ Sistema: Clínica Equilibrar ERP
 =====================================================
 
 Valida que todos los requisitos estén cumplidos antes
-de ejecutar la migración ETL.
+de ejecutar la migración ETL, y perfila los CSVs para
+detectar antes de cargar las filas que el ETL rechazaría.
 
 USO:
     python 03_pre_migration_validator.py
+
+    # Otra carpeta de CSVs, 4 procesos y excepciones en otro archivo
+    python 03_pre_migration_validator.py --csv-path ./exports --workers 4 --exceptions excepciones.csv
 """
 
 import sys
+import os
 import subprocess
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import importlib
+import importlib.util
 import logging
 
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    pd = None  # check_python_packages lo reporta y el perfilado se omite
+
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
+# =====================================================
+# PERFILADO DE DATOS
+# =====================================================
+# Cada CSV se recorre una sola vez, en bloques y en su propio proceso,
+# con los mismos limpiadores del ETL. Los cruces entre archivos
+# (ESPECIALISTA, CODIGO CLIENTE) se resuelven al final sobre los
+# valores distintos que reporta cada archivo.
+
+ETL_PATH = Path(__file__).with_name('02_etl_migration.py')
+PROFILE_CHUNK_ROWS = 100000
+EXCEPTIONS_PATH = 'pre_migration_exceptions.csv'
+EXCEPTION_COLUMNS = ['archivo', 'fila', 'columna', 'problema', 'valor', 'detalle']
+
+DATE_COLUMNS = {
+    'DB_CLIENTES.csv': ['FECHA_NACIMIENTO'],
+    'DB_ATENCIONES.csv': ['FECHA DE ATENCION', 'FECHA DE PAGO'],
+}
+AMOUNT_COLUMNS = ['INGRESO', 'UTILIDAD', 'PAGO ESPECIALISTA (LIQUIDO)', 'IMPUESTO']
+THOUSANDS_DOT_PATTERN = r'\s*\$?\s*[+-]?\d{1,3}(?:\.\d{3})+\s*'  # "$28.000": clean_number lo lee como 28
+
+# Referencias de DB_ATENCIONES: columna → (archivo referenciado, limpiador del ETL, problema)
+REFERENCES = {
+    'CODIGO CLIENTE': ('DB_CLIENTES.csv', 'clean_rut_series', 'CODIGO CLIENTE sin paciente en DB_CLIENTES'),
+    'ESPECIALISTA': ('DB_CONFIG_EQUIPO.csv', 'clean_text_series', 'ESPECIALISTA sin profesional en DB_CONFIG_EQUIPO'),
+}
+
+_etl = None
+
+def load_etl():
+    """Importa 02_etl_migration.py (limpiadores del ETL) una vez por proceso"""
+    global _etl
+    if _etl is None:
+        spec = importlib.util.spec_from_file_location('etl_migration', ETL_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _etl = module
+    return _etl
+
+def flag_rows(exceptions, filename, mask, column, problem, values, detail=None):
+    """Agrega una excepción por cada fila marcada en mask (fila = número de línea del CSV)"""
+    if mask.any():
+        exceptions.append(pd.DataFrame({
+            'archivo': filename,
+            'fila': mask.index[mask].to_numpy() + 2,
+            'columna': column,
+            'problema': problem,
+            'valor': values[mask].to_numpy(),
+            'detalle': detail[mask].to_numpy() if detail is not None else None,
+        }))
+
+def per_value(series, check, fill=None):
+    """Evalúa check (Series → Series) una vez por valor distinto y lo expande a las filas
+    
+    Fechas, nombres y montos se repiten mucho en los CSVs; las filas nulas
+    reciben fill.
+    """
+    codes, uniques = pd.factorize(series)
+    if not len(uniques):
+        return pd.Series(fill, index=series.index, dtype=object)
+    result = check(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+    return pd.Series(np.where(codes >= 0, result[codes], fill), index=series.index, dtype=object)
+
+def distinct_rows(values):
+    """Primera fila y cantidad de filas por valor distinto (sin nulos)"""
+    frame = pd.DataFrame({'valor': values, 'fila': values.index + 2}).dropna()
+    return frame.groupby('valor')['fila'].agg(['min', 'count'])
+
+def profile_csv(path, chunk_rows=PROFILE_CHUNK_ROWS):
+    """Recorre un CSV una vez; retorna filas, vacíos por columna, excepciones y claves para los cruces"""
+    etl = load_etl()
+    filename = path.name
+    rows = 0
+    nulls = {}
+    exceptions = []
+    first_rut = {}  # RUT limpio → primera fila (duplicados entre bloques)
+    keys = set()  # Claves con que el ETL resuelve referencias hacia este archivo
+    references = {column: [] for column in REFERENCES}
+    
+    # Mismos tipos que load_csv del ETL; desde la caché Parquet si está al día
+    for chunk in etl.read_export(path, chunk_rows=chunk_rows):
+        rows += len(chunk)
+        for column in chunk.columns:
+            blank = per_value(chunk[column], lambda values: etl.clean_text_series(values).isna(), True)
+            nulls[column] = nulls.get(column, 0) + int(blank.sum())
+        
+        for column in DATE_COLUMNS.get(filename, []):
+            if column not in chunk.columns:
+                continue
+            # Formato no reconocido o fecha inexistente (p. ej. 31/02/2024)
+            invalid = per_value(chunk[column], lambda values: etl.clean_text_series(values).notna() & pd.to_datetime(
+                etl.parse_date_series(values), format='%Y-%m-%d', errors='coerce').isna(), False).astype(bool)
+            flag_rows(exceptions, filename, invalid, column, 'fecha no parseable', chunk[column])
+        
+        if filename == 'DB_CLIENTES.csv':
+            rut = per_value(etl.get_column(chunk, 'RUT'), etl.clean_rut_series)
+            present = rut.notna()
+            # Bien formado: numérico para el ETL (rut_parts, cuerpo de hasta RUT_MAX_LENGTH - 1 dígitos + DV)
+            well_formed = present & etl.rut_parts(rut)[2]
+            flag_rows(exceptions, filename, present & ~well_formed, 'RUT', 'RUT con formato inválido', chunk['RUT'])
+            flag_rows(exceptions, filename, well_formed & ~etl.valid_rut_series(rut),
+                      'RUT', 'RUT con dígito verificador inválido', chunk['RUT'])
+            
+            first = rut[present & ~rut.duplicated()]
+            previous = rut.map(first_rut)
+            first_in_chunk = rut.map(pd.Series(first.index + 2, index=first.to_numpy()))
+            first_row = previous.fillna(first_in_chunk)
+            duplicated = present & (previous.notna() | rut.duplicated())
+            flag_rows(exceptions, filename, duplicated, 'RUT', 'RUT duplicado', rut,
+                      'primera aparición en fila ' + first_row.astype('Int64').astype(str))
+            first_rut.update((value, row) for value, row in zip(first.to_numpy(), first.index + 2)
+                             if value not in first_rut)
+            # CODIGO CLIENTE también puede traer el código de cliente
+            keys.update(per_value(etl.get_column(chunk, etl.CLIENT_CODE_COLUMN), etl.clean_rut_series).dropna())
+        
+        elif filename == 'DB_CONFIG_EQUIPO.csv':
+            keys.update(per_value(etl.get_column(chunk, 'ESPECIALISTA'), etl.title_case_series).dropna())
+        
+        elif filename == 'DB_ATENCIONES.csv':
+            for column in AMOUNT_COLUMNS:
+                if column not in chunk.columns:
+                    continue
+                # '.' como separador de miles: clean_number solo quita ',' y '$' y lo lee como decimal
+                thousands = per_value(chunk[column], lambda values: values.str.fullmatch(THOUSANDS_DOT_PATTERN),
+                                      False).astype(bool)
+                flag_rows(exceptions, filename, thousands, column, 'monto con punto de miles', chunk[column],
+                          'el ETL carga ' + per_value(chunk[column], etl.clean_number_series).astype(str))
+                # Mismos separadores que acepta clean_number; el resto el ETL lo carga como 0
+                invalid = per_value(chunk[column], lambda values: etl.clean_text_series(values).notna() & pd.to_numeric(
+                    values.str.replace(',', '', regex=False).str.replace('$', '', regex=False).str.strip(),
+                    errors='coerce').isna(), False).astype(bool)
+                flag_rows(exceptions, filename, invalid & ~thousands, column, 'monto no numérico', chunk[column])
+            
+            for column, (_, cleaner, _) in REFERENCES.items():
+                cleaned = per_value(etl.get_column(chunk, column), getattr(etl, cleaner))
+                references[column].append(distinct_rows(cleaned))
+    
+    if filename == 'DB_CLIENTES.csv':
+        keys.update(first_rut)
+    references = {
+        column: pd.concat(parts).groupby(level=0).agg({'min': 'min', 'count': 'sum'})
+        for column, parts in references.items() if parts
+    }
+    return {
+        'archivo': filename,
+        'filas': rows,
+        'vacios': nulls,
+        'excepciones': pd.concat(exceptions, ignore_index=True) if exceptions else None,
+        'claves': keys,
+        'referencias': references,
+    }
+
 class PreMigrationValidator:
-    def __init__(self):
+    def __init__(self, csv_dir='./csv_exports', exceptions_path=EXCEPTIONS_PATH,
+                 workers=None, profile=True):
         self.errors = []
         self.warnings = []
+        self.csv_dir = Path(csv_dir)
+        self.exceptions_path = Path(exceptions_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.profile = profile
         
     def check_python_version(self):
         """Verifica versión de Python"""
@@ -79,7 +248,7 @@ class PreMigrationValidator:
         """Verifica que existan los archivos CSV"""
         logger.info("✓ Verificando archivos CSV...")
         
-        csv_dir = Path('./csv_exports')
+        csv_dir = self.csv_dir
         required_csvs = [
             'DB_CLIENTES.csv',
             'DB_ATENCIONES.csv',
@@ -99,6 +268,89 @@ class PreMigrationValidator:
             else:
                 self.warnings.append(f"Archivo faltante: {csv_file}")
     
+    def profile_csv_files(self):
+        """Perfila los CSVs en paralelo (uno por proceso) y escribe el archivo de excepciones"""
+        logger.info("✓ Perfilando datos de los CSVs...")
+        
+        files = [path for path in (self.csv_dir / name for name in
+                                   ['DB_CLIENTES.csv', 'DB_CONFIG_EQUIPO.csv', 'DB_SERVICIOS.csv', 'DB_ATENCIONES.csv'])
+                 if path.exists()]
+        if not files:
+            return
+        try:
+            load_etl()
+        except Exception as e:
+            self.warnings.append(f"No se pudo perfilar los CSVs (¿faltan paquetes?): {e}")
+            return
+        
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(files))) as pool:
+            profiles = {profile['archivo']: profile for profile in pool.map(profile_csv, files)}
+        
+        exceptions = [profile['excepciones'] for profile in profiles.values() if profile['excepciones'] is not None]
+        
+        # Cruces: valores distintos de DB_ATENCIONES sin registro en el archivo referenciado
+        appointments = profiles.get('DB_ATENCIONES.csv')
+        for column, (source, _, problem) in REFERENCES.items():
+            if appointments is None or source not in profiles or column not in appointments['referencias']:
+                continue
+            distinct = appointments['referencias'][column]
+            if column == 'ESPECIALISTA':
+                missing = self.match_professionals(distinct, profiles[source]['claves'], exceptions)
+            else:
+                missing = distinct[~distinct.index.isin(list(profiles[source]['claves']))]
+            if not missing.empty:
+                exceptions.append(pd.DataFrame({
+                    'archivo': 'DB_ATENCIONES.csv',
+                    'fila': missing['min'].to_numpy(),
+                    'columna': column,
+                    'problema': problem,
+                    'valor': missing.index.to_numpy(),
+                    'detalle': missing['count'].astype(str).to_numpy() + ' filas',
+                }))
+        
+        for filename, profile in profiles.items():
+            logger.info(f"  ✓ {filename}: {profile['filas']:,} filas")
+            for column, count in profile['vacios'].items():
+                if count:
+                    logger.info(f"     {column}: {count / profile['filas']:.1%} vacíos")
+        
+        if not exceptions:
+            logger.info("  ✓ Sin excepciones en los datos")
+            return
+        
+        exceptions = (pd.concat(exceptions, ignore_index=True)[EXCEPTION_COLUMNS]
+                      .sort_values(['archivo', 'fila'], kind='stable'))
+        exceptions.to_csv(self.exceptions_path, index=False, encoding='utf-8-sig')
+        
+        # Filas afectadas por problema (las referencias cuentan todas sus filas)
+        affected = exceptions['detalle'].str.extract(r'^(\d+) filas\b')[0].astype(float).fillna(1)
+        summary = affected.groupby([exceptions['archivo'], exceptions['problema']], sort=False).sum()
+        for (filename, problem), count in summary.items():
+            self.warnings.append(f"{filename}: {int(count):,} filas con {problem}")
+        logger.info(f"  ⚠ {len(exceptions):,} excepciones escritas en {self.exceptions_path}")
+    
+    def match_professionals(self, distinct, names, exceptions):
+        """Resuelve ESPECIALISTA con el NameMatcher del ETL; retorna los nombres que quedarán sin profesional
+        
+        Los que el ETL resolverá por aproximación se agregan a exceptions para revisarlos.
+        """
+        matcher = load_etl().NameMatcher({name: name for name in names})
+        matches = pd.DataFrame([matcher.resolve(name) for name in distinct.index], index=distinct.index,
+                               columns=['profesional', 'estado', 'similitud', 'candidato'])
+        approximate = distinct[matches['estado'] == 'aproximado']
+        if not approximate.empty:
+            matched = matches.loc[approximate.index]
+            exceptions.append(pd.DataFrame({
+                'archivo': 'DB_ATENCIONES.csv',
+                'fila': approximate['min'].to_numpy(),
+                'columna': 'ESPECIALISTA',
+                'problema': 'ESPECIALISTA resuelto por aproximación',
+                'valor': approximate.index.to_numpy(),
+                'detalle': (approximate['count'].astype(str) + ' filas → ' + matched['profesional']
+                            + ' (similitud ' + matched['similitud'].astype(str) + ')').to_numpy(),
+            }))
+        return distinct[matches['profesional'].isna()]
+    
     def check_migration_scripts(self):
         """Verifica que existan los scripts de migración"""
         logger.info("✓ Verificando scripts de migración...")
@@ -180,12 +432,25 @@ class PreMigrationValidator:
         self.check_mysql_connection()
         self.check_python_packages()
         self.check_csv_files()
+        if self.profile:
+            self.profile_csv_files()
         self.check_migration_scripts()
         self.check_disk_space()
         
         return self.print_summary()
 
 if __name__ == "__main__":
-    validator = PreMigrationValidator()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Validador pre-migración')
+    parser.add_argument('--csv-path', default='./csv_exports', help='Ruta a los archivos CSV')
+    parser.add_argument('--exceptions', default=EXCEPTIONS_PATH,
+                        help='CSV con una fila por excepción encontrada en los datos')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Procesos para perfilar los CSVs (default: todos los cores)')
+    parser.add_argument('--skip-profile', action='store_true', help='No perfila los datos de los CSVs')
+    args = parser.parse_args()
+    
+    validator = PreMigrationValidator(args.csv_path, args.exceptions, args.workers, not args.skip_profile)
     success = validator.run_all_checks()
     sys.exit(0 if success else 1)
@@ -9,9 +9,17 @@ después de la migración ETL.
 
 USO:
     python 04_post_migration_verification.py
+
+    # Otra BD (p. ej. el ensayo de 02_etl_migration.py --target sqlite:///ensayo.db)
+    python 04_post_migration_verification.py --target sqlite:///ensayo.db
+
+    # BD grande: un recorrido por tabla, en paralelo sobre 4 conexiones
+    python 04_post_migration_verification.py --workers 4
 """
 
 from sqlalchemy import create_engine, text
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import logging
 import sys
 
@@ -31,10 +39,94 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+# Tablas cuyo conteo se informa
+VERIFIED_TABLES = [
+    'pacientes', 'profesionales', 'usuarios', 'servicios',
+    'citas', 'detalle_financiero_cita', 'pagos', 'ficha_clinica',
+    'roles', 'especialidades', 'estados_cita', 'previsiones', 
+    'comunas', 'metodos_pago', 'ubicaciones'
+]
+
+# =====================================================
+# VERIFICACIÓN CONCURRENTE (--workers)
+# =====================================================
+# Cada tabla grande se recorre una sola vez: sus conteos y predicados se
+# pliegan en un único SELECT de agregados, y los recorridos corren en
+# paralelo sobre el pool de conexiones. La verificación completa tarda
+# lo que el recorrido más lento.
+
+# En orden de costo: los recorridos más lentos se lanzan primero. Citas sin
+# paciente va aparte: sus búsquedas por PK en pacientes cuestan más que el
+# resto del recorrido de citas y así se solapan con él.
+FOLDED_SCANS = {
+    'citas_pacientes': '''
+        SELECT SUM(CASE WHEN pa.id_paciente IS NULL THEN 1 ELSE 0 END) AS sin_paciente
+        FROM citas c
+        LEFT JOIN pacientes pa ON c.id_paciente = pa.id_paciente
+    ''',
+    'citas': '''
+        SELECT COUNT(*) AS total,
+               SUM(CASE WHEN pr.id_profesional IS NULL THEN 1 ELSE 0 END) AS sin_profesional,
+               SUM(CASE WHEN c.fecha_inicio IS NULL THEN 1 ELSE 0 END) AS fecha_invalida,
+               MIN(c.fecha_inicio) AS primera_cita,
+               MAX(c.fecha_inicio) AS ultima_cita
+        FROM citas c
+        LEFT JOIN profesionales pr ON c.id_profesional = pr.id_profesional
+    ''',
+    'detalle_financiero_cita': '''
+        SELECT COUNT(*) AS total,
+               SUM(CASE WHEN c.id_cita IS NULL THEN 1 ELSE 0 END) AS huerfanos,
+               SUM(CASE WHEN df.precio_cobrado < 0 THEN 1 ELSE 0 END) AS precios_negativos,
+               SUM(CASE WHEN df.precio_cobrado > 0 THEN 1 ELSE 0 END) AS con_precio,
+               SUM(CASE
+                   WHEN df.precio_cobrado > 0
+                    AND ABS(df.precio_cobrado - (df.monto_profesional + df.monto_clinica + df.impuesto_retenido)) > 100
+                   THEN 1 ELSE 0
+               END) AS inconsistentes,
+               SUM(df.precio_cobrado) AS ingresos
+        FROM detalle_financiero_cita df
+        LEFT JOIN citas c ON df.id_cita = c.id_cita
+    ''',
+    'pagos': '''
+        SELECT COUNT(*) AS total,
+               SUM(CASE WHEN c.id_cita IS NULL THEN 1 ELSE 0 END) AS sin_cita
+        FROM pagos pg
+        LEFT JOIN citas c ON pg.id_cita = c.id_cita
+    ''',
+    'pacientes': '''
+        SELECT COUNT(*) AS total,
+               SUM(CASE WHEN nombres IS NULL OR nombres = '' THEN 1 ELSE 0 END) AS sin_nombre
+        FROM pacientes
+    ''',
+    'profesionales': '''
+        SELECT COUNT(*) AS total,
+               SUM(CASE WHEN id_especialidad IS NULL THEN 1 ELSE 0 END) AS sin_especialidad
+        FROM profesionales
+    ''',
+}
+
+# Tablas que solo se cuentan: una consulta UNION ALL para todas
+COUNTED_TABLES = [table for table in VERIFIED_TABLES if table not in FOLDED_SCANS]
+
+DUPLICATED_RUTS_QUERY = '''
+    SELECT rut, COUNT(*) as cnt FROM pacientes 
+    WHERE rut IS NOT NULL 
+    GROUP BY rut HAVING cnt > 1
+'''
+
+STREAM_ROWS = 1000  # Filas por lote al leer con cursor del lado del servidor
+
 class PostMigrationVerificator:
-    def __init__(self, db_config):
-        connection_string = f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset=utf8mb4"
-        self.engine = create_engine(connection_string, echo=False)
+    def __init__(self, db_config=None, engine=None, workers=1):
+        """Conecta a MySQL con db_config, o usa un engine existente (SQLite del ensayo, --target)
+        
+        Con workers > 1, run_all_checks usa la verificación concurrente.
+        """
+        self.workers = max(1, workers)
+        if engine is None:
+            connection_string = f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset=utf8mb4"
+            engine = create_engine(connection_string, echo=False, pool_size=self.workers)
+        self.engine = engine
         self.issues = []
         
     def execute_query(self, query, description):
@@ -48,18 +140,31 @@ class PostMigrationVerificator:
             self.issues.append(f"{description}: {e}")
             return []
     
+    def stream_query(self, query, description, keep=None):
+        """Ejecuta una query con cursor del lado del servidor
+        
+        Retorna (filas, total): conserva solo las primeras `keep` filas
+        (todas si keep es None) sin traer el resultado completo a memoria.
+        """
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=STREAM_ROWS).execute(text(query))
+                rows, total = [], 0
+                for row in result:
+                    if keep is None or total < keep:
+                        rows.append(row)
+                    total += 1
+                return rows, total
+        except Exception as e:
+            logger.error(f"Error en {description}: {e}")
+            self.issues.append(f"{description}: {e}")
+            return None, 0
+    
     def check_table_counts(self):
         """Verifica conteos de registros en tablas"""
         logger.info("\n✓ Verificando conteo de registros...")
         
-        tables = [
-            'pacientes', 'profesionales', 'usuarios', 'servicios',
-            'citas', 'detalle_financiero_cita', 'pagos', 'ficha_clinica',
-            'roles', 'especialidades', 'estados_cita', 'previsiones', 
-            'comunas', 'metodos_pago', 'ubicaciones'
-        ]
-        
-        for table in tables:
+        for table in VERIFIED_TABLES:
             query = f"SELECT COUNT(*) FROM {table}"
             result = self.execute_query(query, f"Contar {table}")
             
@@ -124,7 +229,7 @@ class PostMigrationVerificator:
         checks = [
             {
                 'name': 'Pacientes sin nombre',
-                'query': 'SELECT COUNT(*) FROM pacientes WHERE nombres IS NULL OR nombres = ""'
+                'query': "SELECT COUNT(*) FROM pacientes WHERE nombres IS NULL OR nombres = ''"
             },
             {
                 'name': 'Pacientes con RUT duplicado',
@@ -217,8 +322,8 @@ class PostMigrationVerificator:
             logger.info(f"  ✓ Última cita: {ultima}")
             logger.info(f"  ✓ Total citas: {total:,}")
     
-    def generate_summary_report(self):
-        """Genera reporte resumen"""
+    def generate_summary_report(self, stats=None):
+        """Genera reporte resumen (stats: estadísticas ya calculadas por los recorridos plegados)"""
         logger.info("\n" + "="*60)
         logger.info("REPORTE RESUMEN POST-MIGRACIÓN")
         logger.info("="*60)
@@ -233,7 +338,7 @@ class PostMigrationVerificator:
                 (SELECT COUNT(*) FROM pagos) as pagos_registrados
         '''
         
-        result = self.execute_query(query, "Estadísticas generales")
+        result = [stats] if stats else self.execute_query(query, "Estadísticas generales")
         
         if result and result[0]:
             pacientes, profesionales, citas, ingresos, pagos = result[0]
@@ -257,11 +362,117 @@ class PostMigrationVerificator:
         
         logger.info("="*60)
     
+    def run_folded_scans(self):
+        """Lanza en paralelo un recorrido por tabla, el conteo de catálogos y la búsqueda de RUTs duplicados"""
+        logger.info(f"\n✓ Recorriendo tablas en paralelo ({self.workers} conexiones)...")
+        
+        def scan(table, query):
+            rows, _ = self.stream_query(query, f"Recorrer {table}")
+            return dict(rows[0]._mapping) if rows else None
+        
+        counts_query = ' UNION ALL '.join(f"SELECT '{table}', COUNT(*) FROM {table}" for table in COUNTED_TABLES)
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            scans = {table: pool.submit(scan, table, query) for table, query in FOLDED_SCANS.items()}
+            duplicated = pool.submit(self.stream_query, DUPLICATED_RUTS_QUERY, 'Pacientes con RUT duplicado', 5)
+            counts = pool.submit(self.stream_query, counts_query, 'Contar catálogos')
+            
+            scans = {table: future.result() for table, future in scans.items()}
+            duplicated = duplicated.result()
+            counts = counts.result()
+        
+        scans['conteos'] = dict(counts[0]) if counts[0] is not None else {}
+        for table in FOLDED_SCANS:
+            if table in VERIFIED_TABLES and scans[table] is not None:
+                scans['conteos'][table] = scans[table]['total']
+        return scans, duplicated
+    
+    def report_folded(self, scans, name, table, column, level='warning'):
+        """Informa un predicado de un recorrido plegado con los mensajes de la verificación secuencial"""
+        if scans[table] is None:
+            return
+        count = scans[table][column] or 0
+        if count == 0:
+            logger.info(f"  ✓ {name}: OK")
+        elif level == 'error':
+            logger.error(f"  ✗ {name}: {count} registros problemáticos")
+            self.issues.append(name)
+        else:
+            logger.warning(f"  ⚠ {name}: {count} registros")
+            self.issues.append(f"{name}: {count}")
+    
+    def run_concurrent_checks(self):
+        """Mismas verificaciones que run_all_checks, sobre los recorridos plegados de run_folded_scans"""
+        scans, (duplicated, duplicated_total) = self.run_folded_scans()
+        citas = scans['citas'] or {}
+        detalle = scans['detalle_financiero_cita'] or {}
+        
+        logger.info("\n✓ Verificando conteo de registros...")
+        for table in VERIFIED_TABLES:
+            if table not in scans['conteos']:
+                continue
+            count = scans['conteos'][table]
+            if count > 0:
+                logger.info(f"  ✓ {table}: {count:,} registros")
+            else:
+                logger.warning(f"  ⚠ {table}: 0 registros (¿esperado?)")
+        
+        logger.info("\n✓ Verificando integridad de Foreign Keys...")
+        for name, table, column in [
+            ('Citas sin paciente', 'citas_pacientes', 'sin_paciente'),
+            ('Citas sin profesional', 'citas', 'sin_profesional'),
+            ('Detalles financieros huérfanos', 'detalle_financiero_cita', 'huerfanos'),
+            ('Pagos sin cita', 'pagos', 'sin_cita'),
+        ]:
+            self.report_folded(scans, name, table, column, 'error')
+        
+        logger.info("\n✓ Verificando calidad de datos...")
+        self.report_folded(scans, 'Pacientes sin nombre', 'pacientes', 'sin_nombre')
+        if duplicated is not None:
+            # Se cuentan todos los casos pero solo se conservan los primeros 5
+            if duplicated_total > 0:
+                logger.warning(f"  ⚠ Pacientes con RUT duplicado: {duplicated_total} casos")
+                for row in duplicated:
+                    logger.warning(f"     - {row}")
+                self.issues.append(f"Pacientes con RUT duplicado: {duplicated_total}")
+            else:
+                logger.info(f"  ✓ Pacientes con RUT duplicado: OK")
+        self.report_folded(scans, 'Citas con fecha inválida', 'citas', 'fecha_invalida')
+        self.report_folded(scans, 'Precios negativos en detalle financiero', 'detalle_financiero_cita', 'precios_negativos')
+        self.report_folded(scans, 'Profesionales sin especialidad', 'profesionales', 'sin_especialidad')
+        
+        logger.info("\n✓ Verificando consistencia financiera...")
+        if detalle:
+            total, inconsistentes = detalle['con_precio'] or 0, detalle['inconsistentes'] or 0
+            if inconsistentes > 0:
+                pct = (inconsistentes / total * 100) if total > 0 else 0
+                logger.warning(f"  ⚠ {inconsistentes}/{total} ({pct:.1f}%) registros con descuadre > $100")
+                logger.warning(f"     (Esto puede ser normal por descuentos o datos históricos)")
+            else:
+                logger.info(f"  ✓ Todas las finanzas cuadran correctamente")
+        
+        logger.info("\n✓ Verificando rangos de fechas...")
+        if citas:
+            logger.info(f"  ✓ Primera cita: {citas['primera_cita']}")
+            logger.info(f"  ✓ Última cita: {citas['ultima_cita']}")
+            logger.info(f"  ✓ Total citas: {citas['total']:,}")
+        
+        stats = None
+        if all(scans[table] is not None for table in ['pacientes', 'profesionales', 'citas',
+                                                      'detalle_financiero_cita', 'pagos']):
+            stats = (scans['pacientes']['total'], scans['profesionales']['total'], citas['total'],
+                     detalle['ingresos'], scans['pagos']['total'])
+        self.generate_summary_report(stats)
+    
     def run_all_checks(self):
         """Ejecuta todas las verificaciones"""
         print("\n🔍 INICIANDO VERIFICACIÓN POST-MIGRACIÓN...\n")
         
         try:
+            if self.workers > 1:
+                self.run_concurrent_checks()
+                return len(self.issues) == 0
+            
             self.check_table_counts()
             self.check_foreign_keys()
             self.check_data_quality()
@@ -276,18 +487,30 @@ class PostMigrationVerificator:
             return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verificador post-migración')
+    parser.add_argument('--target', default=None, metavar='URL',
+                        help='BD SQLAlchemy a verificar en vez de MySQL (p. ej. sqlite:///ensayo.db)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Conexiones en paralelo; con más de 1, un solo recorrido por tabla (default: 1)')
+    args = parser.parse_args()
+    
     print("="*60)
     print("VERIFICADOR POST-MIGRACIÓN - Clínica Equilibrar ERP")
     print("="*60)
     
-    # Solicitar password de forma segura
-    import getpass
-    print(f"\nConectando a: {DB_CONFIG['user']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
-    
-    password = getpass.getpass("Ingresa password de MySQL: ")
-    DB_CONFIG['password'] = password
-    
-    verificator = PostMigrationVerificator(DB_CONFIG)
+    if args.target:
+        engine = create_engine(args.target, echo=False)
+        print(f"\nConectando a: {engine.url.render_as_string(hide_password=True)}")
+        verificator = PostMigrationVerificator(engine=engine, workers=args.workers)
+    else:
+        # Solicitar password de forma segura
+        import getpass
+        print(f"\nConectando a: {DB_CONFIG['user']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+        
+        password = getpass.getpass("Ingresa password de MySQL: ")
+        DB_CONFIG['password'] = password
+        
+        verificator = PostMigrationVerificator(DB_CONFIG, workers=args.workers)
     success = verificator.run_all_checks()
     
     sys.exit(0 if success else 1)
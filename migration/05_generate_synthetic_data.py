@@ -0,0 +1,370 @@
+"""
+=====================================================
+GENERADOR DE DATOS SINTÉTICOS (CSV LEGACY)
+Sistema: Clínica Equilibrar ERP
+=====================================================
+
+Genera DB_CLIENTES, DB_CONFIG_EQUIPO, DB_SERVICIOS y DB_ATENCIONES
+con las mismas columnas que exporta Google Sheets y que espera
+02_etl_migration.py, con una proporción configurable de datos sucios
+(RUTs duplicados, fechas en formatos mezclados, montos "$1.234",
+referencias inexistentes, campos vacíos). Sirve para medir la
+migración a escala (ver 06_benchmark_etl.py).
+
+Los montos de cada atención son coherentes entre sí (INGRESO >= pago
+especialista + utilidad + impuesto) para no violar los CHECK del schema.
+
+USO:
+    python 05_generate_synthetic_data.py --atenciones 100000 --output ./csv_synthetic
+
+    # 10M de atenciones, el doble de datos sucios y otra semilla
+    python 05_generate_synthetic_data.py --atenciones 10000000 --dirty 2 --seed 7
+
+    # Ajustar una proporción puntual
+    python 05_generate_synthetic_data.py --atenciones 50000 --ratio rut_duplicado=0.05
+"""
+
+import pandas as pd
+import numpy as np
+from pathlib import Path
+import argparse
+import logging
+import json
+import sys
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# CONFIGURACIÓN
+# =====================================================
+
+# Proporción de filas afectadas por cada tipo de dato sucio (--dirty las escala)
+DIRTY_RATIOS = {
+    'rut_duplicado': 0.01,           # Clientes que repiten el RUT de otro (en otro formato)
+    'fecha_mixta': 0.3,              # D-M-YYYY o YYYY-MM-DD en vez de DD/MM/YYYY
+    'fecha_invalida': 0.005,         # Fechas que no se pueden interpretar
+    'monto_moneda': 0.2,             # Montos "$25,000" o "$25.000" en vez de 25000
+    'referencia_desconocida': 0.02,  # Cliente, profesional o servicio inexistente
+    'campo_vacio': 0.03,             # Campos opcionales vacíos
+    'texto_sucio': 0.1,              # Mayúsculas/minúsculas mezcladas y espacios extra
+}
+
+CHUNK_ROWS = 500000  # Filas generadas y escritas por bloque (memoria acotada)
+
+COLUMNS = {
+    'DB_CLIENTES.csv': ['RUT', 'NOMBRES', 'PATERNO', 'MATERNO', 'CORREO', 'TELEFONO',
+                        'DIRECCION', 'FECHA_NACIMIENTO', 'ISAPRE', 'COMUNA'],
+    'DB_CONFIG_EQUIPO.csv': ['ESPECIALISTA', 'EMAIL', 'ESPECIALIDAD', 'COLOR_PROFESIONAL',
+                             'COMISION_%', 'RETENCION_%', 'ESTADO'],
+    'DB_SERVICIOS.csv': ['ID_SERVICIO', 'NOMBRE_SERVICIO', 'PRECIO_LISTA'],
+    'DB_ATENCIONES.csv': ['ID_ATENCION', 'CODIGO CLIENTE', 'ESPECIALISTA', 'FECHA DE ATENCION',
+                          'HORA DE ATENCION', 'ID_SERVICIO', 'INGRESO', 'PAGO ESPECIALISTA (LIQUIDO)',
+                          'UTILIDAD', 'IMPUESTO', 'FECHA DE PAGO', 'OBSERVACION'],
+}
+
+NOMBRES = ['Juan', 'María', 'José', 'Ana', 'Pedro', 'Camila', 'Diego', 'Valentina', 'Matías',
+           'Francisca', 'Benjamín', 'Javiera', 'Tomás', 'Catalina', 'Sebastián', 'Fernanda',
+           'Felipe', 'Constanza', 'Nicolás', 'Isidora', 'Cristóbal', 'Antonia', 'Joaquín', 'Sofía']
+APELLIDOS = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva',
+             'Martínez', 'Sepúlveda', 'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández',
+             'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela', 'Castillo', 'Tapia', 'Reyes']
+COMUNAS = ['Santiago', 'Providencia', 'Las Condes', 'Ñuñoa', 'La Florida', 'Maipú', 'Puente Alto',
+           'Vitacura', 'La Reina', 'Macul', 'San Miguel', 'Peñalolén', 'Estación Central']
+# Mismos nombres que el seed de 01_create_schema.sql, más algunas que no existen
+ISAPRES = ['FONASA', 'Isapre Banmédica', 'Isapre Consalud', 'Isapre Colmena', 'Isapre Vida Tres',
+           'Sin Previsión / Particular', 'Isapre Cruz Blanca', 'Isapre Nueva Masvida']
+ESPECIALIDADES = ['Psicología', 'Psiquiatría', 'Nutrición', 'Kinesiología', 'Fonoaudiología',
+                  'Terapia Ocupacional', 'Psicopedagogía']
+OBSERVACIONES = [
+    'Paciente asiste puntual, se trabaja en técnicas de regulación emocional.',
+    'Control de seguimiento; refiere mejoría del sueño y menor ansiedad.',
+    'Se ajusta plan de tratamiento, próxima sesión en dos semanas.',
+    'Evaluación inicial completa.\nSe solicita informe previo del colegio.',
+    'Sesión breve',
+    'No asiste',
+    'Reagendada por el paciente, "urgente"',
+]
+
+# =====================================================
+# UTILIDADES DE GENERACIÓN (VECTORIZADAS)
+# =====================================================
+
+def pick(rng, values, size):
+    """Elige `size` valores al azar (con reemplazo)"""
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), size)]
+
+def mask(rng, size, ratio):
+    """Máscara booleana con una proporción `ratio` de True"""
+    return rng.random(size) < ratio
+
+def rut_check_digits(numbers):
+    """Dígito verificador módulo 11 de un arreglo de RUTs (sin DV)"""
+    numbers = np.asarray(numbers, dtype=np.int64).copy()
+    total = np.zeros(len(numbers), dtype=np.int64)
+    weight = 2
+    while (numbers > 0).any():
+        total += (numbers % 10) * weight
+        numbers //= 10
+        weight = 2 if weight == 7 else weight + 1
+    dv = 11 - total % 11
+    return np.where(dv == 11, '0', np.where(dv == 10, 'K', dv.astype(str)))
+
+def format_rut(numbers, dv, style):
+    """RUT como texto: style 0 = 12.345.678-5, 1 = 12345678-5, 2 = 12345678k (dv en minúscula)"""
+    digits = pd.Series(numbers).astype(str)
+    dv = pd.Series(dv)
+    dotted = digits.str[:-6] + '.' + digits.str[-6:-3] + '.' + digits.str[-3:] + '-' + dv
+    dashed = digits + '-' + dv
+    compact = digits + dv.str.lower()
+    return pd.Series(np.select([style == 0, style == 1], [dotted, dashed], compact), dtype=object)
+
+def format_unique(values, formatter):
+    """Aplica formatter (Series → Series) solo a los valores distintos y expande el resultado"""
+    unique, inverse = np.unique(values, return_inverse=True)
+    return formatter(pd.Series(unique)).to_numpy(dtype=object)[inverse]
+
+def format_dates(rng, days, ratios):
+    """Fechas (datetime64[D]) en DD/MM/YYYY, con formatos mezclados e inválidas según ratios"""
+    size = len(days)
+    style = np.where(mask(rng, size, ratios['fecha_mixta']), rng.integers(1, 3, size), 0)
+    text = np.select(
+        [style == 0, style == 1],
+        [format_unique(days, lambda d: d.dt.strftime('%d/%m/%Y')),
+         format_unique(days, lambda d: d.dt.day.astype(str) + '-' + d.dt.month.astype(str) + '-' +
+                       d.dt.year.astype(str))],
+        format_unique(days, lambda d: d.dt.strftime('%Y-%m-%d'))
+    ).astype(object)
+    invalid = mask(rng, size, ratios['fecha_invalida'])
+    text[invalid] = pick(rng, ['sin fecha', '2023/13/45', '31.02.2023'], invalid.sum())
+    return text
+
+def money(amounts, style):
+    """Montos como texto según style: 0 = 25000, 1 = "$25,000", 2 = "$25.000" (separador chileno)"""
+    def grouped(values, separator):
+        return '$' + values.astype(str).str.replace(r'(\d)(?=(\d{3})+$)', r'\1' + separator, regex=True)
+    
+    text = np.select(
+        [style == 1, style == 2],
+        [format_unique(amounts, lambda v: grouped(v, ',')), format_unique(amounts, lambda v: grouped(v, '.'))],
+        format_unique(amounts, lambda v: v.astype(str))
+    )
+    return pd.Series(text, dtype=object)
+
+def money_style(rng, size, ratio):
+    """Formato de monto por fila (ver money)"""
+    return np.where(mask(rng, size, ratio), rng.integers(1, 3, size), 0)
+
+def dirty_text(rng, values, ratio):
+    """Altera mayúsculas y agrega espacios en una proporción de los textos"""
+    text = pd.Series(values, dtype=object)
+    dirty = mask(rng, len(text), ratio)
+    variant = rng.integers(0, 3, len(text))
+    altered = np.select(
+        [variant == 0, variant == 1],
+        [text.str.lower(), text.str.upper()],
+        '  ' + text + ' '
+    )
+    return text.mask(dirty, pd.Series(altered, index=text.index, dtype=object))
+
+def blank(rng, values, ratio):
+    """Vacía una proporción de los valores (celda vacía en el CSV)"""
+    values = pd.Series(values, dtype=object)
+    return values.mask(mask(rng, len(values), ratio), None)
+
+# =====================================================
+# GENERADORES POR ARCHIVO
+# =====================================================
+
+def generate_clientes(rng, count, ratios):
+    """DB_CLIENTES; retorna (df, RUTs limpios únicos) para referenciar desde atenciones"""
+    numbers = np.unique(rng.integers(5_000_000, 26_000_000, int(count * 1.1) + 10))
+    if len(numbers) < count:
+        raise ValueError(f"No se pueden generar {count} RUTs distintos")
+    numbers = rng.permutation(numbers)[:count]
+    dv = rut_check_digits(numbers)
+    compact = pd.Series(numbers).astype(str) + dv
+
+    # Duplicados: repiten el número de otro cliente en otro formato
+    duplicated = mask(rng, count, ratios['rut_duplicado'])
+    duplicated[0] = False
+    source = rng.integers(0, count, count)
+    numbers = np.where(duplicated, numbers[source], numbers)
+    dv = np.where(duplicated, dv[source], dv)
+    rut = format_rut(numbers, dv, rng.integers(0, 3, count))
+
+    nombres = pick(rng, NOMBRES, count)
+    paterno = pick(rng, APELLIDOS, count)
+    nacimiento = np.datetime64('1940-01-01') + rng.integers(0, 365 * 65, count).astype('timedelta64[D]')
+    email = (pd.Series(nombres).str.lower() + '.' + pd.Series(paterno).str.lower() +
+             pd.Series(rng.integers(1, 9999, count)).astype(str) + '@correo.cl')
+
+    df = pd.DataFrame({
+        'RUT': rut,
+        'NOMBRES': dirty_text(rng, nombres, ratios['texto_sucio']),
+        'PATERNO': dirty_text(rng, paterno, ratios['texto_sucio']),
+        'MATERNO': blank(rng, pick(rng, APELLIDOS, count), ratios['campo_vacio'] * 3),
+        'CORREO': blank(rng, email, ratios['campo_vacio']),
+        'TELEFONO': blank(rng, '+569' + pd.Series(rng.integers(10_000_000, 99_999_999, count)).astype(str),
+                          ratios['campo_vacio']),
+        'DIRECCION': blank(rng, 'Calle ' + pd.Series(pick(rng, APELLIDOS, count)) + ' ' +
+                           pd.Series(rng.integers(1, 9999, count)).astype(str), ratios['campo_vacio']),
+        'FECHA_NACIMIENTO': blank(rng, format_dates(rng, nacimiento, ratios), ratios['campo_vacio']),
+        'ISAPRE': blank(rng, dirty_text(rng, pick(rng, ISAPRES, count), ratios['texto_sucio']),
+                        ratios['campo_vacio']),
+        'COMUNA': blank(rng, pick(rng, COMUNAS, count), ratios['campo_vacio']),
+    })
+    return df, compact[~duplicated].to_numpy(dtype=object)
+
+def generate_equipo(rng, count, ratios):
+    """DB_CONFIG_EQUIPO; retorna (df, nombres tal como los normaliza el ETL)"""
+    nombres = pd.Series([f"{NOMBRES[i % len(NOMBRES)]} {APELLIDOS[(i // len(NOMBRES)) % len(APELLIDOS)]}"
+                         + (f" {i // (len(NOMBRES) * len(APELLIDOS)) + 1}" if i >= len(NOMBRES) * len(APELLIDOS) else '')
+                         for i in range(count)], dtype=object)
+    email = nombres.str.lower().str.replace(' ', '.', regex=False) + '@equilibrar.cl'
+    df = pd.DataFrame({
+        'ESPECIALISTA': dirty_text(rng, nombres, ratios['texto_sucio']),
+        'EMAIL': blank(rng, email, ratios['campo_vacio']),
+        'ESPECIALIDAD': pick(rng, ESPECIALIDADES, count),
+        'COLOR_PROFESIONAL': pd.Series(rng.integers(0, 0xFFFFFF, count)).map('#{:06X}'.format),
+        'COMISION_%': pick(rng, ['40', '45', '50', '55.5'], count),
+        'RETENCION_%': pick(rng, ['13.75', '12.25', '0'], count),
+        'ESTADO': np.where(mask(rng, count, 0.1), 'INACTIVO', 'ACTIVO'),
+    })
+    return df, nombres.str.strip().str.title().to_numpy(dtype=object)
+
+def generate_servicios(rng, count, ratios):
+    """DB_SERVICIOS; retorna (df, códigos, precios lista)"""
+    codigos = np.array([f"SRV{i + 1:03d}" for i in range(count)], dtype=object)
+    precios = rng.integers(15, 80, count) * 1000
+    df = pd.DataFrame({
+        'ID_SERVICIO': codigos,
+        'NOMBRE_SERVICIO': [f"{pick(rng, ESPECIALIDADES, 1)[0]} - sesión {i + 1}" for i in range(count)],
+        'PRECIO_LISTA': money(precios, money_style(rng, count, ratios['monto_moneda'])),
+    })
+    return df, codigos, precios
+
+def generate_atenciones(rng, start, count, refs, ratios):
+    """Un bloque de DB_ATENCIONES (ID_ATENCION correlativo desde `start`)"""
+    ruts, profesionales, codigos, precios = refs
+    unknown = ratios['referencia_desconocida']
+
+    cliente = pd.Series(pick(rng, ruts, count), dtype=object)
+    cliente = cliente.mask(mask(rng, count, unknown), 'CLI' + pd.Series(rng.integers(0, 10**6, count)).astype(str))
+    especialista = pd.Series(pick(rng, profesionales, count), dtype=object)
+    especialista = especialista.mask(mask(rng, count, unknown), 'Profesional Externo')
+    especialista = dirty_text(rng, especialista, ratios['texto_sucio'] / 4)
+    servicio_idx = rng.integers(0, len(codigos), count)
+    servicio = pd.Series(codigos[servicio_idx], dtype=object).mask(mask(rng, count, unknown), 'SRV999')
+
+    fecha = np.datetime64('2019-01-01') + rng.integers(0, 365 * 7, count).astype('timedelta64[D]')
+    hora = pd.Series(rng.integers(8, 21, count)).astype(str) + pick(rng, [':00', ':30', ':15', ':45'], count)
+    hora = blank(rng, hora.mask(mask(rng, count, ratios['campo_vacio']), 'x'), ratios['campo_vacio'])
+
+    # Montos coherentes: pago especialista + utilidad + impuesto <= ingreso. Todos son
+    # múltiplos de 1000 para que "$25.000" (que el ETL lee como 25) lo siga siendo
+    ingreso = precios[servicio_idx] - rng.integers(0, 3, count) * 1000
+    pago = (ingreso * 0.6).astype(np.int64) // 1000 * 1000
+    impuesto = (pago * 0.1375).astype(np.int64) // 1000 * 1000
+    utilidad = ingreso - pago - impuesto
+    moneda = money_style(rng, count, ratios['monto_moneda'])  # Toda la fila con el mismo formato
+
+    sin_monto = mask(rng, count, ratios['campo_vacio'])
+    pagada = ~sin_monto & ~mask(rng, count, 0.25)
+    fecha_pago = fecha + rng.integers(0, 30, count).astype('timedelta64[D]')
+
+    return pd.DataFrame({
+        'ID_ATENCION': blank(rng, 'AT' + pd.Series(np.arange(start, start + count) + 1).astype(str).str.zfill(8),
+                             ratios['campo_vacio'] / 3),
+        'CODIGO CLIENTE': cliente,
+        'ESPECIALISTA': especialista,
+        'FECHA DE ATENCION': format_dates(rng, fecha, ratios),
+        'HORA DE ATENCION': hora,
+        'ID_SERVICIO': blank(rng, servicio, ratios['campo_vacio']),
+        'INGRESO': money(ingreso, moneda).mask(sin_monto, None),
+        'PAGO ESPECIALISTA (LIQUIDO)': money(pago, moneda).mask(sin_monto, None),
+        'UTILIDAD': money(utilidad, moneda).mask(sin_monto, None),
+        'IMPUESTO': money(impuesto, moneda).mask(sin_monto, None),
+        'FECHA DE PAGO': pd.Series(format_dates(rng, fecha_pago, ratios), dtype=object).where(pagada, None),
+        'OBSERVACION': blank(rng, pick(rng, OBSERVACIONES, count), ratios['campo_vacio'] * 3),
+    })
+
+# =====================================================
+# EJECUCIÓN
+# =====================================================
+
+def write_csv(path, frames):
+    """Escribe bloques de DataFrame en un solo CSV (columnas en el orden de COLUMNS); retorna filas escritas"""
+    rows = 0
+    for i, df in enumerate(frames):
+        df[COLUMNS[path.name]].to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False, encoding='utf-8')
+        rows += len(df)
+    return rows
+
+def generate(output, atenciones, clientes=None, profesionales=40, servicios=30,
+             ratios=None, seed=42, chunk_rows=CHUNK_ROWS):
+    """Genera los 4 CSVs en output; retorna {archivo: filas}"""
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    ratios = {**DIRTY_RATIOS, **(ratios or {})}
+    clientes = clientes or max(100, atenciones // 8)
+    rng = np.random.default_rng(seed)
+    filas = {}
+
+    logger.info(f"Generando datos en {output} (semilla {seed})...")
+    df_clientes, ruts = generate_clientes(rng, clientes, ratios)
+    filas['DB_CLIENTES.csv'] = write_csv(output / 'DB_CLIENTES.csv', [df_clientes])
+    df_equipo, nombres = generate_equipo(rng, profesionales, ratios)
+    filas['DB_CONFIG_EQUIPO.csv'] = write_csv(output / 'DB_CONFIG_EQUIPO.csv', [df_equipo])
+    df_servicios, codigos, precios = generate_servicios(rng, servicios, ratios)
+    filas['DB_SERVICIOS.csv'] = write_csv(output / 'DB_SERVICIOS.csv', [df_servicios])
+
+    refs = (ruts, nombres, codigos, precios)
+    frames = (
+        generate_atenciones(np.random.default_rng([seed, start]), start, min(chunk_rows, atenciones - start), refs, ratios)
+        for start in range(0, atenciones, chunk_rows)
+    )
+    filas['DB_ATENCIONES.csv'] = write_csv(output / 'DB_ATENCIONES.csv', frames)
+
+    # Parámetros de la generación, para saber si un directorio se puede reutilizar
+    (output / 'synthetic.json').write_text(json.dumps({
+        'atenciones': atenciones, 'clientes': clientes, 'profesionales': profesionales,
+        'servicios': servicios, 'ratios': ratios, 'seed': seed, 'filas': filas,
+    }, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    for filename, count in filas.items():
+        logger.info(f"  ✓ {filename}: {count} filas")
+    return filas
+
+def parse_ratio(value):
+    name, _, ratio = value.partition('=')
+    if name not in DIRTY_RATIOS or not ratio:
+        raise argparse.ArgumentTypeError(f"Use nombre=valor con nombre en: {', '.join(DIRTY_RATIOS)}")
+    return name, float(ratio)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description='Genera CSVs legacy sintéticos para pruebas de carga del ETL')
+    parser.add_argument('--output', default='./csv_synthetic', help='Carpeta de salida')
+    parser.add_argument('--atenciones', type=int, default=10000,
+                        help='Filas de DB_ATENCIONES (p. ej. 10000 a 10000000)')
+    parser.add_argument('--clientes', type=int, default=None,
+                        help='Filas de DB_CLIENTES (default: atenciones / 8)')
+    parser.add_argument('--profesionales', type=int, default=40, help='Filas de DB_CONFIG_EQUIPO')
+    parser.add_argument('--servicios', type=int, default=30, help='Filas de DB_SERVICIOS')
+    parser.add_argument('--dirty', type=float, default=1.0,
+                        help='Factor sobre todas las proporciones de datos sucios (0 = datos limpios)')
+    parser.add_argument('--ratio', type=parse_ratio, action='append', default=[],
+                        help=f"Proporción puntual nombre=valor ({', '.join(DIRTY_RATIOS)})")
+    parser.add_argument('--seed', type=int, default=42, help='Semilla (misma semilla = mismos archivos)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='Filas de atenciones generadas por bloque')
+
+    args = parser.parse_args()
+    if args.atenciones <= 0:
+        parser.error('--atenciones debe ser positivo')
+
+    ratios = {name: min(1.0, ratio * args.dirty) for name, ratio in DIRTY_RATIOS.items()}
+    ratios.update(dict(args.ratio))
+    generate(args.output, args.atenciones, args.clientes, args.profesionales, args.servicios,
+             ratios, args.seed, args.chunk_rows)
+    sys.exit(0)
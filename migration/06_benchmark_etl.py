@@ -0,0 +1,255 @@
+"""
+=====================================================
+BENCHMARK DEL ETL
+Sistema: Clínica Equilibrar ERP
+=====================================================
+
+Genera (o reutiliza) datos sintéticos de varios tamaños con
+05_generate_synthetic_data.py, migra cada tamaño a una BD desechable
+con 02_etl_migration.py y agrega el tiempo, filas/s, round-trips y
+memoria de cada fase y sub-paso a benchmark_results.csv, para comparar
+corridas en el tiempo y detectar regresiones.
+
+Destinos:
+- sqlite (default): BD embebida creada desde 01_create_schema.sql, sin servidor
+- memory: SQLite en memoria (aísla el costo de transformación del de escritura)
+- mysql: base desechable en un MySQL local (se BORRA y recrea en cada corrida)
+
+USO:
+    python 06_benchmark_etl.py --sizes 10000,100000
+
+    # MySQL local, comparando backends de escritura
+    python 06_benchmark_etl.py --sizes 100000,1000000 --target mysql --db-password tu_pass --writer bulk
+
+    # Tendencia: última corrida contra la mediana de las anteriores (exit 1 si hay regresiones)
+    python 06_benchmark_etl.py --compare
+"""
+
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+import importlib.util
+import subprocess
+import tempfile
+import argparse
+import logging
+import json
+import time
+import sys
+import re
+
+# =====================================================
+# CONFIGURACIÓN
+# =====================================================
+
+MIGRATION_DIR = Path(__file__).resolve().parent
+RESULTS_PATH = 'benchmark_results.csv'
+DATA_DIR = './benchmark_data'
+BENCH_DATABASE = 'clinica_equilibrar_bench'  # Base desechable en --target mysql
+BENCH_BCRYPT_ROUNDS = 4  # El benchmark mide el flujo de datos, no el costo de bcrypt
+REGRESSION_RATIO = 1.2  # Más lento que 1.2x la mediana anterior = regresión
+
+# Columnas que identifican una configuración comparable entre corridas
+CONFIG_COLUMNS = ['target', 'atenciones', 'motor', 'writer', 'chunk_rows', 'workers', 'phase_workers']
+
+logger = logging.getLogger('benchmark')
+
+def load_script(filename, name):
+    """Importa un script numerado de migration/ como módulo"""
+    spec = importlib.util.spec_from_file_location(name, MIGRATION_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module  # Necesario para los procesos de --workers
+    spec.loader.exec_module(module)
+    return module
+
+etl = load_script('02_etl_migration.py', 'etl_migration')
+generator = load_script('05_generate_synthetic_data.py', 'synthetic_data')
+
+# =====================================================
+# PREPARACIÓN
+# =====================================================
+
+def synthetic_data(data_dir, atenciones, seed):
+    """Carpeta con los CSVs de un tamaño; se generan solo si no existen con los mismos parámetros"""
+    folder = Path(data_dir) / str(atenciones)
+    manifest = folder / 'synthetic.json'
+    if manifest.exists():
+        previous = json.loads(manifest.read_text(encoding='utf-8'))
+        if previous['atenciones'] == atenciones and previous['seed'] == seed and \
+                previous['ratios'] == generator.DIRTY_RATIOS:
+            logger.info(f"↷ Reutilizando datos sintéticos de {folder}")
+            return folder
+    generator.generate(folder, atenciones, seed=seed)
+    return folder
+
+def mysql_database(args):
+    """(Re)crea la base desechable desde 01_create_schema.sql; retorna su connection string"""
+    import pymysql
+
+    schema = etl.SCHEMA_PATH.read_text(encoding='utf-8').replace(etl.DB_CONFIG['database'], args.db_name)
+    statements = [stmt.strip() for stmt in re.sub(r'--[^\n]*', '', schema).split(';') if stmt.strip()]
+    conn = pymysql.connect(host=args.db_host, port=args.db_port, user=args.db_user,
+                           password=args.db_password, charset='utf8mb4')
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{args.db_name}`")
+            for stmt in statements:
+                cursor.execute(stmt)
+        conn.commit()
+    finally:
+        conn.close()
+    return (f"mysql+pymysql://{args.db_user}:{args.db_password}@{args.db_host}:{args.db_port}/"
+            f"{args.db_name}?charset=utf8mb4")
+
+def git_commit():
+    """Commit actual del repo (vacío si no hay git)"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=MIGRATION_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+# =====================================================
+# EJECUCIÓN
+# =====================================================
+
+def run_once(args, data_folder, atenciones, repeticion, workdir):
+    """Migra un tamaño a una BD nueva; retorna las filas de resultados"""
+    if args.target == 'mysql':
+        url = mysql_database(args)
+    elif args.target == 'memory':
+        url = etl.DRY_RUN_TARGET
+    else:
+        url = etl.create_sqlite_database(Path(workdir) / f'bench_{atenciones}.db')
+
+    migration_class = etl.StagedETLMigration if args.transform == 'sql' else etl.ETLMigration
+    migration = migration_class(data_folder, url, chunk_rows=args.chunk_rows, writer=args.writer,
+                                batch_rows=args.batch_rows, bcrypt_rounds=args.bcrypt_rounds,
+                                journal_path=Path(workdir) / 'benchmark_journal.json',
+                                phase_workers=args.phase_workers, workers=args.workers,
+                                report_dir=workdir)  # Reportes de revisión fuera del directorio actual
+
+    start = time.perf_counter()
+    success = migration.migrate_all()  # Sin write_metrics: los resultados van a --results
+    elapsed = time.perf_counter() - start
+
+    base = {
+        'run_id': args.run_id, 'fecha': args.started_at, 'commit': args.commit,
+        'target': args.target, 'atenciones': atenciones, 'motor': args.transform,
+        'writer': args.writer, 'chunk_rows': args.chunk_rows or 0, 'workers': args.workers,
+        'phase_workers': args.phase_workers, 'repeticion': repeticion, 'exito': success,
+    }
+    rows = [{**base, **step} for step in migration.metrics.rows()]
+    rows.append({**base, 'fase': 'corrida', 'paso': 'total', 'segundos': round(elapsed, 3),
+                 'filas': sum(migration.rows_written.values()),
+                 'filas_s': round(sum(migration.rows_written.values()) / elapsed, 1) if elapsed else None,
+                 'rss_pico_mb': etl.peak_rss_mb()})
+    migration.engine.dispose()
+
+    logger.info(f"{'✓' if success else '✗'} {atenciones} atenciones ({args.target}, repetición {repeticion}): "
+                f"{elapsed:.1f}s")
+    for row in rows:
+        if row['paso'] == 'total':
+            logger.info(f"    {row['fase']:<13} {row['segundos']:9.2f}s  {row['filas'] or 0:>10} filas")
+    return rows
+
+def save_results(path, rows):
+    """Agrega las filas al CSV de resultados (crea el encabezado la primera vez)"""
+    df = pd.DataFrame(rows)
+    path = Path(path)
+    if path.exists():
+        columns = pd.read_csv(path, nrows=0).columns
+        df = df.reindex(columns=columns.union(df.columns, sort=False))
+        if list(df.columns) != list(columns):
+            # Columnas nuevas: se reescribe el archivo completo con el encabezado ampliado
+            df = pd.concat([pd.read_csv(path), df], ignore_index=True)
+            df.to_csv(path, index=False)
+            return
+    df.to_csv(path, mode='a', header=not path.exists(), index=False)
+
+def compare(path, ratio=REGRESSION_RATIO):
+    """Compara la última corrida de cada configuración contra la mediana de las anteriores
+
+    Retorna True si no hay regresiones.
+    """
+    df = pd.read_csv(path)
+    df = df[df['paso'] == 'total']
+    ok = True
+    for config, runs in df.groupby(CONFIG_COLUMNS, dropna=False):
+        run_ids = sorted(runs['run_id'].unique())
+        if len(run_ids) < 2:
+            continue
+        # Mediana por corrida (entre repeticiones) y luego entre corridas anteriores
+        by_run = runs.groupby(['run_id', 'fase'])['segundos'].median().unstack('fase')
+        last, history = by_run.loc[run_ids[-1]], by_run.loc[run_ids[:-1]].median()
+        print(f"\n{dict(zip(CONFIG_COLUMNS, config))}  ({len(run_ids) - 1} corridas anteriores)")
+        for fase in last.index:
+            if pd.isna(last[fase]) or pd.isna(history.get(fase)) or not history[fase]:
+                continue
+            change = last[fase] / history[fase]
+            regression = change > ratio
+            ok &= not regression
+            print(f"  {'⚠' if regression else '✓'} {fase:<13} {history[fase]:9.2f}s → {last[fase]:9.2f}s ({change:.2f}x)")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark del ETL con datos sintéticos')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='Tamaños de DB_ATENCIONES separados por coma (p. ej. 10000,1000000,10000000)')
+    parser.add_argument('--repeat', type=int, default=1, help='Repeticiones por tamaño')
+    parser.add_argument('--target', choices=['sqlite', 'memory', 'mysql'], default='sqlite',
+                        help='BD de destino: sqlite embebida, SQLite en memoria o una base desechable en MySQL')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Carpeta de los datos sintéticos')
+    parser.add_argument('--results', default=RESULTS_PATH, help='CSV acumulado de resultados')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla de los datos sintéticos')
+    parser.add_argument('--db-host', default='localhost', help='Host de MySQL')
+    parser.add_argument('--db-port', type=int, default=3306, help='Puerto de MySQL')
+    parser.add_argument('--db-user', default='root', help='Usuario de MySQL')
+    parser.add_argument('--db-password', default='', help='Password de MySQL')
+    parser.add_argument('--db-name', default=BENCH_DATABASE, help='Base desechable (se borra en cada corrida)')
+    parser.add_argument('--transform', choices=etl.TRANSFORMS, default='pandas', help='Motor del ETL')
+    parser.add_argument('--writer', choices=sorted(etl.WRITER_BACKENDS), default='batch', help='Backend de escritura')
+    parser.add_argument('--batch-rows', type=int, default=etl.WRITE_BATCH_ROWS, help='Filas por lote de escritura')
+    parser.add_argument('--chunk-rows', type=int, default=None, help='Bloques de DB_ATENCIONES')
+    parser.add_argument('--phase-workers', type=int, default=etl.PHASE_WORKERS, help='Fases en paralelo')
+    parser.add_argument('--workers', type=int, default=1, help='Procesos para las citas')
+    parser.add_argument('--bcrypt-rounds', type=int, default=BENCH_BCRYPT_ROUNDS, help='Costo bcrypt del staff')
+    parser.add_argument('--verbose', action='store_true', help='Muestra el log completo del ETL')
+    parser.add_argument('--compare', action='store_true',
+                        help='Solo compara la última corrida con las anteriores en --results')
+    parser.add_argument('--regression-ratio', type=float, default=REGRESSION_RATIO,
+                        help='Factor de tiempo sobre la mediana histórica que se reporta como regresión')
+
+    args = parser.parse_args()
+    etl.configure_logging(None)  # Solo consola: el benchmark no escribe en migration.log
+    logger.setLevel(logging.INFO)
+
+    if args.compare:
+        if not Path(args.results).exists():
+            logger.error(f"✗ No existe {args.results}")
+            sys.exit(1)
+        sys.exit(0 if compare(args.results, args.regression_ratio) else 1)
+
+    if args.target == 'mysql' and args.db_name == etl.DB_CONFIG['database']:
+        parser.error(f"--db-name no puede ser la base real ({args.db_name}): se borra en cada corrida")
+
+    # Los rechazos por fila del ETL inundan el log a escala; solo errores salvo --verbose
+    etl.logger.setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    args.started_at = datetime.now().isoformat(timespec='seconds')
+    args.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    args.commit = git_commit()
+
+    rows = []
+    success = True
+    with tempfile.TemporaryDirectory(prefix='etl_bench_') as workdir:
+        for atenciones in (int(size) for size in args.sizes.split(',')):
+            folder = synthetic_data(args.data_dir, atenciones, args.seed)
+            for repeticion in range(1, args.repeat + 1):
+                results = run_once(args, folder, atenciones, repeticion, workdir)
+                success &= all(row['exito'] for row in results)
+                rows.extend(results)
+
+    save_results(args.results, rows)
+    logger.info(f"Resultados agregados a {args.results} (corrida {args.run_id})")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,403 @@
+"""
+=====================================================
+RECONCILIACIÓN CSV ↔ BD
+Sistema: Clínica Equilibrar ERP
+=====================================================
+
+Comprueba que las citas migradas coinciden con DB_ATENCIONES.csv sin
+comparar fila a fila. Ambos lados se agrupan por mes y profesional, y en
+cada partición se comparan:
+- número de filas
+- sumas de montos (INGRESO vs precio_cobrado, etc.)
+- suma de CRC32 por fila (código, fecha y montos), que no depende del orden
+
+El lado CSV pasa por los mismos limpiadores del ETL (02_etl_migration.py)
+y resuelve paciente y profesional como él: ESPECIALISTA con el NameMatcher
+sobre profesionales.nombres y CODIGO CLIENTE por RUT o código de cliente.
+El lado BD sale de un GROUP BY sobre citas y detalle_financiero_cita.
+Solo las particiones que difieren se bajan a detalle por codigo_cita, y
+sus diferencias quedan en reconciliation_differences.csv.
+
+Las filas que el ETL rechaza (sin paciente, sin profesional, fecha o estado
+inválido) no se reconcilian: solo se cuentan por motivo.
+
+USO:
+    python 07_reconcile_csv_db.py --csv-path ./csv_exports
+
+    # Otra BD (p. ej. el ensayo de 02_etl_migration.py --target sqlite:///ensayo.db)
+    python 07_reconcile_csv_db.py --csv-path ./csv_exports --target sqlite:///ensayo.db
+
+    # Si la migración usó --name-threshold, el mismo valor
+    python 07_reconcile_csv_db.py --csv-path ./csv_exports --name-threshold 0.9
+"""
+
+import pandas as pd
+import numpy as np
+from sqlalchemy import create_engine, text, bindparam
+from pathlib import Path
+import importlib.util
+import argparse
+import logging
+import zlib
+import sys
+
+# =====================================================
+# CONFIGURACIÓN
+# =====================================================
+
+MIGRATION_DIR = Path(__file__).resolve().parent
+SOURCE_FILE = 'DB_ATENCIONES.csv'
+DIFFERENCES_PATH = 'reconciliation_differences.csv'
+DIFFERENCE_COLUMNS = ['mes', 'profesional', 'codigo_cita', 'problema', 'detalle']
+CHUNK_ROWS = 200000  # Filas por bloque al leer el CSV
+SHOWN_PARTITIONS = 20  # Particiones con diferencias que se listan en el log
+
+# Columna del CSV → columna de detalle_financiero_cita
+AMOUNT_COLUMNS = {
+    'INGRESO': 'precio_cobrado',
+    'PAGO ESPECIALISTA (LIQUIDO)': 'monto_profesional',
+    'UTILIDAD': 'monto_clinica',
+    'IMPUESTO': 'impuesto_retenido',
+}
+AMOUNTS = list(AMOUNT_COLUMNS.values())
+PARTITION = ['mes', 'profesional']
+
+def load_script(filename, name):
+    """Importa un script numerado de migration/ como módulo"""
+    spec = importlib.util.spec_from_file_location(name, MIGRATION_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+etl = load_script('02_etl_migration.py', 'etl_migration')
+
+logger = logging.getLogger('reconciliation')
+
+# =====================================================
+# HUELLAS POR FILA
+# =====================================================
+# Texto de cada cita: codigo|YYYY-MM-DD|precio|profesional|clínica|impuesto,
+# con '' para nulos. La hora no entra: MySQL la normaliza (09:00:00) y el
+# CSV no ('9:00'). Ambos lados calculan CRC32 sobre los bytes UTF-8.
+
+def crc32(value):
+    """CRC32 de un texto (función CRC32 de MySQL, registrada en SQLite)"""
+    return None if value is None else zlib.crc32(value.encode('utf-8'))
+
+def row_checksums(texts):
+    """CRC32 de cada texto de una columna"""
+    return np.fromiter((zlib.crc32(value.encode('utf-8')) for value in texts), dtype=np.int64, count=len(texts))
+
+def sql_expressions(dialect):
+    """Mes, día y texto por fila de una cita (citas c, detalle_financiero_cita d) en el dialecto de la BD"""
+    if dialect == 'mysql':
+        mes = "DATE_FORMAT(c.fecha_inicio, '%Y-%m')"
+        dia = "DATE_FORMAT(c.fecha_inicio, '%Y-%m-%d')"
+        as_text = "COALESCE(CAST({} AS CHAR), '')"
+        parts = [as_text.format('c.codigo_cita'), dia] + [as_text.format(f'd.{column}') for column in AMOUNTS]
+        return mes, dia, f"CONCAT_WS('|', {', '.join(parts)})"
+
+    # SQLite guarda la fecha como el texto que escribió el ETL ('2024-03-05 9:00:00')
+    mes = "substr(c.fecha_inicio, 1, 7)"
+    dia = "substr(c.fecha_inicio, 1, 10)"
+    as_text = "COALESCE(CAST({} AS TEXT), '')"
+    parts = [as_text.format('c.codigo_cita'), dia] + [as_text.format(f'd.{column}') for column in AMOUNTS]
+    return mes, dia, " || '|' || ".join(parts)
+
+# =====================================================
+# RESOLUCIÓN DE FKs (IGUAL QUE EL ETL)
+# =====================================================
+
+class CsvResolver:
+    """Paciente y profesional de cada fila de DB_ATENCIONES, con los mapas del ETL armados desde la BD
+    
+    Profesionales: NameMatcher sobre profesionales.nombres (mapa de la fase
+    staff). Pacientes: RutIndex de pacientes.rut y, si DB_CLIENTES trae
+    código de cliente, el CodeIndex con el paciente del RUT de su fila.
+    """
+    
+    def __init__(self, csv_path, engine, name_threshold=etl.NAME_MATCH_THRESHOLD):
+        with engine.connect() as conn:
+            profesionales = conn.execute(text(
+                "SELECT id_profesional, nombres FROM profesionales ORDER BY id_profesional")).fetchall()
+            pacientes = conn.execute(text("SELECT id_paciente, rut FROM pacientes WHERE rut IS NOT NULL")).fetchall()
+        self.matcher = etl.NameMatcher(dict((row[1], row[0]) for row in profesionales), name_threshold)
+        self.nombres = dict((row[0], row[1]) for row in profesionales)  # id → nombre de la partición en la BD
+        self.pacientes_rut = etl.RutIndex([row[1] for row in pacientes], [row[0] for row in pacientes])
+        self.pacientes_cod = etl.CodeIndex()
+        
+        clientes = Path(csv_path) / 'DB_CLIENTES.csv'
+        if clientes.exists():
+            df_clientes = etl.read_export(clientes, columns={'RUT', etl.CLIENT_CODE_COLUMN})
+            codigo = etl.clean_rut_series(etl.get_column(df_clientes, etl.CLIENT_CODE_COLUMN))
+            ids = self.pacientes_rut.lookup(etl.clean_rut_series(etl.get_column(df_clientes, 'RUT')))
+            con_codigo = codigo.notna() & ids.notna()
+            self.pacientes_cod = etl.CodeIndex(codigo[con_codigo], ids[con_codigo])
+    
+    def patients(self, codigo_cliente):
+        """id_paciente (Int64) de una columna de CODIGO CLIENTE limpia"""
+        id_paciente = self.pacientes_rut.lookup(codigo_cliente)
+        if len(self.pacientes_cod):
+            id_paciente = id_paciente.fillna(self.pacientes_cod.lookup(codigo_cliente))
+        return id_paciente
+    
+    def professionals(self, especialista):
+        """id_profesional (Int64) de una columna de ESPECIALISTA limpia"""
+        return self.matcher.lookup(especialista)
+
+# =====================================================
+# LADO CSV
+# =====================================================
+
+# Motivos de rechazo de ETLMigration.migrate_appointments_chunk, en su orden
+REJECTIONS = ['sin paciente', 'sin profesional', 'fecha inválida', 'estado inválido']
+
+def csv_rows(csv_path, resolver, chunk_rows=CHUNK_ROWS):
+    """Filas de DB_ATENCIONES que el ETL carga, con su partición y CRC32; retorna (filas, rechazadas por motivo)"""
+    filepath = Path(csv_path) / SOURCE_FILE
+    columns = {'ID_ATENCION', 'CODIGO CLIENTE', 'ESPECIALISTA', 'FECHA DE ATENCION', 'ID_ESTADO', *AMOUNT_COLUMNS}
+    reader = etl.read_export(filepath, chunk_rows=chunk_rows, columns=columns)
+
+    parts, rechazos = [], dict.fromkeys(REJECTIONS, 0)
+    for chunk in reader:
+        # Mismos limpiadores y resolución de FKs que ETLMigration.migrate_appointments_chunk
+        fecha = etl.parse_date_series(etl.get_column(chunk, 'FECHA DE ATENCION'))
+        id_paciente = resolver.patients(etl.clean_rut_series(etl.get_column(chunk, 'CODIGO CLIENTE')))
+        id_profesional = resolver.professionals(etl.clean_text_series(etl.get_column(chunk, 'ESPECIALISTA')))
+        estado_valido = (etl.parse_int_series(chunk['ID_ESTADO']).notna() if 'ID_ESTADO' in chunk.columns
+                         else pd.Series(True, index=chunk.index))
+
+        # Cada fila se rechaza por el primer motivo que aplique
+        rechazada = pd.Series(False, index=chunk.index)
+        for motivo, mask in zip(REJECTIONS, [id_paciente.isna(), id_profesional.isna(), fecha.isna(), ~estado_valido]):
+            mask = mask.fillna(False).astype(bool) & ~rechazada
+            rechazos[motivo] += int(mask.sum())
+            rechazada |= mask
+        cargada = ~rechazada
+
+        rows = pd.DataFrame({
+            'mes': fecha.str[:7],
+            'profesional': id_profesional.map(resolver.nombres),
+            'codigo_cita': etl.clean_text_series(etl.get_column(chunk, 'ID_ATENCION')),
+            'fecha': fecha,
+            **{column: etl.clean_number_series(etl.get_column(chunk, source))
+               for source, column in AMOUNT_COLUMNS.items()},
+        })[cargada]
+
+        row_text = rows['codigo_cita'].fillna('') + '|' + rows['fecha']
+        for column in AMOUNTS:
+            row_text = row_text + '|' + rows[column].astype(str)
+        rows['checksum'] = row_checksums(row_text.to_numpy(dtype=object))
+        parts.append(rows.drop(columns='fecha'))
+
+    rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=PARTITION + ['codigo_cita'] + AMOUNTS + ['checksum'])
+    return rows, rechazos
+
+def aggregate(rows):
+    """Filas, suma de CRC32 y sumas de montos por partición"""
+    grouped = rows.groupby(PARTITION, sort=False)
+    totals = grouped[['checksum'] + AMOUNTS].sum().astype('int64')
+    totals.insert(0, 'filas', grouped.size())
+    return totals
+
+# =====================================================
+# LADO BD
+# =====================================================
+
+class DatabaseSide:
+    """Agregados y filas de citas + detalle_financiero_cita en la BD migrada"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.mes, self.dia, self.row_text = sql_expressions(engine.dialect.name)
+    
+    def connect(self):
+        """Conexión del pool; en SQLite con CRC32 registrada (la conexión pudo abrirse antes)"""
+        conn = self.engine.connect()
+        if self.engine.dialect.name == 'sqlite':
+            conn.connection.driver_connection.create_function('CRC32', 1, crc32, deterministic=True)
+        return conn
+
+    def query(self, sql, params=None):
+        """DataFrame con el resultado, leído con cursor del lado del servidor"""
+        with self.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(text(sql), params or {})
+            return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    def aggregate(self):
+        """Filas, suma de CRC32 y sumas de montos por partición, con un solo GROUP BY"""
+        sums = ', '.join(f"SUM(d.{column}) AS {column}" for column in AMOUNTS)
+        df = self.query(f'''
+            SELECT {self.mes} AS mes, COALESCE(pr.nombres, '') AS profesional,
+                   COUNT(*) AS filas, SUM(CRC32({self.row_text})) AS checksum, {sums}
+            FROM citas c
+            LEFT JOIN profesionales pr ON c.id_profesional = pr.id_profesional
+            LEFT JOIN detalle_financiero_cita d ON d.id_cita = c.id_cita
+            GROUP BY mes, profesional
+        ''')
+        # MySQL retorna DECIMAL en las sumas; sin detalle financiero la suma es NULL
+        totals = df.set_index(PARTITION)
+        return totals.fillna(0).astype('int64')
+
+    def rows(self, partitions):
+        """Filas de las particiones indicadas, con una consulta por mes
+        
+        El rango de fechas del mes usa el índice de citas.fecha_inicio; los
+        profesionales del mes se filtran con IN.
+        """
+        amounts = ', '.join(f"d.{column}" for column in AMOUNTS)
+        query = text(f'''
+            SELECT {self.mes} AS mes, COALESCE(pr.nombres, '') AS profesional, c.codigo_cita, {amounts},
+                   CRC32({self.row_text}) AS checksum, {self.dia} AS fecha
+            FROM citas c
+            LEFT JOIN profesionales pr ON c.id_profesional = pr.id_profesional
+            LEFT JOIN detalle_financiero_cita d ON d.id_cita = c.id_cita
+            WHERE c.fecha_inicio >= :desde AND c.fecha_inicio < :hasta
+              AND COALESCE(pr.nombres, '') IN :profesionales
+        ''').bindparams(bindparam('profesionales', expanding=True))
+        
+        parts = []
+        with self.connect() as conn:
+            conn = conn.execution_options(stream_results=True)
+            for mes, profesionales in partitions.to_frame(index=False).groupby('mes')['profesional']:
+                year, month = map(int, mes.split('-'))
+                hasta = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+                result = conn.execute(query, {'desde': f"{mes}-01", 'hasta': hasta,
+                                              'profesionales': list(profesionales)})
+                parts.append(pd.DataFrame(result.fetchall(), columns=list(result.keys())))
+        return pd.concat(parts, ignore_index=True)
+
+# =====================================================
+# RECONCILIACIÓN
+# =====================================================
+
+def compare_partitions(csv_totals, db_totals):
+    """Une ambos lados por partición; retorna (todas, las que difieren)"""
+    merged = csv_totals.join(db_totals, how='outer', lsuffix='_csv', rsuffix='_bd').fillna(0).astype('int64')
+    differ = np.zeros(len(merged), dtype=bool)
+    for column in ['filas', 'checksum'] + AMOUNTS:
+        differ |= (merged[f'{column}_csv'] != merged[f'{column}_bd']).to_numpy()
+    return merged, merged[differ]
+
+def numbered(df, keys):
+    """Agrega n: ocurrencia de cada valor de keys, para calzar repeticiones 1 a 1"""
+    return df.assign(n=df.groupby(keys, sort=False).cumcount())
+
+def drill_down(csv_part, db_part):
+    """Diferencias por codigo_cita dentro de las particiones de csv_part y db_part
+    
+    Primero se descartan las filas idénticas en ambos lados (misma partición,
+    código y CRC32, contando repeticiones). Lo que queda con el mismo código es
+    una cita distinta y el resto está solo en un lado; las filas sin código
+    solo calzan por CRC32.
+    """
+    differences = []
+    value = lambda v: '' if pd.isna(v) else int(v)  # El outer merge deja los montos en float
+    amounts = lambda row, suffix='': ', '.join(f"{column}={value(row[column + suffix])}" for column in AMOUNTS)
+    add = lambda row, problema, detalle: differences.append(
+        {'mes': row['mes'], 'profesional': row['profesional'], 'codigo_cita': row['codigo_cita'] or None,
+         'problema': problema, 'detalle': detalle})
+
+    # '' en vez de nulo: los nulos no calzan entre sí en los índices
+    same = PARTITION + ['codigo_cita', 'checksum']
+    csv_part = numbered(csv_part.assign(codigo_cita=csv_part['codigo_cita'].fillna('')), same)
+    db_part = numbered(db_part.assign(codigo_cita=db_part['codigo_cita'].fillna(''),
+                                      checksum=db_part['checksum'].astype('int64')), same)
+    keys = same + ['n']
+    csv_rest = csv_part[~csv_part.set_index(keys).index.isin(db_part.set_index(keys).index)]
+    db_rest = db_part[~db_part.set_index(keys).index.isin(csv_part.set_index(keys).index)]
+
+    # Las que quedan con el mismo código (no vacío) se comparan columna a columna
+    by_code = PARTITION + ['codigo_cita']
+    pairs = numbered(csv_rest[csv_rest['codigo_cita'] != ''].drop(columns='n'), by_code).merge(
+        numbered(db_rest[db_rest['codigo_cita'] != ''].drop(columns='n'), by_code),
+        on=by_code + ['n'], how='outer', suffixes=('_csv', '_bd'), indicator='origen')
+
+    for row in pairs.to_dict('records'):
+        if row['origen'] == 'left_only':
+            add(row, 'solo en CSV', amounts(row, '_csv'))
+        elif row['origen'] == 'right_only':
+            add(row, 'solo en BD', amounts(row, '_bd'))
+        else:
+            cambios = [f"{column}: CSV {value(row[f'{column}_csv'])} ≠ BD {value(row[f'{column}_bd'])}"
+                       for column in AMOUNTS if value(row[f'{column}_csv']) != value(row[f'{column}_bd'])]
+            add(row, 'distinta', '; '.join(cambios) or f"fecha: BD {row['fecha']}")
+    for rest, problema in [(csv_rest, 'solo en CSV'), (db_rest, 'solo en BD')]:
+        for row in rest[rest['codigo_cita'] == ''].to_dict('records'):
+            add(row, problema, amounts(row))
+    return pd.DataFrame(differences, columns=DIFFERENCE_COLUMNS).sort_values(
+        ['mes', 'profesional', 'codigo_cita'], na_position='last', kind='stable')
+
+def reconcile(csv_path, engine, differences_path=DIFFERENCES_PATH, chunk_rows=CHUNK_ROWS,
+              name_threshold=etl.NAME_MATCH_THRESHOLD):
+    """Reconcilia DB_ATENCIONES.csv con la BD; retorna True si todas las particiones coinciden"""
+    logger.info(f"Leyendo {SOURCE_FILE} con los limpiadores y mapas del ETL...")
+    rows, rechazos = csv_rows(csv_path, CsvResolver(csv_path, engine, name_threshold), chunk_rows)
+    csv_totals = aggregate(rows)
+    logger.info(f"  ✓ {len(rows):,} filas en {len(csv_totals):,} particiones (mes, profesional)")
+    for motivo, cantidad in rechazos.items():
+        if cantidad:
+            logger.warning(f"  ⚠ {motivo}: {cantidad:,} filas (el ETL las rechaza; no se reconcilian)")
+
+    logger.info("Agregando citas y detalle_financiero_cita en la BD...")
+    database = DatabaseSide(engine)
+    db_totals = database.aggregate()
+    logger.info(f"  ✓ {int(db_totals['filas'].sum()):,} citas en {len(db_totals):,} particiones")
+
+    merged, differ = compare_partitions(csv_totals, db_totals)
+    logger.info(f"\n✓ {len(merged) - len(differ):,}/{len(merged):,} particiones coinciden")
+    if differ.empty:
+        logger.info("  ✓ Filas, montos y huellas cuadran en todas las particiones")
+        return True
+
+    logger.warning(f"⚠ {len(differ):,} particiones con diferencias:")
+    for (mes, profesional), row in differ.head(SHOWN_PARTITIONS).iterrows():
+        logger.warning(f"     - {mes} {profesional or '(sin profesional)'}: "
+                       f"{row['filas_csv']} filas CSV / {row['filas_bd']} BD, "
+                       f"ingreso {row['precio_cobrado_csv']:,} / {row['precio_cobrado_bd']:,}")
+    if len(differ) > SHOWN_PARTITIONS:
+        logger.warning(f"     ... y {len(differ) - SHOWN_PARTITIONS} más")
+
+    # Detalle solo de las particiones que difieren
+    logger.info("\nBajando a detalle las particiones con diferencias...")
+    csv_part = rows[rows.set_index(PARTITION).index.isin(differ.index)]
+    report = drill_down(csv_part, database.rows(differ.index))
+    report.to_csv(differences_path, index=False, encoding='utf-8')
+    for problema, cantidad in report['problema'].value_counts().items():
+        logger.warning(f"  ⚠ {problema}: {cantidad:,} citas")
+    logger.info(f"  Detalle en {differences_path}")
+    return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reconciliación de DB_ATENCIONES.csv con la BD migrada')
+    parser.add_argument('--csv-path', default='./csv_exports', help='Ruta a los archivos CSV')
+    parser.add_argument('--db-host', default='localhost', help='Host de MySQL')
+    parser.add_argument('--db-user', default='root', help='Usuario de MySQL')
+    parser.add_argument('--db-password', default='', help='Password de MySQL')
+    parser.add_argument('--target', default=None, metavar='URL',
+                        help='BD SQLAlchemy a reconciliar en vez de MySQL (p. ej. sqlite:///ensayo.db)')
+    parser.add_argument('--differences', default=DIFFERENCES_PATH,
+                        help='CSV con las diferencias por cita')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Filas por bloque al leer el CSV')
+    parser.add_argument('--name-threshold', type=float, default=etl.NAME_MATCH_THRESHOLD,
+                        help='Similitud mínima de ESPECIALISTA (la misma de la migración)')
+    args = parser.parse_args()
+    etl.configure_logging(None)  # Solo consola: la reconciliación no escribe en migration.log
+    logger.setLevel(logging.INFO)
+
+    if not (Path(args.csv_path) / SOURCE_FILE).exists():
+        logger.error(f"✗ No existe {Path(args.csv_path) / SOURCE_FILE}")
+        sys.exit(1)
+
+    connection_string = args.target or (
+        f"mysql+pymysql://{args.db_user}:{args.db_password}@{args.db_host}:{etl.DB_CONFIG['port']}/"
+        f"{etl.DB_CONFIG['database']}?charset=utf8mb4")
+    engine = create_engine(connection_string, echo=False)
+
+    print("="*60)
+    print("RECONCILIACIÓN CSV ↔ BD - Clínica Equilibrar ERP")
+    print("="*60)
+    success = reconcile(args.csv_path, engine, args.differences, args.chunk_rows, args.name_threshold)
+    sys.exit(0 if success else 1)
@@ -23,7 +23,7 @@ $MYSQL_DB = "clinica_equilibrar_erp"
 Write-Host "[PASO 0] Verificando pre-requisitos..." -ForegroundColor Yellow
 Write-Host ""
 
-python "$MIGRATION_DIR/03_pre_migration_validator.py"
+python "$MIGRATION_DIR/03_pre_migration_validator.py" --csv-path $CSV_DIR
 
 if ($LASTEXITCODE -ne 0) {
     Write-Host ""
@@ -0,0 +1,60 @@
+"""
+Fixtures compartidas: scripts numerados de migration/ como módulos, datos
+sintéticos (05_generate_synthetic_data.py) y migraciones a SQLite.
+"""
+
+from pathlib import Path
+import importlib.util
+import os
+import sys
+
+import pytest
+
+MIGRATION_DIR = Path(__file__).resolve().parent.parent
+SYNTHETIC_ROWS = 3000  # Filas de DB_ATENCIONES de los datos sintéticos
+
+def load_script(filename, name):
+    """Importa un script numerado de migration/ como módulo (una sola vez por sesión)"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, MIGRATION_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture(scope='session')
+def etl():
+    return load_script('02_etl_migration.py', 'etl_migration')
+
+@pytest.fixture(scope='session')
+def synthetic_csv(tmp_path_factory):
+    """Carpeta con los 4 CSVs sintéticos (con la suciedad por defecto)"""
+    generator = load_script('05_generate_synthetic_data.py', 'synthetic_data')
+    output = tmp_path_factory.mktemp('csv_synthetic')
+    generator.generate(output, SYNTHETIC_ROWS, seed=7)
+    return output
+
+@pytest.fixture(scope='session')
+def migrate(etl, synthetic_csv, tmp_path_factory):
+    """migrate(transform='pandas', **opciones): migra los datos sintéticos a un SQLite nuevo; retorna su URL"""
+    def run(transform='pandas', **options):
+        workdir = tmp_path_factory.mktemp(f'migracion_{transform}')
+        target = f"sqlite:///{workdir / 'migracion.db'}"
+        migration_class = etl.StagedETLMigration if transform == 'sql' else etl.ETLMigration
+        cwd = os.getcwd()
+        os.chdir(workdir)  # Métricas y reportes de la corrida quedan junto a la BD
+        try:
+            migration = migration_class(synthetic_csv, target, bcrypt_rounds=4, hash_workers=1,
+                                        journal_path=workdir / etl.JOURNAL_PATH, **options)
+            assert migration.run_migration()
+            migration.engine.dispose()
+        finally:
+            os.chdir(cwd)
+        return target
+    return run
+
+@pytest.fixture(scope='session')
+def migrated_db(migrate):
+    """URL del SQLite con la migración de los datos sintéticos (transform pandas)"""
+    return migrate()
@@ -0,0 +1,12 @@
+"""Benchmark del ETL (06_benchmark_etl.py)"""
+
+import subprocess
+import sys
+
+from conftest import MIGRATION_DIR
+
+def test_benchmark_only_writes_results_and_data(tmp_path):
+    # Los reportes de revisión y las métricas de cada repetición quedan en su carpeta temporal
+    subprocess.run([sys.executable, str(MIGRATION_DIR / '06_benchmark_etl.py'), '--sizes', '1000'],
+                   cwd=tmp_path, check=True, capture_output=True)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['benchmark_data', 'benchmark_results.csv']
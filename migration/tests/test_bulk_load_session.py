@@ -0,0 +1,53 @@
+"""Sesión de carga (--commit-rows) con el writer bulk (LOAD DATA)"""
+
+from sqlalchemy import create_engine, text
+
+import pandas as pd
+import pytest
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'carga.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE filas (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT, monto INT)"))
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def writer_class(etl):
+    class FileInsertWriter(etl.LoadDataWriter):
+        """LoadDataWriter con la carga del archivo traducida a INSERT (SQLite no tiene LOAD DATA)
+
+        Todo lo demás (archivo temporal, ejecución, transacción) es el camino de LOAD DATA.
+        """
+
+        def load_statement(self, path, table, columns):
+            literal = lambda value: 'NULL' if value == '\\N' else "'" + value.replace("'", "''") + "'"
+            rows = [line.split('\t') for line in path.read_text(encoding='utf-8').splitlines()]
+            values = ', '.join('(' + ', '.join(map(literal, row)) + ')' for row in rows)
+            return f"INSERT INTO {table} ({columns.replace('`', '')}) VALUES {values}"
+    return FileInsertWriter
+
+def count(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM filas")).scalar()
+
+def rows(n, start=0):
+    return pd.DataFrame({'nombre': [f"fila {i}" for i in range(start, start + n)], 'monto': range(start, start + n)})
+
+def test_worker_commit_keeps_rows(etl, engine, writer_class):
+    # Un proceso de --workers escribe sin otra sentencia antes y confirma con commit_session()
+    session = etl.BulkLoadSession(engine, commit_rows=1000)
+    writer = writer_class(engine, batch_rows=2, session=session)
+    assert writer.write(rows(5), 'filas') == 5
+    session.commit()
+    session.close(commit=False)  # Lo no confirmado se descarta al terminar el pool
+    assert count(engine) == 5
+
+def test_writes_after_a_mid_chunk_commit_are_kept(etl, engine, writer_class):
+    session = etl.BulkLoadSession(engine, commit_rows=3)
+    writer = writer_class(engine, batch_rows=2, session=session)
+    session.wrote(writer.write(rows(4), 'filas'))  # Llega a commit_rows: COMMIT
+    session.wrote(writer.write(rows(2, start=4), 'filas'))  # Queda pendiente hasta close()
+    session.close()
+    assert count(engine) == 6
@@ -0,0 +1,92 @@
+"""Migración ETL (02_etl_migration.py) sobre datos sintéticos"""
+
+import shutil
+import subprocess
+import sys
+
+from sqlalchemy import create_engine, inspect, make_url, text
+
+import pytest
+
+from conftest import MIGRATION_DIR
+
+# Columnas que dependen del momento de la corrida o de la sal de bcrypt
+VOLATILE_COLUMNS = {'fecha_registro', 'fecha_creacion', 'fecha_modificacion', 'password_hash'}
+MIGRATED_TABLES = ['comunas', 'previsiones', 'especialidades', 'pacientes', 'usuarios', 'profesionales',
+                   'servicios', 'citas', 'detalle_financiero_cita', 'pagos', 'ficha_clinica']
+
+def table_rows(url, table):
+    """Filas de una tabla sin las columnas volátiles, ordenadas"""
+    engine = create_engine(url)
+    try:
+        columns = [column['name'] for column in inspect(engine).get_columns(table)
+                   if column['name'] not in VOLATILE_COLUMNS]
+        with engine.connect() as conn:
+            return columns, sorted(conn.execute(text(f"SELECT {', '.join(columns)} FROM {table}")).fetchall(),
+                                   key=repr)
+    finally:
+        engine.dispose()
+
+@pytest.fixture(scope='module')
+def staged_db(migrate):
+    """URL del SQLite con la migración de los datos sintéticos (--transform sql)"""
+    return migrate('sql')
+
+@pytest.mark.parametrize('table', MIGRATED_TABLES)
+def test_sql_transform_matches_pandas(migrated_db, staged_db, table):
+    columns, expected = table_rows(migrated_db, table)
+    _, rows = table_rows(staged_db, table)
+    assert len(rows) == len(expected)
+    differ = [(row, other) for row, other in zip(rows, expected) if row != other]
+    assert not differ, f"{table} ({', '.join(columns)}): {differ[:3]}"
+
+def test_client_codes_are_rebuilt_from_the_database(etl, synthetic_csv, migrated_db, tmp_path):
+    # Sin almacén de mapas (--resume sin _maps/, --delta), el código de cliente sale de DB_CLIENTES + pacientes.rut
+    df_clientes = etl.read_export(synthetic_csv / 'DB_CLIENTES.csv')
+    df_clientes[etl.CLIENT_CODE_COLUMN] = [f"CLI{i:05d}" for i in range(len(df_clientes))]
+    df_clientes.to_csv(tmp_path / 'DB_CLIENTES.csv', index=False)
+    migration = etl.ETLMigration(tmp_path, migrated_db, journal_path=tmp_path / etl.JOURNAL_PATH)
+    migration.load_maps_from_db('patients')
+    
+    rut = etl.clean_rut_series(df_clientes['RUT'])
+    expected = migration.maps['pacientes_rut'].lookup(rut)
+    found = migration.maps['pacientes_cod'].lookup(etl.clean_rut_series(df_clientes[etl.CLIENT_CODE_COLUMN]))
+    assert expected.notna().sum() > 0
+    assert found[expected.notna()].equals(expected[expected.notna()])
+    migration.engine.dispose()
+
+def test_delta_does_not_retry_unchanged_rejections(etl, synthetic_csv, migrated_db, tmp_path, monkeypatch):
+    csv_path = tmp_path / 'csv'
+    shutil.copytree(synthetic_csv, csv_path)
+    database = tmp_path / 'delta.db'
+    shutil.copy(make_url(migrated_db).database, database)
+    monkeypatch.chdir(tmp_path)
+    
+    def sync():
+        migration = etl.ETLMigration(csv_path, f"sqlite:///{database}", journal_path=tmp_path / etl.JOURNAL_PATH)
+        assert migration.sync_delta()
+        migration.engine.dispose()
+        return sum(migration.rejections.values())
+    
+    # Sin cambios en los CSVs no se reprocesa nada, tampoco las citas rechazadas
+    assert sync() == 0
+    
+    # Una cita rechazada se reintenta cuando cambia su fila
+    df = etl.read_export(csv_path / 'DB_ATENCIONES.csv')
+    engine = create_engine(f"sqlite:///{database}")
+    with engine.connect() as conn:
+        rejected = conn.execute(text("SELECT clave FROM etl_fingerprints "
+                                     "WHERE fuente = 'DB_ATENCIONES.csv' AND rechazada = 1")).scalars().all()
+    engine.dispose()
+    assert rejected
+    df.loc[df['ID_ATENCION'] == rejected[0], 'OBSERVACION'] = 'Observación corregida'
+    df.to_csv(csv_path / 'DB_ATENCIONES.csv', index=False)
+    assert sync() == 1
+    assert sync() == 0
+
+def test_import_does_not_create_migration_log(tmp_path):
+    # Validador, benchmark y reconciliación importan el ETL: solo ejecutarlo escribe migration.log
+    subprocess.run([sys.executable, '-c', "import importlib.util as u; "
+                    f"s = u.spec_from_file_location('etl_migration', {str(MIGRATION_DIR / '02_etl_migration.py')!r}); "
+                    "s.loader.exec_module(u.module_from_spec(s))"], cwd=tmp_path, check=True)
+    assert not (tmp_path / 'migration.log').exists()
@@ -0,0 +1,115 @@
+"""Exportación de hojas a CSV (00_export_sheets_to_csv.py) contra un servidor HTTP local"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+
+import pytest
+
+from conftest import load_script
+
+SHEETS = {'DB_CLIENTES': 'DB_CLIENTES.csv', 'DB_SERVICIOS': 'DB_SERVICIOS.csv'}
+
+@pytest.fixture(scope='module')
+def exporter():
+    return load_script('00_export_sheets_to_csv.py', 'export_sheets')
+
+class SheetServer(ThreadingHTTPServer):
+    """Sirve cada hoja como /<nombre> con ETag y Last-Modified; responde 304 a las peticiones condicionales vigentes"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SheetHandler)
+        self.sheets = {}  # nombre → (cuerpo, etag, last_modified)
+        self.requests = []  # (nombre, status) de cada petición
+
+    def publish(self, name, body, version):
+        self.sheets[name] = (body.encode('utf-8'), f'"v{version}"', f'Mon, 0{version} Jan 2024 00:00:00 GMT')
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+class SheetHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        if name not in self.server.sheets:
+            status = 404
+            self.send_error(404)
+        else:
+            body, etag, last_modified = self.server.sheets[name]
+            fresh = (self.headers.get('If-None-Match') == etag
+                     or self.headers.get('If-Modified-Since') == last_modified)
+            status = 304 if fresh else 200
+            self.send_response(status)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            if fresh:
+                self.end_headers()
+            else:
+                self.send_header('Content-Type', 'text/csv; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        self.server.requests.append((name, status))
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = SheetServer()
+    server.publish('DB_CLIENTES', 'RUT,NOMBRES\n11111111-1,Ana\n', 1)
+    server.publish('DB_SERVICIOS', 'ID_SERVICIO,NOMBRE\nSRV001,Terapia\n', 1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def export(exporter, server, tmp_path):
+    """export(force=False): exporta SHEETS desde el servidor a tmp_path; retorna el estado por hoja"""
+    def run(force=False):
+        server.requests.clear()
+        return exporter.export_sheets(SHEETS, base_url=server.base_url, output_dir=tmp_path, force=force)
+    return run
+
+def test_first_export_downloads_every_sheet(exporter, export, server, tmp_path):
+    assert export() == {'DB_CLIENTES': 'descargada', 'DB_SERVICIOS': 'descargada'}
+    assert (tmp_path / 'DB_CLIENTES.csv').read_text(encoding='utf-8') == 'RUT,NOMBRES\n11111111-1,Ana\n'
+    assert sorted(server.requests) == [('DB_CLIENTES', 200), ('DB_SERVICIOS', 200)]
+    cache = exporter.load_cache(tmp_path)
+    assert cache['DB_CLIENTES'] == {'etag': '"v1"', 'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    assert not list(tmp_path.glob('*.part'))
+
+def test_unchanged_sheet_is_not_rewritten(export, server, tmp_path):
+    export()
+    path = tmp_path / 'DB_CLIENTES.csv'
+    os.utime(path, ns=(10**9, 10**9))  # Una reescritura cambiaría el mtime
+    assert export() == {'DB_CLIENTES': 'sin cambios', 'DB_SERVICIOS': 'sin cambios'}
+    assert sorted(server.requests) == [('DB_CLIENTES', 304), ('DB_SERVICIOS', 304)]
+    assert path.stat().st_mtime_ns == 10**9
+    assert path.read_text(encoding='utf-8') == 'RUT,NOMBRES\n11111111-1,Ana\n'
+
+def test_changed_sheet_is_downloaded_again(exporter, export, server, tmp_path):
+    export()
+    server.publish('DB_CLIENTES', 'RUT,NOMBRES\n11111111-1,Ana\n22222222-2,Luis\n', 2)
+    assert export() == {'DB_CLIENTES': 'descargada', 'DB_SERVICIOS': 'sin cambios'}
+    assert (tmp_path / 'DB_CLIENTES.csv').read_text(encoding='utf-8').endswith('22222222-2,Luis\n')
+    assert exporter.load_cache(tmp_path)['DB_CLIENTES']['etag'] == '"v2"'
+
+def test_force_downloads_unchanged_sheets(export, server):
+    export()
+    assert export(force=True) == {'DB_CLIENTES': 'descargada', 'DB_SERVICIOS': 'descargada'}
+    assert sorted(server.requests) == [('DB_CLIENTES', 200), ('DB_SERVICIOS', 200)]
+
+def test_failed_download_keeps_previous_csv_and_cache(export, server, tmp_path):
+    export()
+    csv_before = (tmp_path / 'DB_CLIENTES.csv').read_bytes()
+    cache_before = (tmp_path / '.export_cache.json').read_bytes()
+    del server.sheets['DB_CLIENTES']
+    assert export(force=True) == {'DB_CLIENTES': None, 'DB_SERVICIOS': 'descargada'}
+    assert ('DB_CLIENTES', 404) in server.requests
+    assert (tmp_path / 'DB_CLIENTES.csv').read_bytes() == csv_before
+    assert (tmp_path / '.export_cache.json').read_bytes() == cache_before
+    assert not list(tmp_path.glob('*.part'))
@@ -0,0 +1,41 @@
+"""Perfil de los CSVs (03_pre_migration_validator.py)"""
+
+import pandas as pd
+
+import pytest
+
+from conftest import load_script
+
+@pytest.fixture(scope='module')
+def validator():
+    return load_script('03_pre_migration_validator.py', 'pre_migration_validator')
+
+def with_check_digit(etl, body):
+    dv = int(etl.rut_check_digit([body])[0])
+    return f"{body}-{'K' if dv == 10 else dv}"
+
+def problems(profile):
+    exceptions = profile['excepciones']
+    if exceptions is None:
+        return {}
+    return dict(zip(exceptions['valor'], exceptions['problema']))
+
+def test_rut_format_follows_the_etl(validator, etl, tmp_path):
+    # Cuerpos de 6 y 10 dígitos: el ETL los carga como RUT numérico
+    short, long = with_check_digit(etl, 999999), with_check_digit(etl, 1234567890)
+    path = tmp_path / 'DB_CLIENTES.csv'
+    pd.DataFrame({'RUT': [short, long, '12345678-9X', '0012345678']}).to_csv(path, index=False)
+    found = problems(validator.profile_csv(path))
+    assert short not in found and long not in found
+    assert found['12345678-9X'] == 'RUT con formato inválido'
+    assert found['0012345678'] == 'RUT con formato inválido'
+
+def test_thousands_dot_amounts_are_flagged(validator, tmp_path):
+    path = tmp_path / 'DB_ATENCIONES.csv'
+    pd.DataFrame({'INGRESO': ['$28.000', '$28,000', '28000', '1.234.567', 'gratis']}).to_csv(path, index=False)
+    exceptions = validator.profile_csv(path)['excepciones'].set_index('valor')
+    assert exceptions.loc['$28.000', 'problema'] == 'monto con punto de miles'
+    assert exceptions.loc['$28.000', 'detalle'] == 'el ETL carga 28'
+    assert exceptions.loc['1.234.567', 'problema'] == 'monto con punto de miles'
+    assert exceptions.loc['gratis', 'problema'] == 'monto no numérico'
+    assert '$28,000' not in exceptions.index and '28000' not in exceptions.index
@@ -0,0 +1,41 @@
+"""Reconciliación CSV ↔ BD (07_reconcile_csv_db.py)"""
+
+from sqlalchemy import create_engine, text
+
+import pytest
+
+from conftest import load_script
+
+@pytest.fixture(scope='module')
+def reconciliation():
+    return load_script('07_reconcile_csv_db.py', 'reconciliation')
+
+def test_clean_migration_has_no_differences(reconciliation, synthetic_csv, migrated_db, tmp_path):
+    differences = tmp_path / 'differences.csv'
+    engine = create_engine(migrated_db)
+    assert reconciliation.reconcile(synthetic_csv, engine, differences)
+    assert not differences.exists()
+
+def test_rejected_rows_are_counted_apart(reconciliation, synthetic_csv, migrated_db):
+    engine = create_engine(migrated_db)
+    rows, rechazos = reconciliation.csv_rows(synthetic_csv, reconciliation.CsvResolver(synthetic_csv, engine))
+    with engine.connect() as conn:
+        citas = conn.execute(text("SELECT COUNT(*) FROM citas")).scalar()
+    # Los datos sintéticos traen pacientes y profesionales desconocidos: se rechazan, no son diferencias
+    assert rechazos['sin paciente'] and rechazos['sin profesional']
+    assert len(rows) == citas
+
+def test_changed_amount_is_reported(reconciliation, synthetic_csv, migrated_db, tmp_path):
+    engine = create_engine(migrated_db)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE detalle_financiero_cita SET precio_cobrado = precio_cobrado + 1 "
+                          "WHERE id_finanza = (SELECT MIN(id_finanza) FROM detalle_financiero_cita)"))
+    try:
+        differences = tmp_path / 'differences.csv'
+        assert not reconciliation.reconcile(synthetic_csv, engine, differences)
+        report = differences.read_text(encoding='utf-8').splitlines()
+        assert len(report) == 2 and ',distinta,' in report[1]
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE detalle_financiero_cita SET precio_cobrado = precio_cobrado - 1 "
+                              "WHERE id_finanza = (SELECT MIN(id_finanza) FROM detalle_financiero_cita)"))